@@ -1,5 +1,6 @@
 from django.core.management.base import BaseCommand
-from billing.services import HourlyBillingService
+from billing.services import HourlyBillingService, BulkHourlyBillingService
+from grandvps.locks import DistributedLock, LockNotAcquired
 
 
 class Command(BaseCommand):
@@ -10,7 +11,13 @@ class Command(BaseCommand):
             '--hours',
             type=int,
             default=1,
-            help='Number of hours to bill for (default: 1)',
+            help='Bill every hour not yet billed within the last N hours (default: 1, the current hour)',
+        )
+        parser.add_argument(
+            '--shards',
+            type=int,
+            default=1,
+            help='Split users into N user-id ranges and bill each in its own Celery task (default: 1, in-process)',
         )
         parser.add_argument(
             '--dry-run',
@@ -21,9 +28,10 @@ class Command(BaseCommand):
     def handle(self, *args, **options):
         hours = options['hours']
         dry_run = options['dry_run']
+        shards = options['shards']
 
         self.stdout.write(
-            self.style.SUCCESS(f'Starting hourly billing process for {hours} hour(s)...')
+            self.style.SUCCESS(f'Starting hourly billing process for the last {hours} hour(s)...')
         )
 
         if dry_run:
@@ -31,7 +39,15 @@ class Command(BaseCommand):
                 self.style.WARNING('DRY RUN MODE - No actual billing will occur')
             )
 
-        results = HourlyBillingService.process_hourly_billing_for_all_users(hours)
+        if shards > 1:
+            self.stdout.write(f'Fanning out billing across {shards} Celery shards...')
+
+        try:
+            with DistributedLock(BulkHourlyBillingService.LOCK_NAME) as lock:
+                results = HourlyBillingService.process_hourly_billing_for_all_users(hours, shards=shards, lock=lock)
+        except LockNotAcquired:
+            self.stdout.write(self.style.WARNING('Another billing run is in progress, skipping'))
+            return
 
         successful_billings = 0
         failed_billings = 0
@@ -0,0 +1,30 @@
+# Generated by Django 5.2.18 on 2026-10-17 12:06
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('billing', '0002_invoice'),
+        ('vps', '0001_initial'),
+        ('wallet', '0002_transaction_reference_id_transaction_status'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='BillingPeriod',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('period_start', models.DateTimeField()),
+                ('amount', models.DecimalField(decimal_places=2, max_digits=10)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('instance', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='billing_periods', to='vps.vpsinstance')),
+                ('transaction', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, to='wallet.transaction')),
+            ],
+            options={
+                'constraints': [models.UniqueConstraint(fields=('instance', 'period_start'), name='unique_billing_period')],
+            },
+        ),
+    ]
@@ -0,0 +1,34 @@
+# Generated by Django 5.2.18 on 2026-10-17 12:11
+
+import django.db.models.deletion
+import django.utils.timezone
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('billing', '0004_notificationoutbox'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='NotificationEvent',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('event_type', models.CharField(choices=[('hourly_billing', 'Hourly Billing'), ('low_balance', 'Low Balance'), ('payment_due', 'Payment Due'), ('renewal_success', 'Renewal Successful'), ('renewal_failure', 'Renewal Failed')], max_length=20)),
+                ('dedupe_key', models.CharField(blank=True, max_length=100, null=True)),
+                ('summary', models.CharField(max_length=255)),
+                ('amount', models.DecimalField(blank=True, decimal_places=2, max_digits=10, null=True)),
+                ('created_at', models.DateTimeField(default=django.utils.timezone.now)),
+                ('digested_at', models.DateTimeField(blank=True, null=True)),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'indexes': [models.Index(fields=['digested_at', 'user'], name='billing_event_pending_idx')],
+                'constraints': [models.UniqueConstraint(condition=models.Q(('digested_at__isnull', True)), fields=('user', 'event_type', 'dedupe_key'), name='unique_pending_notification_event')],
+            },
+        ),
+    ]
@@ -0,0 +1,19 @@
+# Generated by Django 5.2.18 on 2026-10-17 12:35
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('billing', '0005_notificationevent'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='invoice',
+            index=models.Index(fields=['user', '-issued_date'], name='billing_invoice_recent_idx'),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.18 on 2026-10-17 13:07
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('billing', '0008_invoice_recent_idx_id'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='notificationevent',
+            name='event_type',
+            field=models.CharField(choices=[('hourly_billing', 'Hourly Billing'), ('low_balance', 'Low Balance'), ('payment_due', 'Payment Due'), ('renewal_success', 'Renewal Successful'), ('renewal_failure', 'Renewal Failed'), ('expiry_warning', 'Expiry Warning')], max_length=20),
+        ),
+    ]
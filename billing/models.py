@@ -1,6 +1,9 @@
-from django.db import models
+from django.db import models, transaction, connection, IntegrityError
+from django.db.models import F
 from django.contrib.auth.models import User
+from django.utils import timezone
 from decimal import Decimal
+from .pricing import PricingTable
 
 # Create your models here.
 
@@ -41,6 +44,70 @@ class BillingCycle(models.Model):
         self.save()
 
 
+class InvoiceSequence(models.Model):
+    """Per-day invoice number counter.
+
+    Numbers are allocated by incrementing last_number in a single UPDATE, so
+    concurrent allocators never see the same value and the cost does not
+    grow with the number of invoices issued that day.
+    """
+
+    day = models.DateField(primary_key=True)
+    last_number = models.PositiveIntegerField(default=0)
+
+    def __str__(self):
+        return f"{self.day}: {self.last_number}"
+
+    @classmethod
+    def reserve(cls, day, count=1):
+        """Reserve `count` numbers for a day and return them as a range"""
+        if count < 1:
+            raise ValueError("count must be positive")
+
+        with transaction.atomic():
+            last = cls._increment(day, count)
+            if last is None:
+                cls._create(day)
+                last = cls._increment(day, count)
+        return range(last - count + 1, last + 1)
+
+    @classmethod
+    def _increment(cls, day, count):
+        """Bump the counter and return the new last_number, or None if the day has no row yet"""
+        if cls._supports_update_returning():
+            with connection.cursor() as cursor:
+                cursor.execute(
+                    f'UPDATE {cls._meta.db_table} SET last_number = last_number + %s WHERE day = %s RETURNING last_number',
+                    [count, day]
+                )
+                row = cursor.fetchone()
+            return row[0] if row else None
+
+        if not cls.objects.filter(day=day).update(last_number=F('last_number') + count):
+            return None
+        return cls.objects.filter(day=day).values_list('last_number', flat=True).get()
+
+    @staticmethod
+    def _supports_update_returning():
+        if connection.vendor == 'postgresql':
+            return True
+        return connection.vendor == 'sqlite' and connection.Database.sqlite_version_info >= (3, 35)
+
+    @classmethod
+    def _create(cls, day):
+        """Create a day's counter, continuing from invoices numbered before the counter existed"""
+        last_invoice = Invoice.objects.filter(
+            invoice_number__startswith=Invoice.format_invoice_number(day, 0)[:-4]
+        ).order_by('-invoice_number').values_list('invoice_number', flat=True).first()
+        start = int(last_invoice.rsplit('-', 1)[-1]) if last_invoice else 0
+        try:
+            with transaction.atomic():
+                cls.objects.create(day=day, last_number=start)
+        except IntegrityError:
+            # Another allocator created the row first
+            pass
+
+
 class Invoice(models.Model):
     STATUS_CHOICES = [
         ('draft', 'Draft'),
@@ -59,32 +126,139 @@ class Invoice(models.Model):
     due_date = models.DateField()
     pdf_file = models.FileField(upload_to='invoices/', blank=True, null=True)
 
+    class Meta:
+        indexes = [
+            # Invoice lists and "recent invoices" per user; invoice_number
+            # prefix lookups are served by the unique index (and its
+            # varchar_pattern_ops twin that Django adds on PostgreSQL)
+            models.Index(fields=['user', '-issued_date', '-id'], name='billing_invoice_recent_idx'),
+        ]
+
     def __str__(self):
         return f"Invoice {self.invoice_number} - {self.user.username} - {self.amount}"
 
+    @staticmethod
+    def format_invoice_number(day, number):
+        return f"INV-{day.strftime('%Y%m%d')}-{number:04d}"
+
     @classmethod
     def generate_invoice_number(cls):
         """Generate a unique invoice number"""
-        from django.utils import timezone
-        date_str = timezone.now().strftime('%Y%m%d')
-        last_invoice = cls.objects.filter(invoice_number__startswith=date_str).order_by('-invoice_number').first()
-        if last_invoice:
-            num = int(last_invoice.invoice_number.split('-')[-1]) + 1
-        else:
-            num = 1
-        return f"INV-{date_str}-{num:04d}"
+        return cls.reserve_invoice_numbers(1)[0]
+
+    @classmethod
+    def reserve_invoice_numbers(cls, count):
+        """Reserve `count` consecutive invoice numbers for today in one round-trip"""
+        day = timezone.localdate()
+        return [cls.format_invoice_number(day, number) for number in InvoiceSequence.reserve(day, count)]
 
     def calculate_hourly_cost(self, vps_instance):
         """Calculate hourly cost for a VPS instance with 10% profit margin"""
-        monthly_cost = vps_instance.plan.price_per_month
-        hourly_base = monthly_cost / Decimal('720')  # 30 days * 24 hours
-        hourly_with_margin = hourly_base * Decimal('1.10')  # 10% profit margin
-        return hourly_with_margin.quantize(Decimal('0.01'))
+        return PricingTable.current().instance_rate(vps_instance.plan_id, vps_instance.price_per_month)
 
     def calculate_total_cost(self, vps_instances, hours):
         """Calculate total cost for multiple VPS instances over given hours"""
-        total = Decimal('0')
-        for instance in vps_instances:
-            hourly_cost = self.calculate_hourly_cost(instance)
-            total += hourly_cost * hours
+        total = PricingTable.current().total_hourly_cost(vps_instances) * hours
         return total.quantize(Decimal('0.01'))
+
+
+class BillingPeriod(models.Model):
+    """A single billed hour of a VPS instance.
+
+    The unique (instance, period_start) constraint guarantees an hour is
+    never charged twice, no matter how often the billing run is retried.
+    """
+
+    instance = models.ForeignKey('vps.VPSInstance', on_delete=models.CASCADE, related_name='billing_periods')
+    period_start = models.DateTimeField()
+    amount = models.DecimalField(max_digits=10, decimal_places=2)
+    transaction = models.ForeignKey('wallet.Transaction', on_delete=models.SET_NULL, blank=True, null=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['instance', 'period_start'], name='unique_billing_period'),
+        ]
+
+    def __str__(self):
+        return f"{self.instance.instance_id} - {self.period_start:%Y-%m-%d %H:00} - {self.amount}"
+
+    @staticmethod
+    def hour_bucket(moment):
+        """Truncate a datetime to the start of its billing hour"""
+        return moment.replace(minute=0, second=0, microsecond=0)
+
+
+class NotificationOutbox(models.Model):
+    """Email queued for delivery by the outbox drain task.
+
+    Rows are written inside the caller's transaction, so a notification
+    exists exactly when the billing change that caused it commits, and no
+    SMTP round-trip ever happens while wallet rows are locked.
+    """
+
+    STATUS_CHOICES = [
+        ('pending', 'Pending'),
+        ('sent', 'Sent'),
+        ('failed', 'Failed'),
+    ]
+
+    user = models.ForeignKey(User, on_delete=models.CASCADE, blank=True, null=True)
+    recipient = models.EmailField()
+    subject = models.CharField(max_length=255)
+    body = models.TextField()
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='pending')
+    attempts = models.PositiveIntegerField(default=0)
+    last_error = models.TextField(blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    available_at = models.DateTimeField(default=timezone.now)
+    sent_at = models.DateTimeField(blank=True, null=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['status', 'available_at'], name='billing_outbox_due_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.subject} -> {self.recipient} ({self.status})"
+
+
+class NotificationEvent(models.Model):
+    """Billing event waiting to be rolled into a user's notification digest.
+
+    Events that share a dedupe_key collapse into one while they are pending,
+    so repeated low-balance or payment-due warnings appear once per digest.
+    Events without a key (hourly charges) accumulate and are summed.
+    """
+
+    EVENT_TYPES = [
+        ('hourly_billing', 'Hourly Billing'),
+        ('low_balance', 'Low Balance'),
+        ('payment_due', 'Payment Due'),
+        ('renewal_success', 'Renewal Successful'),
+        ('renewal_failure', 'Renewal Failed'),
+        ('expiry_warning', 'Expiry Warning'),
+    ]
+
+    user = models.ForeignKey(User, on_delete=models.CASCADE)
+    event_type = models.CharField(max_length=20, choices=EVENT_TYPES)
+    dedupe_key = models.CharField(max_length=100, blank=True, null=True)
+    summary = models.CharField(max_length=255)
+    amount = models.DecimalField(max_digits=10, decimal_places=2, blank=True, null=True)
+    created_at = models.DateTimeField(default=timezone.now)
+    digested_at = models.DateTimeField(blank=True, null=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=['user', 'event_type', 'dedupe_key'],
+                condition=models.Q(digested_at__isnull=True),
+                name='unique_pending_notification_event',
+            ),
+        ]
+        indexes = [
+            models.Index(fields=['digested_at', 'user'], name='billing_event_pending_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.user.username} - {self.get_event_type_display()} - {self.summary}"
@@ -0,0 +1,107 @@
+"""
+Hourly pricing for VPS plans.
+
+Hourly rates are derived from VPSPlan.price_per_month once per plan and kept
+in the Django cache as a {plan_id: hourly_rate} table, so billing code can
+price instances by plan_id without touching the plan rows. The table is
+dropped whenever a plan is saved or deleted. Instances that store the price
+agreed for their location are rated from that price instead.
+"""
+
+import logging
+from decimal import Decimal
+from django.core.cache import cache
+from django.db.models import QuerySet
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import receiver
+from vps.models import VPSPlan
+
+logger = logging.getLogger(__name__)
+
+HOURS_PER_MONTH = Decimal('720')  # 30 days * 24 hours
+PROFIT_MARGIN = Decimal('1.10')  # 10% profit margin
+CACHE_KEY = 'billing:pricing:hourly_rates'
+CACHE_TIMEOUT = 60 * 60
+
+
+def hourly_rate(monthly_cost):
+    """Convert a monthly plan price into an hourly rate with 10% profit margin"""
+    hourly_base = monthly_cost / HOURS_PER_MONTH
+    return (hourly_base * PROFIT_MARGIN).quantize(Decimal('0.01'))
+
+
+class PricingTable:
+    """Precomputed hourly rate of every VPS plan"""
+
+    def __init__(self, rates):
+        self.rates = rates
+
+    @classmethod
+    def load(cls):
+        """Build the table from the database in a single query"""
+        return cls({
+            plan_id: hourly_rate(price)
+            for plan_id, price in VPSPlan.objects.values_list('id', 'price_per_month')
+        })
+
+    @classmethod
+    def current(cls):
+        """Return the cached table, rebuilding and caching it when missing"""
+        try:
+            rates = cache.get(CACHE_KEY)
+        except Exception as e:
+            logger.warning(f'Pricing cache unavailable: {str(e)}')
+            return cls.load()
+
+        if rates is not None:
+            return cls(rates)
+
+        table = cls.load()
+        try:
+            cache.set(CACHE_KEY, table.rates, CACHE_TIMEOUT)
+        except Exception as e:
+            logger.warning(f'Pricing cache unavailable: {str(e)}')
+        return table
+
+    def hourly_rate_for(self, plan_id):
+        """Hourly rate of a plan, reloading the table if the plan is unknown"""
+        if plan_id not in self.rates:
+            invalidate()
+            self.rates = PricingTable.current().rates
+        return self.rates[plan_id]
+
+    def instance_rate(self, plan_id, price_per_month=None):
+        """Hourly rate of an instance: from its agreed monthly price, else its plan's"""
+        if price_per_month is not None:
+            return hourly_rate(price_per_month)
+        return self.hourly_rate_for(plan_id)
+
+    def price_instances(self, instances):
+        """Map instance ids to their hourly cost in one pass.
+
+        Accepts a queryset, which is read as (id, plan_id, price) rows without
+        joining the plan table, or an iterable of VPSInstance objects.
+        """
+        if isinstance(instances, QuerySet):
+            rows = instances.values_list('id', 'plan_id', 'price_per_month')
+        else:
+            rows = ((instance.id, instance.plan_id, instance.price_per_month) for instance in instances)
+        return {instance_id: self.instance_rate(plan_id, price) for instance_id, plan_id, price in rows}
+
+    def total_hourly_cost(self, instances):
+        """Combined hourly cost of a set of instances"""
+        return sum(self.price_instances(instances).values(), Decimal('0'))
+
+
+def invalidate():
+    """Drop the cached pricing table"""
+    try:
+        cache.delete(CACHE_KEY)
+    except Exception as e:
+        logger.warning(f'Pricing cache unavailable: {str(e)}')
+
+
+@receiver(post_save, sender=VPSPlan)
+@receiver(post_delete, sender=VPSPlan)
+def invalidate_pricing_table(sender, **kwargs):
+    invalidate()
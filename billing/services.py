@@ -1,111 +1,453 @@
+import logging
+import time
+from functools import lru_cache
 from decimal import Decimal
+from datetime import timedelta
 from django.utils import timezone
 from django.db import transaction
+from django.db.models import F, Max, Min, Q
 from django.conf import settings
-from django.core.mail import send_mail
+from django.core.cache import cache
+from django.contrib.auth.models import User
+from django.core.mail import EmailMessage, get_connection
 from io import BytesIO
 from reportlab.pdfgen import canvas
 from reportlab.lib.pagesizes import letter
 from reportlab.lib.styles import getSampleStyleSheet
 from reportlab.platypus import SimpleDocTemplate, Paragraph, Spacer, Table, TableStyle
 from reportlab.lib import colors
-from .models import Invoice
+from .models import Invoice, BillingPeriod, NotificationOutbox, NotificationEvent
+from .pricing import PricingTable, hourly_rate
 from vps.models import VPSInstance
 from wallet.models import Wallet, Transaction
+from wallet.signals import balances_changed
+from grandvps.locks import LockLost
+
+logger = logging.getLogger(__name__)
 
 
 class HourlyBillingService:
     """Service for handling hourly billing operations"""
 
+    @staticmethod
+    def calculate_hourly_rate(monthly_cost):
+        """Convert a monthly plan price into an hourly rate with 10% profit margin"""
+        return hourly_rate(monthly_cost)
+
     @staticmethod
     def calculate_hourly_cost(vps_instance):
         """Calculate hourly cost for a VPS instance with 10% profit margin"""
-        monthly_cost = vps_instance.plan.price_per_month
-        hourly_base = monthly_cost / Decimal('720')  # 30 days * 24 hours
-        hourly_with_margin = hourly_base * Decimal('1.10')  # 10% profit margin
-        return hourly_with_margin.quantize(Decimal('0.01'))
+        return PricingTable.current().instance_rate(vps_instance.plan_id, vps_instance.price_per_month)
 
     @staticmethod
     def process_hourly_billing_for_user(user, hours=1):
         """Process hourly billing for all active VPS instances of a user"""
-        active_instances = VPSInstance.objects.filter(
-            user=user,
-            status='active'
-        )
+        try:
+            results = BulkHourlyBillingService.process(hours, user_id_range=(user.id, user.id))
+        except Exception as e:
+            return {'success': False, 'message': f'Billing error: {str(e)}', 'total_deducted': Decimal('0')}
 
-        if not active_instances.exists():
+        if not results:
             return {'success': True, 'message': 'No active VPS instances to bill', 'total_deducted': Decimal('0')}
 
-        try:
-            with transaction.atomic():
-                wallet = Wallet.objects.get(user=user)
-                total_cost = Decimal('0')
+        result = results[0]
+        return {
+            'success': result['success'],
+            'message': result['message'],
+            'total_deducted': result['total_deducted']
+        }
 
-                for instance in active_instances:
-                    hourly_cost = HourlyBillingService.calculate_hourly_cost(instance)
-                    cost_for_hours = hourly_cost * hours
-                    total_cost += cost_for_hours
+    @staticmethod
+    def process_hourly_billing_for_all_users(hours=1, shards=1, lock=None):
+        """Process hourly billing for all users with active VPS instances"""
+        if shards > 1:
+            return BulkHourlyBillingService.process_sharded(hours, shards, lock=lock)
+        return BulkHourlyBillingService.process(hours, lock=lock)
 
-                if wallet.balance < total_cost:
-                    return {
-                        'success': False,
-                        'message': f'Insufficient balance. Required: ${total_cost}, Available: ${wallet.balance}',
-                        'total_deducted': Decimal('0')
-                    }
 
-                # Deduct from wallet
-                wallet.withdraw(total_cost, f'Hourly billing for {len(active_instances)} VPS instances ({hours} hours)')
+class BulkHourlyBillingService:
+    """Set-based hourly billing engine.
 
-                # Send notification
-                NotificationService.send_hourly_billing_notification(user, total_cost, len(active_instances))
+    Active instances are loaded for every user in a single query, wallets are
+    debited with one conditional UPDATE per batch and charge amount, and the
+    ledger rows of a batch are written with a single bulk_create.
 
-                return {
-                    'success': True,
-                    'message': f'Successfully billed ${total_cost} for {len(active_instances)} VPS instances',
-                    'total_deducted': total_cost
-                }
+    Every charged hour is recorded as a BillingPeriod, so re-running the
+    engine only bills the (instance, hour) buckets that are still missing
+    within the look-back window. Without an explicit number of hours the
+    engine catches up: every instance is billed from the hour after its
+    last BillingPeriod, looking back at most BILLING_CATCHUP_MAX_HOURS.
+    """
 
-        except Wallet.DoesNotExist:
-            return {'success': False, 'message': 'User wallet not found', 'total_deducted': Decimal('0')}
-        except Exception as e:
-            return {'success': False, 'message': f'Billing error: {str(e)}', 'total_deducted': Decimal('0')}
+    BATCH_SIZE = 500
+    LOCK_NAME = 'billing:hourly'
 
     @staticmethod
-    def process_hourly_billing_for_all_users(hours=1):
-        """Process hourly billing for all users with active VPS instances"""
+    def active_instances(user_id_range=None):
+        """Active VPS instances, optionally limited to an inclusive user-id range"""
+        instances = VPSInstance.objects.filter(status='active')
+        if user_id_range:
+            instances = instances.filter(user_id__gte=user_id_range[0], user_id__lte=user_id_range[1])
+        return instances
+
+    @staticmethod
+    def active_user_ids(user_id_range=None):
+        """Ids of users with active VPS instances"""
+        instances = BulkHourlyBillingService.active_instances(user_id_range)
+        return list(instances.values_list('user_id', flat=True).distinct().order_by('user_id'))
+
+    @staticmethod
+    def shard_user_ranges(shards):
+        """Partition users with active VPS instances into contiguous user-id ranges.
+
+        Ranges are split on the sorted id list so each shard gets roughly the
+        same number of users, regardless of gaps in the id space.
+        """
+        user_ids = BulkHourlyBillingService.active_user_ids()
+        if not user_ids:
+            return []
+
+        shards = max(1, min(shards, len(user_ids)))
+        size, remainder = divmod(len(user_ids), shards)
+        ranges = []
+        start = 0
+        for shard in range(shards):
+            end = start + size + (1 if shard < remainder else 0)
+            ranges.append((user_ids[start], user_ids[end - 1]))
+            start = end
+        return ranges
+
+    @staticmethod
+    def catchup_max_hours():
+        return getattr(settings, 'BILLING_CATCHUP_MAX_HOURS', 24)
+
+    @staticmethod
+    def billing_window(hours=1, now=None):
+        """Hour buckets covered by a run looking back over the given number of hours"""
+        current = BillingPeriod.hour_bucket(now or timezone.now())
+        return [current - timedelta(hours=offset) for offset in range(max(hours, 1))]
+
+    @staticmethod
+    def collect_charges(user_id_range=None, since_last_billed=False):
+        """Load the active instances of every user to bill, with their hourly rate.
+
+        With `since_last_billed` an instance's first billable hour is the one
+        after its latest BillingPeriod rather than the hour it was created.
+        """
+        pricing = PricingTable.current()
+        rows = BulkHourlyBillingService.active_instances(user_id_range).values(
+            'id', 'user_id', 'user__username', 'plan_id', 'price_per_month', 'created_at'
+        ).order_by('user_id', 'id')
+        if since_last_billed:
+            rows = rows.annotate(last_billed=Max('billing_periods__period_start'))
+
+        charges = {}
+        for row in rows:
+            charge = charges.setdefault(row['user_id'], {
+                'user': row['user__username'],
+                'instances': [],
+            })
+            first_bucket = BillingPeriod.hour_bucket(row['created_at'])
+            if row.get('last_billed') is not None:
+                first_bucket = max(first_bucket, row['last_billed'] + timedelta(hours=1))
+            charge['instances'].append({
+                'id': row['id'],
+                'hourly_cost': pricing.instance_rate(row['plan_id'], row['price_per_month']),
+                'first_bucket': first_bucket,
+            })
+        return charges
+
+    @staticmethod
+    def process(hours=1, user_id_range=None, now=None, lock=None):
+        """Bill every unbilled hour of every user's active VPS instances in batches.
+
+        `hours=None` catches up every hour since each instance was last
+        billed, up to BILLING_CATCHUP_MAX_HOURS back, so hours missed while
+        the scheduler was down are charged by the next scheduled run.
+
+        When a DistributedLock is given it is checked before every batch and
+        fenced inside every batch's transaction, so a run whose lease expired
+        stops instead of racing its successor.
+        """
+        catch_up = hours is None
+        if catch_up:
+            hours = BulkHourlyBillingService.catchup_max_hours()
+        window = BulkHourlyBillingService.billing_window(hours, now)
+        charges = BulkHourlyBillingService.collect_charges(user_id_range, since_last_billed=catch_up)
+        user_ids = list(charges)
         results = []
-        users_with_active_vps = VPSInstance.objects.filter(
-            status='active'
-        ).values_list('user', flat=True).distinct()
 
-        for user_id in users_with_active_vps:
-            from django.contrib.auth.models import User
+        for start in range(0, len(user_ids), BulkHourlyBillingService.BATCH_SIZE):
+            if lock is not None:
+                lock.check()
+            batch = {
+                user_id: charges[user_id]
+                for user_id in user_ids[start:start + BulkHourlyBillingService.BATCH_SIZE]
+            }
             try:
-                user = User.objects.get(id=user_id)
-                result = HourlyBillingService.process_hourly_billing_for_user(user, hours)
-                results.append({
-                    'user': user.username,
-                    'success': result['success'],
-                    'message': result['message'],
-                    'total_deducted': result['total_deducted']
-                })
-            except User.DoesNotExist:
-                results.append({
-                    'user': f'User {user_id}',
-                    'success': False,
-                    'message': 'User not found',
-                    'total_deducted': Decimal('0')
-                })
+                results.extend(BulkHourlyBillingService.bill_batch(batch, window, lock))
+            except LockLost:
+                raise
+            except Exception as e:
+                results.extend(
+                    BulkHourlyBillingService._result(charge['user'], False, f'Billing error: {str(e)}')
+                    for charge in batch.values()
+                )
+
+        return results
+
+    @staticmethod
+    def shard_tasks(hours=1, shards=2, lock_token=None):
+        """Build the Celery group billing each user-id shard, or None when nobody is billable.
+
+        With `lock_token` every shard adopts that acquisition of the billing
+        lock and fences its writes with it.
+        """
+        from celery import group
+        from .tasks import process_hourly_billing_shard
+
+        ranges = BulkHourlyBillingService.shard_user_ranges(shards)
+        if not ranges:
+            return None
+
+        # Every shard bills the same window, even if it starts after the hour turns
+        now = timezone.now().isoformat()
+        return group(process_hourly_billing_shard.s(start, end, hours, now, lock_token) for start, end in ranges)
+
+    @staticmethod
+    def dispatch_sharded(hours=1, shards=2, lock=None):
+        """Queue the shard tasks without waiting for them; returns the number of shards.
+
+        Used from inside Celery tasks, where blocking on sub-task results
+        could deadlock the worker pool. A given lock is handed off to the
+        shards and released by a chord callback once all of them finished,
+        so no new run starts while shards are still billing.
+        """
+        from celery import chord
+        from .tasks import release_hourly_billing_lock
+
+        tasks = BulkHourlyBillingService.shard_tasks(hours, shards, lock.token if lock is not None else None)
+        if tasks is None:
+            return 0
+        if lock is None:
+            tasks.apply_async()
+        else:
+            chord(tasks)(release_hourly_billing_lock.si(lock.hand_off()))
+        return len(tasks.tasks)
+
+    @staticmethod
+    def process_sharded(hours=1, shards=2, timeout=None, lock=None):
+        """Fan billing out to one Celery task per user-id shard and merge the results.
+
+        The caller keeps the lock (and its renewal) while waiting; shards
+        fence their writes with its token, which is claimed here first so
+        their batches only share the fence row.
+        """
+        tasks = BulkHourlyBillingService.shard_tasks(hours, shards, lock.token if lock is not None else None)
+        if tasks is None:
+            return []
+        if lock is not None:
+            with transaction.atomic():
+                lock.fence()
 
+        shard_results = tasks.apply_async().get(timeout=timeout)
+
+        results = []
+        for shard in shard_results:
+            for result in shard:
+                result['total_deducted'] = Decimal(result['total_deducted'])
+                results.append(result)
         return results
 
+    @staticmethod
+    def bill_batch(batch, window, lock=None):
+        """Debit one batch of users and write their ledger rows.
+
+        Wallets are locked before the already-billed hours are read, so
+        concurrent runs over the same users serialize and the second one
+        finds nothing left to charge. Notifications are queued in the same
+        transaction. Returns the per-user results.
+        """
+        results = {}
+        billed = {}
+        instance_ids = [instance['id'] for charge in batch.values() for instance in charge['instances']]
+
+        with transaction.atomic():
+            if lock is not None:
+                lock.fence()
+            wallets = {
+                user_id: (wallet_id, balance)
+                for wallet_id, user_id, balance in Wallet.objects.select_for_update().filter(
+                    user_id__in=list(batch)
+                ).values_list('id', 'user_id', 'balance')
+            }
+
+            already_billed = set(BillingPeriod.objects.filter(
+                instance_id__in=instance_ids,
+                period_start__gte=window[-1]
+            ).values_list('instance_id', 'period_start'))
+
+            # Group debits by amount so each distinct charge is a single UPDATE
+            debits = {}
+            for user_id, charge in batch.items():
+                periods = [
+                    (instance, bucket)
+                    for instance in charge['instances']
+                    for bucket in window
+                    if bucket >= instance['first_bucket'] and (instance['id'], bucket) not in already_billed
+                ]
+                total_cost = sum((instance['hourly_cost'] for instance, bucket in periods), Decimal('0'))
+                instances_count = len(charge['instances'])
+
+                if not periods:
+                    results[user_id] = BulkHourlyBillingService._result(
+                        charge['user'], True, f'All hours already billed for {instances_count} VPS instances'
+                    )
+                    continue
+
+                if user_id not in wallets:
+                    results[user_id] = BulkHourlyBillingService._result(
+                        charge['user'], False, 'User wallet not found'
+                    )
+                    continue
+
+                wallet_id, balance = wallets[user_id]
+                if balance < total_cost:
+                    results[user_id] = BulkHourlyBillingService._result(
+                        charge['user'], False,
+                        f'Insufficient balance. Required: ${total_cost}, Available: ${balance}'
+                    )
+                    continue
+
+                debits.setdefault(total_cost, []).append(wallet_id)
+                billed[user_id] = {
+                    'user': charge['user'],
+                    'wallet_id': wallet_id,
+                    'instances_count': instances_count,
+                    'total_cost': total_cost,
+                    'periods': periods,
+                }
+                results[user_id] = BulkHourlyBillingService._result(
+                    charge['user'], True,
+                    f'Successfully billed ${total_cost} for {instances_count} VPS instances',
+                    total_cost
+                )
+
+            for amount, wallet_ids in debits.items():
+                Wallet.objects.filter(
+                    id__in=wallet_ids,
+                    balance__gte=amount
+                ).update(balance=F('balance') - amount)
+            balances_changed.send(
+                sender=Wallet, wallet_ids=[charge['wallet_id'] for charge in billed.values()]
+            )
+
+            ledger = Transaction.objects.bulk_create([
+                Transaction(
+                    wallet_id=charge['wallet_id'],
+                    amount=charge['total_cost'],
+                    transaction_type='withdraw',
+                    description=(
+                        f'Hourly billing for {charge["instances_count"]} VPS instances '
+                        f'({len(charge["periods"])} instance-hours)'
+                    ),
+                    status='completed'
+                )
+                for charge in billed.values()
+            ])
+
+            # The unique (instance, period_start) constraint rejects any hour a
+            # concurrent run managed to bill first, rolling back the whole batch
+            BillingPeriod.objects.bulk_create([
+                BillingPeriod(
+                    instance_id=instance['id'],
+                    period_start=bucket,
+                    amount=instance['hourly_cost'],
+                    transaction=ledger_row if ledger_row.pk else None
+                )
+                for charge, ledger_row in zip(billed.values(), ledger)
+                for instance, bucket in charge['periods']
+            ])
+
+            BulkHourlyBillingService.notify_billed(billed)
+
+        return [results[user_id] for user_id in batch]
+
+    @staticmethod
+    def notify_billed(billed):
+        """Record the billing notifications of a batch in the digest or the outbox"""
+        if not billed:
+            return
+        users = User.objects.only('id', 'username', 'email').in_bulk(list(billed))
+
+        if NotificationDigestService.enabled():
+            NotificationDigestService.record_events([
+                NotificationService.build_hourly_billing_event(
+                    users[user_id], charge['total_cost'], charge['instances_count']
+                )
+                for user_id, charge in billed.items()
+                if user_id in users
+            ])
+            return
+
+        NotificationService.queue_emails([
+            NotificationService.build_hourly_billing_email(
+                users[user_id], charge['total_cost'], charge['instances_count']
+            )
+            for user_id, charge in billed.items()
+            if user_id in users
+        ])
+
+    @staticmethod
+    def _result(username, success, message, total_deducted=Decimal('0')):
+        return {
+            'user': username,
+            'success': success,
+            'message': message,
+            'total_deducted': total_deducted,
+        }
+
 
 class NotificationService:
-    """Service for sending billing notifications"""
+    """Service for sending billing notifications.
+
+    Notifications are written to the NotificationOutbox in the caller's
+    transaction and delivered by the drain_notification_outbox task once it
+    commits.
+    """
+
+    @staticmethod
+    def build_email(user, subject, message):
+        """Build an unsaved outbox row for a user, or None if they have no email"""
+        if not user.email:
+            return None
+        return NotificationOutbox(user_id=user.pk, recipient=user.email, subject=subject, body=message)
+
+    @staticmethod
+    def queue_emails(emails):
+        """Write outbox rows in one statement and drain them after commit"""
+        emails = [email for email in emails if email is not None]
+        if not emails:
+            return []
+        queued = NotificationOutbox.objects.bulk_create(emails)
+        transaction.on_commit(NotificationOutboxService.schedule_drain)
+        return queued
+
+    @staticmethod
+    def queue_email(user, subject, message):
+        """Queue a single notification email for a user"""
+        return NotificationService.queue_emails([NotificationService.build_email(user, subject, message)])
 
     @staticmethod
     def send_low_balance_notification(user, current_balance, required_balance):
         """Send notification when wallet balance is low"""
+        if NotificationDigestService.record(
+            user, 'low_balance',
+            f'Wallet balance ${current_balance} is below the recommended ${required_balance}',
+            dedupe_key='low_balance'
+        ):
+            return
+
         subject = 'GrandVPS - Low Wallet Balance Warning'
         message = f"""
         Dear {user.username},
@@ -121,21 +463,18 @@ class NotificationService:
         GrandVPS Team
         """
 
-        try:
-            send_mail(
-                subject=subject,
-                message=message,
-                from_email=settings.DEFAULT_FROM_EMAIL,
-                recipient_list=[user.email],
-                fail_silently=True
-            )
-        except Exception as e:
-            # Log error but don't fail the operation
-            pass
+        NotificationService.queue_email(user, subject, message)
 
     @staticmethod
     def send_payment_due_notification(user, invoice):
         """Send notification for payment due"""
+        if NotificationDigestService.record(
+            user, 'payment_due',
+            f'Invoice #{invoice.invoice_number} for ${invoice.amount} is due on {invoice.due_date}',
+            dedupe_key=f'invoice:{invoice.pk}', amount=invoice.amount
+        ):
+            return
+
         subject = 'GrandVPS - Payment Due'
         message = f"""
         Dear {user.username},
@@ -151,76 +490,125 @@ class NotificationService:
         GrandVPS Team
         """
 
-        try:
-            send_mail(
-                subject=subject,
-                message=message,
-                from_email=settings.DEFAULT_FROM_EMAIL,
-                recipient_list=[user.email],
-                fail_silently=True
-            )
-        except Exception as e:
-            pass
+        NotificationService.queue_email(user, subject, message)
 
     @staticmethod
-    def send_renewal_success_notification(user, instance, cost):
-        """Send notification for successful renewal"""
+    def build_renewal_success_email(user, instance_id, plan_name, cost, expires_at):
+        """Build the renewal confirmation for one VPS instance"""
         subject = 'GrandVPS - VPS Renewal Successful'
         message = f"""
         Dear {user.username},
 
-        Your VPS instance {instance.instance_id} has been successfully renewed.
+        Your VPS instance {instance_id} has been successfully renewed.
 
-        Plan: {instance.plan.name}
+        Plan: {plan_name}
         Cost: ${cost}
-        New Expiry: {instance.expires_at.strftime('%Y-%m-%d')}
+        New Expiry: {expires_at.strftime('%Y-%m-%d')}
 
         Best regards,
         GrandVPS Team
         """
 
-        try:
-            send_mail(
-                subject=subject,
-                message=message,
-                from_email=settings.DEFAULT_FROM_EMAIL,
-                recipient_list=[user.email],
-                fail_silently=True
-            )
-        except Exception as e:
-            pass
+        return NotificationService.build_email(user, subject, message)
 
     @staticmethod
-    def send_renewal_failure_notification(user, instance):
-        """Send notification for renewal failure"""
+    def build_renewal_success_event(user, instance_pk, instance_id, cost, expires_at):
+        """Build the digest event for a successful renewal"""
+        return NotificationEvent(
+            user_id=user.pk,
+            event_type='renewal_success',
+            summary=f'VPS {instance_id} renewed for ${cost} until {expires_at:%Y-%m-%d}',
+            dedupe_key=f'instance:{instance_pk}',
+            amount=cost
+        )
+
+    @staticmethod
+    def build_renewal_failure_email(user, instance_id, plan_name):
+        """Build the suspension notice for a VPS instance that could not be renewed"""
         subject = 'GrandVPS - VPS Renewal Failed'
         message = f"""
         Dear {user.username},
 
-        We were unable to renew your VPS instance {instance.instance_id} due to insufficient wallet balance.
+        We were unable to renew your VPS instance {instance_id} due to insufficient wallet balance.
 
         The instance has been suspended. Please top up your wallet and contact support to reactivate.
 
-        Plan: {instance.plan.name}
+        Plan: {plan_name}
 
         Best regards,
         GrandVPS Team
         """
 
-        try:
-            send_mail(
-                subject=subject,
-                message=message,
-                from_email=settings.DEFAULT_FROM_EMAIL,
-                recipient_list=[user.email],
-                fail_silently=True
-            )
-        except Exception as e:
-            pass
+        return NotificationService.build_email(user, subject, message)
 
     @staticmethod
-    def send_hourly_billing_notification(user, total_cost, instances_count):
-        """Send notification for hourly billing"""
+    def build_renewal_failure_event(user, instance_pk, instance_id):
+        """Build the digest event for a suspension after a failed renewal"""
+        return NotificationEvent(
+            user_id=user.pk,
+            event_type='renewal_failure',
+            summary=f'VPS {instance_id} was suspended: insufficient balance for renewal',
+            dedupe_key=f'instance:{instance_pk}'
+        )
+
+    @staticmethod
+    def build_expiry_warning_email(user, instance_id, plan_name, expires_at):
+        """Build the reminder sent ahead of a VPS instance's expiry"""
+        subject = 'GrandVPS - VPS Expiring Soon'
+        message = f"""
+        Dear {user.username},
+
+        Your VPS instance {instance_id} expires on {expires_at.strftime('%Y-%m-%d')}.
+
+        Plan: {plan_name}
+
+        It will be renewed automatically if your wallet balance covers the plan price.
+
+        Best regards,
+        GrandVPS Team
+        """
+
+        return NotificationService.build_email(user, subject, message)
+
+    @staticmethod
+    def build_expiry_warning_event(user, instance_pk, instance_id, expires_at):
+        """Build the digest event for an upcoming expiry"""
+        return NotificationEvent(
+            user_id=user.pk,
+            event_type='expiry_warning',
+            summary=f'VPS {instance_id} expires on {expires_at:%Y-%m-%d}',
+            dedupe_key=f'instance:{instance_pk}:{expires_at:%Y%m%d}'
+        )
+
+    @staticmethod
+    def send_renewal_success_notification(user, instance, cost):
+        """Send notification for successful renewal"""
+        if NotificationDigestService.enabled():
+            NotificationDigestService.record_events([NotificationService.build_renewal_success_event(
+                user, instance.pk, instance.instance_id, cost, instance.expires_at
+            )])
+            return
+
+        NotificationService.queue_emails([NotificationService.build_renewal_success_email(
+            user, instance.instance_id, instance.plan.name, cost, instance.expires_at
+        )])
+
+    @staticmethod
+    def send_renewal_failure_notification(user, instance):
+        """Send notification for renewal failure"""
+        if NotificationDigestService.enabled():
+            NotificationDigestService.record_events([NotificationService.build_renewal_failure_event(
+                user, instance.pk, instance.instance_id
+            )])
+            return
+
+        NotificationService.queue_emails([NotificationService.build_renewal_failure_email(
+            user, instance.instance_id, instance.plan.name
+        )])
+
+    @staticmethod
+    def build_hourly_billing_email(user, total_cost, instances_count):
+        """Build the hourly billing notification for a user"""
         subject = 'GrandVPS - Hourly Billing Completed'
         message = f"""
         Dear {user.username},
@@ -234,34 +622,44 @@ class NotificationService:
         GrandVPS Team
         """
 
-        try:
-            send_mail(
-                subject=subject,
-                message=message,
-                from_email=settings.DEFAULT_FROM_EMAIL,
-                recipient_list=[user.email],
-                fail_silently=True
-            )
-        except Exception as e:
-            pass
+        return NotificationService.build_email(user, subject, message)
+
+    @staticmethod
+    def build_hourly_billing_event(user, total_cost, instances_count):
+        """Build the digest event for an hourly billing charge"""
+        return NotificationEvent(
+            user_id=user.pk,
+            event_type='hourly_billing',
+            summary=f'Hourly billing: ${total_cost} for {instances_count} VPS instances',
+            amount=total_cost
+        )
+
+    @staticmethod
+    def send_hourly_billing_notification(user, total_cost, instances_count):
+        """Send notification for hourly billing"""
+        if NotificationDigestService.enabled():
+            NotificationDigestService.record_events([
+                NotificationService.build_hourly_billing_event(user, total_cost, instances_count)
+            ])
+            return
+
+        NotificationService.queue_emails([
+            NotificationService.build_hourly_billing_email(user, total_cost, instances_count)
+        ])
 
     @staticmethod
     def check_wallet_balance_for_renewal(user):
         """Check if user has sufficient balance for VPS renewal"""
-        active_instances = VPSInstance.objects.filter(
-            user=user,
-            status='active'
+        instance_costs = PricingTable.current().price_instances(
+            VPSInstance.objects.filter(user=user, status='active')
         )
 
-        if not active_instances.exists():
+        if not instance_costs:
             return {'sufficient': True, 'message': 'No active instances to renew'}
 
         try:
             wallet = Wallet.objects.get(user=user)
-            total_hourly_cost = sum(
-                HourlyBillingService.calculate_hourly_cost(instance)
-                for instance in active_instances
-            )
+            total_hourly_cost = sum(instance_costs.values(), Decimal('0'))
 
             # Check for 24 hours renewal
             required_balance = total_hourly_cost * 24
@@ -277,19 +675,236 @@ class NotificationService:
             return {'sufficient': False, 'message': 'Wallet not found'}
 
 
+class NotificationDigestService:
+    """Coalesces billing notifications into one digest email per user and window.
+
+    With NOTIFICATION_DIGEST_WINDOW set to 'daily' or 'weekly', notifications
+    are recorded as NotificationEvent rows instead of emails. The flush task
+    turns every user's pending events into a single outbox email once their
+    oldest event is a full window old. Set it to None to email immediately.
+    """
+
+    WINDOWS = {
+        'daily': timedelta(days=1),
+        'weekly': timedelta(weeks=1),
+    }
+
+    @staticmethod
+    def window():
+        return NotificationDigestService.WINDOWS.get(getattr(settings, 'NOTIFICATION_DIGEST_WINDOW', None))
+
+    @staticmethod
+    def enabled():
+        return NotificationDigestService.window() is not None
+
+    @staticmethod
+    def record_events(events):
+        """Store digest events; pending duplicates of a dedupe_key are dropped"""
+        if events:
+            NotificationEvent.objects.bulk_create(events, ignore_conflicts=True)
+
+    @staticmethod
+    def record(user, event_type, summary, dedupe_key=None, amount=None):
+        """Record a single event, returning False when digests are disabled"""
+        if not NotificationDigestService.enabled():
+            return False
+        NotificationDigestService.record_events([NotificationEvent(
+            user_id=user.pk,
+            event_type=event_type,
+            summary=summary,
+            dedupe_key=dedupe_key,
+            amount=amount
+        )])
+        return True
+
+    @staticmethod
+    def build_digest_email(user, events, window_name):
+        """Render one digest email from a user's pending events"""
+        charges = [event for event in events if event.event_type == 'hourly_billing']
+        others = [event for event in events if event.event_type != 'hourly_billing']
+
+        lines = []
+        if charges:
+            total = sum((event.amount or Decimal('0') for event in charges), Decimal('0'))
+            lines.append(f'Hourly billing: {len(charges)} charges totalling ${total}')
+        lines.extend(event.summary for event in others)
+        details = '\n'.join(f'        - {line}' for line in lines)
+
+        subject = f'GrandVPS - Your {window_name} billing summary'
+        message = f"""
+        Dear {user.username},
+
+        Here is a summary of your GrandVPS billing activity.
+
+{details}
+
+        Best regards,
+        GrandVPS Team
+        """
+
+        return NotificationService.build_email(user, subject, message)
+
+    @staticmethod
+    def flush(now=None, batch_size=500, force=False):
+        """Send one digest to every user whose oldest pending event is a window old.
+
+        Returns the number of digests queued.
+        """
+        window = NotificationDigestService.window()
+        window_name = getattr(settings, 'NOTIFICATION_DIGEST_WINDOW', None) or 'daily'
+        now = now or timezone.now()
+
+        due_users = NotificationEvent.objects.filter(
+            digested_at__isnull=True
+        ).values('user_id').annotate(first_event=Min('created_at'))
+        if window and not force:
+            due_users = due_users.filter(first_event__lte=now - window)
+        user_ids = list(due_users.order_by('user_id').values_list('user_id', flat=True))
+
+        digests = 0
+        for start in range(0, len(user_ids), batch_size):
+            batch_ids = user_ids[start:start + batch_size]
+            with transaction.atomic():
+                events = list(NotificationEvent.objects.select_for_update(skip_locked=True).filter(
+                    user_id__in=batch_ids,
+                    digested_at__isnull=True
+                ).select_related('user').order_by('user_id', 'created_at'))
+
+                by_user = {}
+                for event in events:
+                    by_user.setdefault(event.user_id, []).append(event)
+
+                queued = NotificationService.queue_emails([
+                    NotificationDigestService.build_digest_email(user_events[0].user, user_events, window_name)
+                    for user_events in by_user.values()
+                ])
+                NotificationEvent.objects.filter(id__in=[event.id for event in events]).update(digested_at=now)
+                digests += len(queued)
+
+        return digests
+
+
+class NotificationOutboxService:
+    """Delivers queued notification emails in batches over one SMTP connection"""
+
+    @staticmethod
+    def schedule_drain():
+        """Ask a Celery worker to drain the outbox"""
+        from .tasks import drain_notification_outbox
+        try:
+            drain_notification_outbox.delay()
+        except Exception as e:
+            # The periodic drain picks the rows up if the broker is unavailable
+            logger.warning(f'Could not schedule notification outbox drain: {str(e)}')
+
+    @staticmethod
+    def batch_size():
+        return getattr(settings, 'NOTIFICATION_OUTBOX_BATCH_SIZE', 100)
+
+    @staticmethod
+    def drain(batch_size=None):
+        """Send one batch of due outbox emails.
+
+        Due rows are claimed with SKIP LOCKED so concurrent drains never send
+        the same email twice. Failed emails are retried with exponential
+        backoff until NOTIFICATION_OUTBOX_MAX_ATTEMPTS is reached. Raises if
+        the SMTP connection cannot be opened, leaving the batch untouched.
+        """
+        batch_size = batch_size or NotificationOutboxService.batch_size()
+        max_attempts = getattr(settings, 'NOTIFICATION_OUTBOX_MAX_ATTEMPTS', 5)
+        retry_delay = getattr(settings, 'NOTIFICATION_OUTBOX_RETRY_DELAY', 60)
+        max_per_second = getattr(settings, 'NOTIFICATION_OUTBOX_MAX_PER_SECOND', 0)
+        min_interval = 1.0 / max_per_second if max_per_second else 0
+
+        sent_count = 0
+        failed_count = 0
+
+        with transaction.atomic():
+            batch = list(NotificationOutbox.objects.select_for_update(skip_locked=True).filter(
+                status='pending',
+                available_at__lte=timezone.now()
+            ).order_by('available_at', 'id')[:batch_size])
+
+            if not batch:
+                return {'sent': 0, 'failed': 0, 'claimed': 0}
+
+            connection = get_connection(fail_silently=False)
+            connection.open()
+            try:
+                last_sent = 0
+                for email in batch:
+                    if min_interval:
+                        wait = last_sent + min_interval - time.monotonic()
+                        if wait > 0:
+                            time.sleep(wait)
+                        last_sent = time.monotonic()
+
+                    message = EmailMessage(
+                        subject=email.subject,
+                        body=email.body,
+                        from_email=settings.DEFAULT_FROM_EMAIL,
+                        to=[email.recipient],
+                        connection=connection
+                    )
+                    email.attempts += 1
+                    try:
+                        connection.send_messages([message])
+                    except Exception as e:
+                        email.last_error = str(e)
+                        if email.attempts >= max_attempts:
+                            email.status = 'failed'
+                            failed_count += 1
+                        else:
+                            email.available_at = timezone.now() + timedelta(
+                                seconds=retry_delay * 2 ** (email.attempts - 1)
+                            )
+                    else:
+                        email.status = 'sent'
+                        email.sent_at = timezone.now()
+                        sent_count += 1
+            finally:
+                connection.close()
+
+            NotificationOutbox.objects.bulk_update(
+                batch, ['status', 'attempts', 'last_error', 'available_at', 'sent_at']
+            )
+
+        return {'sent': sent_count, 'failed': failed_count, 'claimed': len(batch)}
+
+
+@lru_cache(maxsize=None)
+def invoice_pdf_styles():
+    """Paragraph and table styles for invoice PDFs, built once per process"""
+    styles = getSampleStyleSheet()
+    table_style = TableStyle([
+        ('BACKGROUND', (0, 0), (0, -1), colors.lightgrey),
+        ('TEXTCOLOR', (0, 0), (-1, 0), colors.black),
+        ('ALIGN', (0, 0), (-1, -1), 'LEFT'),
+        ('FONTNAME', (0, 0), (-1, 0), 'Helvetica-Bold'),
+        ('FONTSIZE', (0, 0), (-1, 0), 12),
+        ('BOTTOMPADDING', (0, 0), (-1, 0), 12),
+        ('BACKGROUND', (0, 1), (-1, -1), colors.white),
+        ('GRID', (0, 0), (-1, -1), 1, colors.black)
+    ])
+    return {'title': styles['Title'], 'normal': styles['Normal'], 'table': table_style}
+
+
 class InvoiceService:
     """Service for generating and managing invoices"""
 
+    RENDER_LOCK_KEY = 'billing:invoice_pdf:{}'
+    RENDER_LOCK_TIMEOUT = 10 * 60
+
     @staticmethod
     def generate_invoice_pdf(invoice):
         """Generate PDF for an invoice"""
         buffer = BytesIO()
         doc = SimpleDocTemplate(buffer, pagesize=letter)
-        styles = getSampleStyleSheet()
+        styles = invoice_pdf_styles()
         story = []
 
         # Title
-        title = Paragraph("GrandVPS Invoice", styles['Title'])
+        title = Paragraph("GrandVPS Invoice", styles['title'])
         story.append(title)
         story.append(Spacer(1, 12))
 
@@ -315,28 +930,10 @@ class InvoiceService:
 
         # Create tables
         invoice_table = Table(invoice_data)
-        invoice_table.setStyle(TableStyle([
-            ('BACKGROUND', (0, 0), (0, -1), colors.lightgrey),
-            ('TEXTCOLOR', (0, 0), (-1, 0), colors.black),
-            ('ALIGN', (0, 0), (-1, -1), 'LEFT'),
-            ('FONTNAME', (0, 0), (-1, 0), 'Helvetica-Bold'),
-            ('FONTSIZE', (0, 0), (-1, 0), 12),
-            ('BOTTOMPADDING', (0, 0), (-1, 0), 12),
-            ('BACKGROUND', (0, 1), (-1, -1), colors.white),
-            ('GRID', (0, 0), (-1, -1), 1, colors.black)
-        ]))
+        invoice_table.setStyle(styles['table'])
 
         customer_table = Table(customer_data)
-        customer_table.setStyle(TableStyle([
-            ('BACKGROUND', (0, 0), (0, -1), colors.lightgrey),
-            ('TEXTCOLOR', (0, 0), (-1, 0), colors.black),
-            ('ALIGN', (0, 0), (-1, -1), 'LEFT'),
-            ('FONTNAME', (0, 0), (-1, 0), 'Helvetica-Bold'),
-            ('FONTSIZE', (0, 0), (-1, 0), 12),
-            ('BOTTOMPADDING', (0, 0), (-1, 0), 12),
-            ('BACKGROUND', (0, 1), (-1, -1), colors.white),
-            ('GRID', (0, 0), (-1, -1), 1, colors.black)
-        ]))
+        customer_table.setStyle(styles['table'])
 
         story.append(invoice_table)
         story.append(Spacer(1, 12))
@@ -344,16 +941,67 @@ class InvoiceService:
         story.append(Spacer(1, 12))
 
         # Footer
-        footer = Paragraph("Thank you for using GrandVPS!", styles['Normal'])
+        footer = Paragraph("Thank you for using GrandVPS!", styles['normal'])
         story.append(footer)
 
         doc.build(story)
         buffer.seek(0)
         return buffer
 
+    @staticmethod
+    def render_batch_size():
+        return getattr(settings, 'INVOICE_PDF_RENDER_BATCH_SIZE', 50)
+
+    @staticmethod
+    def schedule_pdf_rendering(invoice_ids):
+        """Queue PDF rendering in batches, skipping invoices whose render is already queued.
+
+        Returns the ids that were queued.
+        """
+        from .tasks import render_invoice_pdfs
+
+        queued = []
+        for invoice_id in invoice_ids:
+            try:
+                if cache.add(InvoiceService.RENDER_LOCK_KEY.format(invoice_id), 1, InvoiceService.RENDER_LOCK_TIMEOUT):
+                    queued.append(invoice_id)
+            except Exception as e:
+                logger.warning(f'Invoice render lock unavailable: {str(e)}')
+                queued.append(invoice_id)
+
+        batch_size = InvoiceService.render_batch_size()
+        for start in range(0, len(queued), batch_size):
+            batch = queued[start:start + batch_size]
+            try:
+                render_invoice_pdfs.delay(batch)
+            except Exception as e:
+                logger.error(f'Failed to queue invoice PDF rendering for {batch}: {str(e)}')
+                cache.delete_many([InvoiceService.RENDER_LOCK_KEY.format(invoice_id) for invoice_id in batch])
+        return queued
+
+    @staticmethod
+    def render_pdfs(invoice_ids):
+        """Render and store the PDFs of a batch of invoices; returns the number rendered"""
+        invoices = Invoice.objects.filter(
+            Q(pdf_file='') | Q(pdf_file__isnull=True), id__in=invoice_ids
+        ).select_related('user', 'billing_cycle')
+        rendered = 0
+        try:
+            for invoice in invoices:
+                try:
+                    pdf_buffer = InvoiceService.generate_invoice_pdf(invoice)
+                    invoice.pdf_file.save(f'invoice_{invoice.invoice_number}.pdf', pdf_buffer, save=False)
+                    Invoice.objects.filter(pk=invoice.pk).update(pdf_file=invoice.pdf_file.name)
+                    rendered += 1
+                except Exception as e:
+                    logger.error(f'Failed to render PDF for invoice {invoice.invoice_number}: {str(e)}')
+        finally:
+            cache.delete_many([InvoiceService.RENDER_LOCK_KEY.format(invoice_id) for invoice_id in invoice_ids])
+        return rendered
+
     @staticmethod
     def create_invoice_for_billing_cycle(billing_cycle, vps_instances):
-        """Create an invoice for a billing cycle"""
+        """Create an invoice for a billing cycle; its PDF is rendered in the background"""
         invoice = Invoice.objects.create(
             user=billing_cycle.user,
             billing_cycle=billing_cycle,
@@ -361,10 +1009,7 @@ class InvoiceService:
             amount=billing_cycle.amount,
             due_date=billing_cycle.end_date,
         )
-
-        # Generate PDF
-        pdf_buffer = InvoiceService.generate_invoice_pdf(invoice)
-        invoice.pdf_file.save(f'invoice_{invoice.invoice_number}.pdf', pdf_buffer, save=True)
+        transaction.on_commit(lambda: InvoiceService.schedule_pdf_rendering([invoice.id]))
 
         return invoice
 
@@ -372,91 +1017,225 @@ class InvoiceService:
 class AutoRenewalService:
     """Service for handling automatic VPS renewal"""
 
+    LOCK_NAME = 'billing:auto_renewal'
+
     @staticmethod
     def process_auto_renewal_for_user(user):
         """Process auto-renewal for all expired VPS instances of a user"""
-        expired_instances = VPSInstance.objects.filter(
-            user=user,
-            status='active'
-        ).filter(expires_at__lt=timezone.now())
-
-        if not expired_instances.exists():
+        results = BulkAutoRenewalService.process(user_ids=[user.pk])
+        if not results:
             return {'success': True, 'message': 'No expired instances to renew', 'renewed_count': 0}
 
-        renewed_count = 0
-        failed_count = 0
-        total_cost = Decimal('0')
-
-        try:
-            with transaction.atomic():
-                wallet = Wallet.objects.get(user=user)
-
-                for instance in expired_instances:
-                    # Calculate renewal cost (30 days)
-                    monthly_cost = instance.plan.price_per_month
-                    renewal_cost = monthly_cost  # For 30 days
+        result = results[0]
+        if not result['success']:
+            return {'success': False, 'message': result['message'], 'renewed_count': 0}
+        return {key: value for key, value in result.items() if key != 'user'}
 
-                    if wallet.balance >= renewal_cost:
-                        # Deduct from wallet
-                        wallet.withdraw(renewal_cost, f'Auto-renewal for VPS {instance.instance_id} (30 days)')
+    @staticmethod
+    def process_auto_renewal_for_all_users(lock=None):
+        """Process auto-renewal for all users with expired VPS instances"""
+        return BulkAutoRenewalService.process(lock=lock)
 
-                        # Renew the instance
-                        instance.renew(days=30)
-                        renewed_count += 1
-                        total_cost += renewal_cost
 
-                        # Send success notification
-                        NotificationService.send_renewal_success_notification(user, instance, renewal_cost)
-                    else:
-                        # Insufficient funds - suspend the instance
-                        instance.status = 'suspended'
-                        instance.save()
-                        failed_count += 1
+class BulkAutoRenewalService:
+    """Set-based auto-renewal engine.
 
-                        # Send failure notification
-                        NotificationService.send_renewal_failure_notification(user, instance)
+    Due instances (active, expires_at in the past) are read in batches in
+    (expires_at, id) order, which the status/expires_at index serves
+    directly. For each batch the wallets are locked once, every wallet
+    renews its due instances oldest first while the balance lasts and the
+    rest are suspended. The batch is then written with one UPDATE per
+    outcome, one debit UPDATE per distinct amount and one bulk_create for
+    ledger rows and notifications, so the cost of a run grows with the
+    number of due instances rather than with users times queries.
+    """
 
-                return {
-                    'success': True,
-                    'message': f'Renewed {renewed_count} instances, suspended {failed_count} due to insufficient funds',
-                    'renewed_count': renewed_count,
-                    'suspended_count': failed_count,
-                    'total_cost': total_cost
-                }
+    BATCH_SIZE = 500
+    RENEWAL_DAYS = 30
 
-        except Wallet.DoesNotExist:
-            return {'success': False, 'message': 'User wallet not found', 'renewed_count': 0}
+    @staticmethod
+    def due_instances(now, user_ids=None, instance_ids=None):
+        """Active instances whose paid period has ended"""
+        instances = VPSInstance.objects.filter(status='active', expires_at__lt=now)
+        if user_ids is not None:
+            instances = instances.filter(user_id__in=user_ids)
+        if instance_ids is not None:
+            instances = instances.filter(id__in=instance_ids)
+        return instances
 
     @staticmethod
-    def process_auto_renewal_for_all_users():
-        """Process auto-renewal for all users with expired VPS instances"""
-        results = []
-        users_with_expired_vps = VPSInstance.objects.filter(
-            status='active',
-            expires_at__lt=timezone.now()
-        ).values_list('user', flat=True).distinct()
+    def process(now=None, user_ids=None, instance_ids=None, lock=None):
+        """Renew or suspend every due instance and return one result per user.
 
-        for user_id in users_with_expired_vps:
-            from django.contrib.auth.models import User
-            try:
-                user = User.objects.get(id=user_id)
-                result = AutoRenewalService.process_auto_renewal_for_user(user)
-                results.append({
-                    'user': user.username,
-                    'success': result['success'],
-                    'message': result['message'],
-                    'renewed_count': result.get('renewed_count', 0),
-                    'suspended_count': result.get('suspended_count', 0),
-                    'total_cost': result.get('total_cost', Decimal('0'))
+        The expiry timers pass `instance_ids`; without it this is the full
+        sweep used as a daily backstop. A given DistributedLock is checked
+        before every batch and fenced inside every batch's transaction.
+        """
+        now = now or timezone.now()
+        due = BulkAutoRenewalService.due_instances(now, user_ids, instance_ids).order_by('expires_at', 'id').values(
+            'id', 'user_id', 'user__username', 'instance_id', 'expires_at', 'plan__name',
+            monthly_price=VPSInstance.monthly_price_expression()
+        )
+
+        results = {}
+        after = None
+        while True:
+            page = due
+            if after is not None:
+                page = page.filter(Q(expires_at__gt=after[0]) | Q(expires_at=after[0], id__gt=after[1]))
+            rows = list(page[:BulkAutoRenewalService.BATCH_SIZE])
+            if not rows:
+                break
+            after = (rows[-1]['expires_at'], rows[-1]['id'])
+
+            if lock is not None:
+                lock.check()
+            for user_id, outcome in BulkAutoRenewalService.renew_batch(rows, now, lock).items():
+                result = results.setdefault(user_id, {
+                    'user': outcome['user'],
+                    'success': True,
+                    'renewed_count': 0,
+                    'suspended_count': 0,
+                    'total_cost': Decimal('0'),
                 })
-            except User.DoesNotExist:
-                results.append({
-                    'user': f'User {user_id}',
-                    'success': False,
-                    'message': 'User not found',
+                if outcome.get('error'):
+                    result['success'] = False
+                    result['message'] = outcome['error']
+                    continue
+                result['renewed_count'] += outcome['renewed_count']
+                result['suspended_count'] += outcome['suspended_count']
+                result['total_cost'] += outcome['total_cost']
+
+        for result in results.values():
+            result.setdefault(
+                'message',
+                f"Renewed {result['renewed_count']} instances, "
+                f"suspended {result['suspended_count']} due to insufficient funds"
+            )
+        return list(results.values())
+
+    @staticmethod
+    def renew_batch(rows, now, lock=None):
+        """Apply renewals and suspensions for one batch of due instance rows"""
+        from dashboard.models import DashboardSummary
+        from vps.services.expiry import ExpiryScheduler
+
+        new_expiry = now + timedelta(days=BulkAutoRenewalService.RENEWAL_DAYS)
+        outcomes = {}
+        renewed = []
+        suspended = []
+        debits = {}
+
+        with transaction.atomic():
+            if lock is not None:
+                lock.fence()
+            wallets = {
+                user_id: [wallet_id, balance]
+                for wallet_id, user_id, balance in Wallet.objects.select_for_update().filter(
+                    user_id__in={row['user_id'] for row in rows}
+                ).values_list('id', 'user_id', 'balance')
+            }
+            # Skip rows a concurrent renewal already handled
+            still_due = set(BulkAutoRenewalService.due_instances(now).select_for_update().filter(
+                id__in=[row['id'] for row in rows]
+            ).values_list('id', flat=True))
+
+            for row in rows:
+                if row['id'] not in still_due:
+                    continue
+                outcome = outcomes.setdefault(row['user_id'], {
+                    'user': row['user__username'],
                     'renewed_count': 0,
                     'suspended_count': 0,
-                    'total_cost': Decimal('0')
+                    'total_cost': Decimal('0'),
                 })
+                wallet = wallets.get(row['user_id'])
+                if wallet is None:
+                    outcome['error'] = 'User wallet not found'
+                    continue
+
+                cost = row['monthly_price']
+                if wallet[1] >= cost:
+                    wallet[1] -= cost
+                    debits[wallet[0]] = debits.get(wallet[0], Decimal('0')) + cost
+                    outcome['renewed_count'] += 1
+                    outcome['total_cost'] += cost
+                    renewed.append((row, wallet[0], cost))
+                else:
+                    outcome['suspended_count'] += 1
+                    suspended.append(row)
+
+            # Group wallets by total debit so each distinct amount is a single UPDATE
+            by_amount = {}
+            for wallet_id, amount in debits.items():
+                by_amount.setdefault(amount, []).append(wallet_id)
+            for amount, wallet_ids in by_amount.items():
+                Wallet.objects.filter(id__in=wallet_ids, balance__gte=amount).update(balance=F('balance') - amount)
+            balances_changed.send(sender=Wallet, wallet_ids=list(debits))
+
+            Transaction.objects.bulk_create([
+                Transaction(
+                    wallet_id=wallet_id,
+                    amount=cost,
+                    transaction_type='withdraw',
+                    description=(
+                        f'Auto-renewal for VPS {row["instance_id"]} '
+                        f'({BulkAutoRenewalService.RENEWAL_DAYS} days)'
+                    ),
+                    status='completed',
+                    reference_id=row['instance_id']
+                )
+                for row, wallet_id, cost in renewed
+            ])
+
+            # Every renewal in the batch starts from now, so they share one expiry
+            if renewed:
+                VPSInstance.objects.filter(id__in=[row['id'] for row, _, _ in renewed]).update(expires_at=new_expiry)
+            if suspended:
+                VPSInstance.objects.filter(id__in=[row['id'] for row in suspended]).update(status='suspended')
+            # update() skips post_save, so refresh the affected dashboard summaries here
+            DashboardSummary.refresh_vps(
+                [row['user_id'] for row, _, _ in renewed] + [row['user_id'] for row in suspended]
+            )
 
-        return results
\ No newline at end of file
+            BulkAutoRenewalService.notify(renewed, suspended, new_expiry)
+
+            # update() skips post_save, so move the timers explicitly
+            ExpiryScheduler.on_commit(ExpiryScheduler.schedule, [(row['id'], new_expiry) for row, _, _ in renewed])
+            ExpiryScheduler.on_commit(ExpiryScheduler.cancel, [row['id'] for row in suspended])
+
+        return outcomes
+
+    @staticmethod
+    def notify(renewed, suspended, new_expiry):
+        """Queue renewal and suspension notices in the digest or the outbox"""
+        user_ids = {row['user_id'] for row, _, _ in renewed} | {row['user_id'] for row in suspended}
+        if not user_ids:
+            return
+        users = User.objects.only('id', 'username', 'email').in_bulk(list(user_ids))
+
+        if NotificationDigestService.enabled():
+            NotificationDigestService.record_events([
+                NotificationService.build_renewal_success_event(
+                    users[row['user_id']], row['id'], row['instance_id'], cost, new_expiry
+                )
+                for row, _, cost in renewed
+            ] + [
+                NotificationService.build_renewal_failure_event(
+                    users[row['user_id']], row['id'], row['instance_id']
+                )
+                for row in suspended
+            ])
+            return
+
+        NotificationService.queue_emails([
+            NotificationService.build_renewal_success_email(
+                users[row['user_id']], row['instance_id'], row['plan__name'], cost, new_expiry
+            )
+            for row, _, cost in renewed
+        ] + [
+            NotificationService.build_renewal_failure_email(
+                users[row['user_id']], row['instance_id'], row['plan__name']
+            )
+            for row in suspended
+        ])
@@ -0,0 +1,92 @@
+from datetime import datetime
+from celery import shared_task
+from django.conf import settings
+from grandvps.locks import DistributedLock, single_flight
+from .services import (
+    BulkHourlyBillingService, NotificationOutboxService, NotificationDigestService,
+    InvoiceService, AutoRenewalService
+)
+
+
+@shared_task
+def process_hourly_billing_shard(start_user_id, end_user_id, hours=None, now=None, lock_token=None):
+    """Bill the users of one user-id shard and return JSON-serializable results.
+
+    `lock_token` is the billing lock acquisition handed off by the parent run.
+    """
+    lock = None
+    if lock_token is not None:
+        lock = DistributedLock.adopt(BulkHourlyBillingService.LOCK_NAME, lock_token)
+    results = BulkHourlyBillingService.process(
+        hours,
+        user_id_range=(start_user_id, end_user_id),
+        now=datetime.fromisoformat(now) if now else None,
+        lock=lock
+    )
+    for result in results:
+        result['total_deducted'] = str(result['total_deducted'])
+    return results
+
+
+@shared_task
+@single_flight(BulkHourlyBillingService.LOCK_NAME, pass_lock=True)
+def process_hourly_billing(hours=None, lock=None):
+    """Scheduled hourly billing; fans out to shard tasks when BILLING_SHARDS > 1.
+
+    By default every hour since each instance's last billed hour is charged,
+    so runs missed during an outage are caught up without a manual --hours.
+    """
+    shards = getattr(settings, 'BILLING_SHARDS', 1)
+    if shards > 1:
+        return {'shards': BulkHourlyBillingService.dispatch_sharded(hours, shards, lock=lock)}
+
+    results = BulkHourlyBillingService.process(hours, lock=lock)
+    return {
+        'billed': sum(1 for result in results if result['success']),
+        'failed': sum(1 for result in results if not result['success']),
+        'total_deducted': str(sum(result['total_deducted'] for result in results)),
+    }
+
+
+@shared_task
+def release_hourly_billing_lock(lock_token):
+    """Chord callback releasing the billing lock once every shard has finished"""
+    DistributedLock.adopt(BulkHourlyBillingService.LOCK_NAME, lock_token).release()
+
+
+@shared_task
+@single_flight(AutoRenewalService.LOCK_NAME, pass_lock=True)
+def process_auto_renewals(lock=None):
+    """Scheduled renewal of expired VPS instances"""
+    results = AutoRenewalService.process_auto_renewal_for_all_users(lock=lock)
+    return {
+        'users': len(results),
+        'renewed': sum(result['renewed_count'] for result in results),
+        'suspended': sum(result['suspended_count'] for result in results),
+    }
+
+
+@shared_task(bind=True, max_retries=5, default_retry_delay=60)
+def drain_notification_outbox(self, batch_size=None):
+    """Send queued notification emails, re-queueing itself while full batches remain"""
+    try:
+        result = NotificationOutboxService.drain(batch_size)
+    except Exception as exc:
+        # SMTP unavailable: back off and try the same batch again
+        raise self.retry(exc=exc, countdown=self.default_retry_delay * 2 ** self.request.retries)
+
+    if result['claimed'] and result['claimed'] >= (batch_size or NotificationOutboxService.batch_size()):
+        drain_notification_outbox.delay(batch_size)
+    return result
+
+
+@shared_task
+def flush_notification_digests():
+    """Roll pending billing events into one digest email per user"""
+    return NotificationDigestService.flush()
+
+
+@shared_task
+def render_invoice_pdfs(invoice_ids):
+    """Render a batch of invoice PDFs; routed to the CPU-bound invoice_pdfs queue"""
+    return InvoiceService.render_pdfs(invoice_ids)
@@ -1,17 +1,27 @@
-from django.test import TestCase, Client
+from django.db import connection
+from django.test import TestCase, Client, override_settings
+from django.core.cache import cache
 from django.contrib.auth.models import User
 from django.utils import timezone
 from django.core.management import call_command
 from django.core.files.base import ContentFile
 from decimal import Decimal
-from unittest.mock import patch, MagicMock
+from unittest import skipUnless
+from unittest.mock import patch, MagicMock, ANY
 from io import BytesIO
 import datetime
+import os
 
-from .models import BillingCycle, Invoice
+from .models import BillingCycle, Invoice, InvoiceSequence, BillingPeriod, NotificationOutbox, NotificationEvent
 from vps.models import VPSInstance, VPSPlan
 from wallet.models import Wallet, Transaction
-from .services import HourlyBillingService, NotificationService, InvoiceService, AutoRenewalService
+from .pricing import PricingTable
+from grandvps.locks import DistributedLock, LockLost
+from grandvps.locking.models import JobFence
+from .services import (
+    HourlyBillingService, BulkHourlyBillingService, NotificationService, NotificationOutboxService,
+    NotificationDigestService, InvoiceService, AutoRenewalService
+)
 
 
 class BillingTestCase(TestCase):
@@ -135,6 +145,35 @@ class BillingTestCase(TestCase):
         number2 = Invoice.generate_invoice_number()
         self.assertNotEqual(number, number2)
 
+    def test_invoice_numbers_reserved_in_blocks(self):
+        """Test block reservation hands out consecutive numbers after earlier ones"""
+        first = Invoice.generate_invoice_number()
+        block = Invoice.reserve_invoice_numbers(3)
+        sequence = [int(number.rsplit('-', 1)[-1]) for number in [first] + block]
+        self.assertEqual(sequence, list(range(sequence[0], sequence[0] + 4)))
+
+    def test_invoice_sequence_continues_existing_numbers(self):
+        """Test a new day's counter starts after invoices numbered before it existed"""
+        today = timezone.localdate()
+        Invoice.objects.create(
+            user=self.user,
+            invoice_number=Invoice.format_invoice_number(today, 41),
+            amount=Decimal('1.00'),
+            due_date=today
+        )
+        self.assertEqual(Invoice.generate_invoice_number(), Invoice.format_invoice_number(today, 42))
+
+    def test_invoice_sequence_single_statement(self):
+        """Test allocating numbers for an existing day is one UPDATE"""
+        from django.test.utils import CaptureQueriesContext
+
+        Invoice.generate_invoice_number()
+        with CaptureQueriesContext(connection) as queries:
+            InvoiceSequence.reserve(timezone.localdate(), 100)
+        statements = [query['sql'] for query in queries if 'SAVEPOINT' not in query['sql']]
+        self.assertEqual(len(statements), 1)
+        self.assertTrue(statements[0].startswith('UPDATE'))
+
     def test_invoice_calculate_hourly_cost(self):
         """Test Invoice.calculate_hourly_cost method"""
         # Monthly cost 20.00, hourly base = 20/720 ≈ 0.02778, with 10% margin ≈ 0.03056
@@ -151,6 +190,23 @@ class BillingTestCase(TestCase):
         result = self.invoice.calculate_total_cost(instances, hours)
         self.assertEqual(result, expected)
 
+    def test_pricing_table_prices_queryset_in_one_query(self):
+        """Test the pricing table prices a whole queryset without loading plans"""
+        PricingTable.current()
+        with self.assertNumQueries(1):
+            costs = PricingTable.current().price_instances(VPSInstance.objects.filter(user=self.user))
+
+        self.assertEqual(costs, {self.vps_instance.id: Decimal('0.03')})
+
+    def test_pricing_table_invalidated_on_plan_save(self):
+        """Test saving a plan refreshes its cached hourly rate"""
+        self.assertEqual(PricingTable.current().hourly_rate_for(self.plan.id), Decimal('0.03'))
+
+        self.plan.price_per_month = Decimal('72.00')
+        self.plan.save()
+
+        self.assertEqual(PricingTable.current().hourly_rate_for(self.plan.id), Decimal('0.11'))
+
     # View Tests
     def test_billing_dashboard_view(self):
         """Test billing dashboard view"""
@@ -192,6 +248,23 @@ class BillingTestCase(TestCase):
         self.assertEqual(response.status_code, 200)
         self.assertEqual(response['Content-Type'], 'application/pdf')
         self.assertIn('attachment', response['Content-Disposition'])
+        self.assertTrue(response.streaming)
+        self.assertEqual(b''.join(response.streaming_content), b'fake pdf content')
+
+    @override_settings(MEDIA_X_ACCEL_REDIRECT_PREFIX='/protected-media/')
+    def test_download_invoice_view_x_accel_redirect(self):
+        """Test downloads are handed to nginx when X-Accel-Redirect is configured"""
+        self.invoice.pdf_file.save('invoice_test.pdf', ContentFile(b'pdf'), save=True)
+
+        self.client.login(username='testuser', password='testpass123')
+        response = self.client.get(f'/billing/invoice/{self.invoice.id}/download/')
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['X-Accel-Redirect'], f'/protected-media/{self.invoice.pdf_file.name}')
+        self.assertEqual(response.content, b'')
+        self.assertIn('attachment', response['Content-Disposition'])
+        self.assertIn('no-store', response['Cache-Control'])
+        self.assertIn('private', response['Cache-Control'])
 
     def test_billing_history_view(self):
         """Test billing history view"""
@@ -205,6 +278,38 @@ class BillingTestCase(TestCase):
         self.assertIn('paid_amount', response.context)
         self.assertIn('pending_amount', response.context)
 
+    @override_settings(HISTORY_PAGE_SIZE=1)
+    def test_billing_history_view_keyset_cursor(self):
+        """Test billing history pages follow the cursor without repeating rows"""
+        second = Invoice.objects.create(
+            user=self.user,
+            amount=Decimal('5.00'),
+            due_date=timezone.now().date() + datetime.timedelta(days=30)
+        )
+        Invoice.objects.filter(pk=second.pk).update(issued_date=self.invoice.issued_date)
+
+        self.client.login(username='testuser', password='testpass123')
+        first_page = self.client.get('/billing/history/').context['page']
+        self.assertTrue(first_page.has_next)
+        second_page = self.client.get('/billing/history/', {'cursor': first_page.next_cursor}).context['page']
+        self.assertFalse(second_page.has_next)
+        self.assertEqual(
+            {i.pk for i in first_page} | {i.pk for i in second_page},
+            {self.invoice.pk, second.pk}
+        )
+
+    def test_export_invoices_view(self):
+        """Test invoice export streams a CSV of the user's invoices"""
+        self.client.login(username='testuser', password='testpass123')
+        response = self.client.get('/billing/history/export/', {'format': 'csv'})
+
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.streaming)
+        self.assertIn('invoices.csv', response['Content-Disposition'])
+        lines = b''.join(response.streaming_content).decode().splitlines()
+        self.assertEqual(lines[0], 'invoice_number,issued_date,due_date,amount,status')
+        self.assertIn(self.invoice.invoice_number, lines[1])
+
     def test_billing_analytics_view(self):
         """Test billing analytics view"""
         self.client.login(username='testuser', password='testpass123')
@@ -273,6 +378,159 @@ class BillingTestCase(TestCase):
         self.assertEqual(results[0]['user'], 'testuser')
         self.assertTrue(results[0]['success'])
 
+    def test_bulk_hourly_billing_multiple_users(self):
+        """Test bulk billing debits sufficient wallets and skips the rest"""
+        VPSInstance.objects.create(
+            user=self.other_user,
+            plan=self.plan,
+            instance_id='other-instance-123',
+            status='active',
+            expires_at=timezone.now() + datetime.timedelta(days=30)
+        )
+        other_wallet = Wallet.objects.create(user=self.other_user, balance=Decimal('0.01'))
+        VPSInstance.objects.update(created_at=timezone.now() - datetime.timedelta(hours=3))
+
+        results = BulkHourlyBillingService.process(hours=2)
+
+        by_user = {result['user']: result for result in results}
+        self.assertTrue(by_user['testuser']['success'])
+        self.assertEqual(by_user['testuser']['total_deducted'], Decimal('0.06'))
+        self.assertFalse(by_user['otheruser']['success'])
+        self.assertIn('Insufficient balance', by_user['otheruser']['message'])
+
+        self.wallet.refresh_from_db()
+        other_wallet.refresh_from_db()
+        self.assertEqual(self.wallet.balance, Decimal('99.94'))
+        self.assertEqual(other_wallet.balance, Decimal('0.01'))
+        self.assertEqual(Transaction.objects.filter(wallet=self.wallet, transaction_type='withdraw').count(), 1)
+        self.assertFalse(Transaction.objects.filter(wallet=other_wallet).exists())
+        self.assertEqual(NotificationEvent.objects.filter(user=self.user, event_type='hourly_billing').count(), 1)
+        self.assertFalse(NotificationEvent.objects.filter(user=self.other_user).exists())
+
+    def test_bulk_hourly_billing_query_count_independent_of_users(self):
+        """Test bulk billing round-trips do not grow with the number of users"""
+        from django.db import connection
+        from django.test.utils import CaptureQueriesContext
+
+        def add_users(start, count):
+            for i in range(start, start + count):
+                user = User.objects.create(username=f'bulkuser{i}', email=f'bulk{i}@example.com')
+                Wallet.objects.create(user=user, balance=Decimal('50.00'))
+                VPSInstance.objects.create(
+                    user=user,
+                    plan=self.plan,
+                    instance_id=f'bulk-instance-{i}',
+                    status='active',
+                    expires_at=timezone.now() + datetime.timedelta(days=30)
+                )
+
+        add_users(0, 2)
+        PricingTable.current()
+        with CaptureQueriesContext(connection) as small_run:
+            BulkHourlyBillingService.process(hours=1)
+
+        add_users(2, 10)
+        with CaptureQueriesContext(connection) as large_run:
+            BulkHourlyBillingService.process(hours=1)
+
+        self.assertEqual(len(small_run), len(large_run))
+
+    def test_bulk_hourly_billing_is_idempotent(self):
+        """Test re-running billing within the same hour charges nothing"""
+        first = BulkHourlyBillingService.process(hours=1)
+        second = BulkHourlyBillingService.process(hours=1)
+
+        self.assertEqual(first[0]['total_deducted'], Decimal('0.03'))
+        self.assertTrue(second[0]['success'])
+        self.assertEqual(second[0]['total_deducted'], Decimal('0'))
+        self.assertIn('already billed', second[0]['message'])
+
+        self.wallet.refresh_from_db()
+        self.assertEqual(self.wallet.balance, Decimal('99.97'))
+        self.assertEqual(BillingPeriod.objects.filter(instance=self.vps_instance).count(), 1)
+        self.assertEqual(NotificationEvent.objects.filter(user=self.user).count(), 1)
+
+    def test_bulk_hourly_billing_catches_up_missing_hours(self):
+        """Test catch-up only bills the hours missing from the ledger"""
+        now = timezone.now()
+        VPSInstance.objects.update(created_at=now - datetime.timedelta(hours=10))
+        BillingPeriod.objects.create(
+            instance=self.vps_instance,
+            period_start=BillingPeriod.hour_bucket(now) - datetime.timedelta(hours=1),
+            amount=Decimal('0.03')
+        )
+
+        results = BulkHourlyBillingService.process(hours=4, now=now)
+
+        # 4 hours in the window, one of them already billed
+        self.assertEqual(results[0]['total_deducted'], Decimal('0.09'))
+        self.assertEqual(BillingPeriod.objects.filter(instance=self.vps_instance).count(), 4)
+        self.assertEqual(
+            BillingPeriod.objects.filter(instance=self.vps_instance, transaction__isnull=False).count(), 3
+        )
+
+    def test_bulk_hourly_billing_catches_up_since_last_billed_hour(self):
+        """Test the default run bills the hours missed since the last billed one"""
+        now = timezone.now()
+        VPSInstance.objects.update(created_at=now - datetime.timedelta(hours=10))
+        # Billed 3 hours ago, then the scheduler was down; older gaps stay unbilled
+        BillingPeriod.objects.create(
+            instance=self.vps_instance,
+            period_start=BillingPeriod.hour_bucket(now) - datetime.timedelta(hours=3),
+            amount=Decimal('0.03')
+        )
+
+        results = BulkHourlyBillingService.process(hours=None, now=now)
+
+        self.assertEqual(results[0]['total_deducted'], Decimal('0.09'))
+        self.assertEqual(BillingPeriod.objects.filter(instance=self.vps_instance).count(), 4)
+
+    @override_settings(BILLING_CATCHUP_MAX_HOURS=5)
+    def test_bulk_hourly_billing_catch_up_is_bounded(self):
+        """Test catch-up never looks back further than BILLING_CATCHUP_MAX_HOURS"""
+        now = timezone.now()
+        VPSInstance.objects.update(created_at=now - datetime.timedelta(hours=10))
+
+        results = BulkHourlyBillingService.process(hours=None, now=now)
+
+        self.assertEqual(results[0]['total_deducted'], Decimal('0.15'))
+        self.assertEqual(
+            min(BillingPeriod.objects.values_list('period_start', flat=True)),
+            BillingPeriod.hour_bucket(now) - datetime.timedelta(hours=4)
+        )
+
+    def test_bulk_hourly_billing_shard_user_ranges(self):
+        """Test users with active instances are split into contiguous id ranges"""
+        VPSInstance.objects.create(
+            user=self.other_user,
+            plan=self.plan,
+            instance_id='other-instance-123',
+            status='active',
+            expires_at=timezone.now() + datetime.timedelta(days=30)
+        )
+
+        ranges = BulkHourlyBillingService.shard_user_ranges(4)
+
+        self.assertEqual(ranges, [(self.user.id, self.user.id), (self.other_user.id, self.other_user.id)])
+
+    def test_bulk_hourly_billing_sharded(self):
+        """Test sharded billing merges the per-shard results"""
+        VPSInstance.objects.create(
+            user=self.other_user,
+            plan=self.plan,
+            instance_id='other-instance-123',
+            status='active',
+            expires_at=timezone.now() + datetime.timedelta(days=30)
+        )
+        Wallet.objects.create(user=self.other_user, balance=Decimal('10.00'))
+
+        results = HourlyBillingService.process_hourly_billing_for_all_users(hours=1, shards=2)
+
+        self.assertEqual(sorted(result['user'] for result in results), ['otheruser', 'testuser'])
+        self.assertTrue(all(result['success'] for result in results))
+        self.assertEqual(sum(result['total_deducted'] for result in results), Decimal('0.06'))
+        self.assertEqual(NotificationEvent.objects.filter(event_type='hourly_billing').count(), 2)
+
     @patch('django.core.mail.send_mail')
     def test_notification_service_send_low_balance_notification(self, mock_send_mail):
         """Test sending low balance notification"""
@@ -301,6 +559,81 @@ class BillingTestCase(TestCase):
         args = mock_send_mail.call_args[0]
         self.assertIn('Hourly Billing Completed', args[0])
 
+    @override_settings(NOTIFICATION_DIGEST_WINDOW=None)
+    def test_notification_service_queues_in_outbox(self):
+        """Test notifications are written to the outbox instead of sent inline"""
+        from django.core import mail
+
+        NotificationService.send_low_balance_notification(self.user, Decimal('5.00'), Decimal('10.00'))
+
+        self.assertEqual(len(mail.outbox), 0)
+        queued = NotificationOutbox.objects.get(user=self.user)
+        self.assertEqual(queued.status, 'pending')
+        self.assertEqual(queued.recipient, self.user.email)
+        self.assertIn('Low Wallet Balance', queued.subject)
+
+    @override_settings(NOTIFICATION_DIGEST_WINDOW=None)
+    def test_notification_outbox_drain_sends_batch(self):
+        """Test draining the outbox sends due emails and marks them sent"""
+        from django.core import mail
+
+        NotificationService.send_payment_due_notification(self.user, self.invoice)
+        NotificationService.send_hourly_billing_notification(self.user, Decimal('1.00'), 2)
+
+        with self.settings(NOTIFICATION_OUTBOX_MAX_PER_SECOND=0):
+            result = NotificationOutboxService.drain()
+
+        self.assertEqual(result['sent'], 2)
+        self.assertEqual(len(mail.outbox), 2)
+        self.assertFalse(NotificationOutbox.objects.exclude(status='sent').exists())
+
+    @override_settings(NOTIFICATION_DIGEST_WINDOW=None)
+    @patch('django.core.mail.backends.locmem.EmailBackend.send_messages')
+    def test_notification_outbox_drain_retries_failures(self, mock_send_messages):
+        """Test failed emails are rescheduled with backoff and eventually marked failed"""
+        mock_send_messages.side_effect = Exception('SMTP error')
+        NotificationService.send_payment_due_notification(self.user, self.invoice)
+
+        with self.settings(NOTIFICATION_OUTBOX_MAX_PER_SECOND=0, NOTIFICATION_OUTBOX_MAX_ATTEMPTS=2):
+            NotificationOutboxService.drain()
+            queued = NotificationOutbox.objects.get(user=self.user)
+            self.assertEqual(queued.status, 'pending')
+            self.assertEqual(queued.attempts, 1)
+            self.assertGreater(queued.available_at, timezone.now())
+
+            NotificationOutbox.objects.update(available_at=timezone.now())
+            NotificationOutboxService.drain()
+
+        queued.refresh_from_db()
+        self.assertEqual(queued.status, 'failed')
+        self.assertIn('SMTP error', queued.last_error)
+
+    @override_settings(NOTIFICATION_DIGEST_WINDOW='daily')
+    def test_notification_digest_coalesces_events(self):
+        """Test billing events are deduplicated and flushed as one digest per window"""
+        for _ in range(3):
+            NotificationService.send_hourly_billing_notification(self.user, Decimal('0.03'), 1)
+            NotificationService.send_low_balance_notification(self.user, Decimal('5.00'), Decimal('10.00'))
+
+        self.assertFalse(NotificationOutbox.objects.exists())
+        self.assertEqual(NotificationEvent.objects.filter(event_type='hourly_billing').count(), 3)
+        self.assertEqual(NotificationEvent.objects.filter(event_type='low_balance').count(), 1)
+
+        # Nothing is due until the oldest event is a full window old
+        self.assertEqual(NotificationDigestService.flush(), 0)
+
+        digests = NotificationDigestService.flush(now=timezone.now() + datetime.timedelta(days=1, minutes=1))
+
+        self.assertEqual(digests, 1)
+        digest = NotificationOutbox.objects.get(user=self.user)
+        self.assertIn('3 charges totalling $0.09', digest.body)
+        self.assertEqual(digest.body.count('below the recommended'), 1)
+        self.assertFalse(NotificationEvent.objects.filter(digested_at__isnull=True).exists())
+
+        # A new window starts a fresh, deduplicated set of events
+        NotificationService.send_low_balance_notification(self.user, Decimal('5.00'), Decimal('10.00'))
+        self.assertEqual(NotificationEvent.objects.filter(digested_at__isnull=True).count(), 1)
+
     def test_notification_service_check_wallet_balance_for_renewal(self):
         """Test checking wallet balance for renewal"""
         result = NotificationService.check_wallet_balance_for_renewal(self.user)
@@ -322,12 +655,46 @@ class BillingTestCase(TestCase):
         mock_pdf = BytesIO(b'fake pdf')
         mock_generate_pdf.return_value = mock_pdf
 
-        invoice = InvoiceService.create_invoice_for_billing_cycle(self.billing_cycle, [self.vps_instance])
+        with self.captureOnCommitCallbacks() as callbacks:
+            invoice = InvoiceService.create_invoice_for_billing_cycle(self.billing_cycle, [self.vps_instance])
 
         self.assertEqual(invoice.user, self.user)
         self.assertEqual(invoice.billing_cycle, self.billing_cycle)
         self.assertEqual(invoice.amount, self.billing_cycle.amount)
-        self.assertIsNotNone(invoice.pdf_file)
+        # The PDF is not rendered inside the billing flow
+        mock_generate_pdf.assert_not_called()
+
+        for callback in callbacks:
+            callback()
+        invoice.refresh_from_db()
+        self.assertTrue(invoice.pdf_file)
+
+    @patch('billing.tasks.render_invoice_pdfs.delay')
+    def test_invoice_pdf_rendering_batched_and_deduplicated(self, mock_delay):
+        """Test invoice PDFs are queued in batches and a queued invoice is not queued twice"""
+        # Render locks stay set because the mocked task never releases them
+        self.addCleanup(cache.clear)
+        invoices = [
+            Invoice.objects.create(
+                user=self.user,
+                invoice_number=Invoice.generate_invoice_number(),
+                amount=Decimal('10.00'),
+                due_date=timezone.now().date() + datetime.timedelta(days=30)
+            )
+            for _ in range(5)
+        ]
+        with self.settings(INVOICE_PDF_RENDER_BATCH_SIZE=2):
+            InvoiceService.schedule_pdf_rendering([invoice.id for invoice in invoices])
+
+        self.assertEqual([len(call.args[0]) for call in mock_delay.call_args_list], [2, 2, 1])
+        self.assertEqual(InvoiceService.schedule_pdf_rendering([invoices[0].id]), [])
+
+    def test_invoice_pdf_styles_built_once(self):
+        """Test PDF styles are shared between renders"""
+        InvoiceService.generate_invoice_pdf(self.invoice)
+        with patch('billing.services.getSampleStyleSheet') as mock_styles:
+            InvoiceService.generate_invoice_pdf(self.invoice)
+        mock_styles.assert_not_called()
 
     @patch('billing.services.NotificationService.send_renewal_success_notification')
     def test_auto_renewal_service_process_for_user_success(self, mock_notify):
@@ -411,6 +778,113 @@ class BillingTestCase(TestCase):
         self.assertIn('DRY RUN MODE', output)
         self.assertIn('This was a dry run', output)
 
+    # Periodic Task Tests
+    def test_process_hourly_billing_task(self):
+        """Test the scheduled billing task bills in-process and returns a summary"""
+        from .tasks import process_hourly_billing
+        cache.clear()
+
+        result = process_hourly_billing()
+
+        self.assertEqual(result['billed'], 1)
+        self.assertEqual(result['failed'], 0)
+        self.assertEqual(Decimal(result['total_deducted']), Decimal('0.03'))
+
+    def test_process_hourly_billing_task_skips_overlapping_run(self):
+        """Test a run is skipped while another run holds the billing lock"""
+        from .tasks import process_hourly_billing
+        cache.clear()
+        self.addCleanup(cache.clear)
+        other_run = DistributedLock(BulkHourlyBillingService.LOCK_NAME, ttl=60)
+        self.assertTrue(other_run.acquire())
+        self.addCleanup(other_run.release)
+
+        self.assertIsNone(process_hourly_billing())
+        self.assertFalse(Transaction.objects.filter(transaction_type='withdraw').exists())
+
+    def test_bulk_billing_stops_when_lock_is_lost(self):
+        """Test a run whose lease was taken over bills nothing further"""
+        cache.clear()
+        self.addCleanup(cache.clear)
+        lock = DistributedLock(BulkHourlyBillingService.LOCK_NAME, ttl=60)
+        self.assertTrue(lock.acquire())
+        self.addCleanup(lock.release)
+        # Simulate the lease expiring and a newer run taking the lock
+        cache.delete(f'grandvps:lock:{BulkHourlyBillingService.LOCK_NAME}')
+
+        with self.assertRaises(LockLost):
+            BulkHourlyBillingService.process(1, lock=lock)
+        self.assertFalse(Transaction.objects.filter(transaction_type='withdraw').exists())
+
+    @override_settings(BILLING_SHARDS=4)
+    @patch('billing.services.BulkHourlyBillingService.dispatch_sharded', return_value=1)
+    def test_process_hourly_billing_task_sharded(self, mock_dispatch):
+        """Test the scheduled task dispatches shards without waiting on them"""
+        from .tasks import process_hourly_billing
+        cache.clear()
+
+        self.assertEqual(process_hourly_billing(), {'shards': 1})
+        mock_dispatch.assert_called_once_with(None, 4, lock=ANY)
+
+    @override_settings(BILLING_SHARDS=2)
+    def test_sharded_billing_holds_lock_until_shards_finish(self):
+        """Test the billing lock stays held while shards bill and is released afterwards"""
+        from .tasks import process_hourly_billing
+        cache.clear()
+        self.addCleanup(cache.clear)
+        lock_key = f'grandvps:lock:{BulkHourlyBillingService.LOCK_NAME}'
+        bill_batch = BulkHourlyBillingService.bill_batch
+        held = []
+
+        def record_holder(batch, window, lock=None):
+            held.append((cache.get(lock_key), lock.token))
+            return bill_batch(batch, window, lock)
+
+        with patch('billing.services.BulkHourlyBillingService.bill_batch', side_effect=record_holder):
+            self.assertEqual(process_hourly_billing(), {'shards': 1})
+
+        token = held[0][1]
+        self.assertEqual(held, [(token, token)])
+        self.assertEqual(JobFence.objects.get(name=BulkHourlyBillingService.LOCK_NAME).token, token)
+        self.assertIsNone(cache.get(lock_key))
+        self.assertTrue(Transaction.objects.filter(transaction_type='withdraw').exists())
+
+    def test_bulk_billing_is_fenced_against_newer_holder(self):
+        """Test a stale holder that still passes check() cannot commit after a newer run wrote"""
+        cache.clear()
+        self.addCleanup(cache.clear)
+        lock = DistributedLock(BulkHourlyBillingService.LOCK_NAME, ttl=60)
+        self.assertTrue(lock.acquire())
+        self.addCleanup(lock.release)
+        JobFence.objects.create(name=BulkHourlyBillingService.LOCK_NAME, token=lock.token + 1)
+
+        with self.assertRaises(LockLost):
+            BulkHourlyBillingService.process(1, lock=lock)
+        self.assertFalse(Transaction.objects.filter(transaction_type='withdraw').exists())
+
+    def test_beat_schedule_tasks_are_registered(self):
+        """Test every beat entry dispatches a task Celery knows about"""
+        from django.conf import settings
+        from grandvps.celery import app
+
+        app.loader.import_default_modules()
+        for entry in settings.CELERY_BEAT_SCHEDULE.values():
+            self.assertIn(entry['task'], app.tasks)
+            self.assertIn(entry['kwargs']['task_name'], app.tasks)
+
+    @patch('grandvps.celery.app.send_task')
+    def test_dispatch_with_jitter(self, mock_send):
+        """Test periodic runs are queued with a bounded random delay"""
+        from grandvps.celery import dispatch_with_jitter
+
+        dispatch_with_jitter('billing.tasks.process_hourly_billing', {'hours': 2}, jitter=30, expires=60)
+
+        args, kwargs = mock_send.call_args
+        self.assertEqual(args, ('billing.tasks.process_hourly_billing',))
+        self.assertEqual(kwargs['kwargs'], {'hours': 2})
+        self.assertTrue(0 <= kwargs['countdown'] <= 30)
+        self.assertAlmostEqual(kwargs['expires'], kwargs['countdown'] + 60)
+
     # Edge Cases and Validation Tests
     def test_billing_cycle_invalid_amount(self):
         """Test BillingCycle with invalid amount"""
@@ -506,3 +980,174 @@ class BillingTestCase(TestCase):
         # Check wallet
         self.wallet.refresh_from_db()
         self.assertEqual(self.wallet.balance, Decimal('60.00'))  # 100 - 40
+
+    def test_auto_renewal_renews_oldest_first_and_suspends_rest(self):
+        """Test a wallet covering only one renewal renews the longest-expired instance"""
+        self.vps_instance.expires_at = timezone.now() - datetime.timedelta(days=2)
+        self.vps_instance.save()
+        newer = VPSInstance.objects.create(
+            user=self.user,
+            plan=self.plan,
+            instance_id='test-instance-456',
+            status='active',
+            expires_at=timezone.now() - datetime.timedelta(hours=1)
+        )
+        self.wallet.balance = Decimal('30.00')
+        self.wallet.save()
+
+        result = AutoRenewalService.process_auto_renewal_for_user(self.user)
+
+        self.assertEqual(result['renewed_count'], 1)
+        self.assertEqual(result['suspended_count'], 1)
+        self.vps_instance.refresh_from_db()
+        newer.refresh_from_db()
+        self.assertEqual(self.vps_instance.status, 'active')
+        self.assertGreater(self.vps_instance.expires_at, timezone.now())
+        self.assertEqual(newer.status, 'suspended')
+        self.wallet.refresh_from_db()
+        self.assertEqual(self.wallet.balance, Decimal('10.00'))
+        self.assertTrue(Transaction.objects.filter(
+            wallet=self.wallet, reference_id='test-instance-123', amount=Decimal('20.00')
+        ).exists())
+
+    @override_settings(NOTIFICATION_DIGEST_WINDOW=None)
+    def test_auto_renewal_queues_notifications(self):
+        """Test renewal notices are written to the outbox in bulk"""
+        self.vps_instance.expires_at = timezone.now() - datetime.timedelta(days=1)
+        self.vps_instance.save()
+
+        AutoRenewalService.process_auto_renewal_for_all_users()
+
+        email = NotificationOutbox.objects.get(user=self.user)
+        self.assertEqual(email.subject, 'GrandVPS - VPS Renewal Successful')
+        self.assertIn('test-instance-123', email.body)
+
+    def test_auto_renewal_query_count_independent_of_users(self):
+        """Test renewal queries do not grow with the number of due users"""
+        from django.test.utils import CaptureQueriesContext
+
+        def add_due_users(count, prefix):
+            for n in range(count):
+                user = User.objects.create_user(username=f'{prefix}{n}', password='pass')
+                Wallet.objects.create(user=user, balance=Decimal('100.00'))
+                VPSInstance.objects.create(
+                    user=user,
+                    plan=self.plan,
+                    instance_id=f'{prefix}-vm-{n}',
+                    status='active',
+                    expires_at=timezone.now() - datetime.timedelta(days=1)
+                )
+
+        add_due_users(1, 'small')
+        with CaptureQueriesContext(connection) as small_run:
+            AutoRenewalService.process_auto_renewal_for_all_users()
+
+        add_due_users(5, 'large')
+        with CaptureQueriesContext(connection) as large_run:
+            results = AutoRenewalService.process_auto_renewal_for_all_users()
+
+        self.assertEqual(len(results), 5)
+        self.assertTrue(all(result['renewed_count'] == 1 for result in results))
+        self.assertEqual(len(large_run), len(small_run))
+
+
+@skipUnless(
+    connection.vendor == 'postgresql' or os.environ.get('CI'),
+    'Query plans are only checked on PostgreSQL'
+)
+class QueryPlanTest(TestCase):
+    """Regression tests that hot queries are planned on the index meant for them.
+
+    The tables are seeded with a few thousand rows shaped like production
+    (most instances not active, many rows per user) and analyzed, so the
+    planner picks indexes on cost rather than because scans were disabled.
+    CI runs this on its PostgreSQL service; there a skip would hide a
+    regression, so a non-PostgreSQL database fails instead.
+    """
+
+    USERS = 200
+
+    @classmethod
+    def setUpTestData(cls):
+        if connection.vendor != 'postgresql':
+            return
+        users = User.objects.bulk_create(User(username=f'plan-user-{n}') for n in range(cls.USERS))
+        wallets = Wallet.objects.bulk_create(Wallet(user=user, balance=Decimal('10.00')) for user in users)
+        plan = VPSPlan.objects.create(
+            name='Plan', cpu_cores=1, ram_gb=1, disk_gb=10, bandwidth_gb=100, price_per_month=Decimal('5.00')
+        )
+        now = timezone.now()
+        VPSInstance.objects.bulk_create(
+            VPSInstance(
+                user=user, plan=plan, instance_id=f'plan-vm-{user.pk}-{n}',
+                status='active' if n < 2 else 'terminated',
+                expires_at=now + datetime.timedelta(days=n - 1 if n < 2 else -30 * n)
+            )
+            for user in users for n in range(20)
+        )
+        Transaction.objects.bulk_create(
+            Transaction(wallet=wallet, amount=Decimal('1.00'), transaction_type='withdraw', reference_id=f'ref-{wallet.pk}-{n}')
+            for wallet in wallets for n in range(25)
+        )
+        Invoice.objects.bulk_create(
+            Invoice(
+                user=user, invoice_number=f'INV-{n:02d}-{user.pk:06d}', amount=Decimal('5.00'),
+                due_date=now.date()
+            )
+            for user in users for n in range(10)
+        )
+
+    def setUp(self):
+        self.assertEqual(connection.vendor, 'postgresql', 'CI must run the query plan tests on PostgreSQL')
+        with connection.cursor() as cursor:
+            cursor.execute('ANALYZE')
+        self.user_id = User.objects.filter(username='plan-user-0').values_list('id', flat=True).get()
+        self.wallet_id = Wallet.objects.filter(user_id=self.user_id).values_list('id', flat=True).get()
+
+    def assertUsesIndex(self, queryset, index_name):
+        plan = queryset.explain()
+        self.assertRegex(plan, rf'(Index (Only )?Scan( Backward)? using|Bitmap Index Scan on) {index_name}\b')
+
+    def test_billing_queries(self):
+        self.assertUsesIndex(
+            BulkHourlyBillingService.active_instances((self.user_id, self.user_id + 10)).values('id', 'user_id', 'plan_id'),
+            'vps_active_user_expires_idx'
+        )
+
+    def test_renewal_queries(self):
+        now = timezone.now()
+        self.assertUsesIndex(
+            VPSInstance.objects.filter(status='active', expires_at__lt=now).values('user_id'),
+            'vps_status_expires_idx'
+        )
+        self.assertUsesIndex(
+            VPSInstance.objects.filter(user_id=self.user_id, status='active', expires_at__lt=now),
+            'vps_active_user_expires_idx'
+        )
+
+    def test_dashboard_queries(self):
+        self.assertUsesIndex(
+            Transaction.objects.filter(wallet_id=self.wallet_id).order_by('-timestamp')[:5],
+            'wallet_txn_recent_idx'
+        )
+        self.assertUsesIndex(
+            Invoice.objects.filter(user_id=self.user_id).order_by('-issued_date')[:3],
+            'billing_invoice_recent_idx'
+        )
+        self.assertUsesIndex(
+            VPSInstance.objects.filter(user_id=self.user_id, status='terminated'),
+            'vps_user_status_idx'
+        )
+
+    def test_lookup_queries(self):
+        self.assertUsesIndex(Transaction.objects.filter(reference_id='ref-1-1'), 'wallet_txn_reference_idx')
+        # Under a byte-order (C) collation the unique index serves prefix scans
+        # itself; otherwise that is the job of the varchar_pattern_ops twin
+        # Django adds
+        with connection.cursor() as cursor:
+            cursor.execute("SELECT 'B' < 'a'")
+            c_collation = cursor.fetchone()[0]
+        self.assertUsesIndex(
+            Invoice.objects.filter(invoice_number__startswith='INV-01-'),
+            'billing_invoice_invoice_number_key' if c_collation else r'billing_invoice_invoice_number_\w+_like'
+        )
@@ -6,6 +6,7 @@ app_name = 'billing'
 urlpatterns = [
     path('dashboard/', views.billing_dashboard, name='dashboard'),
     path('history/', views.billing_history, name='history'),
+    path('history/export/', views.export_invoices, name='export_invoices'),
     path('analytics/', views.billing_analytics, name='analytics'),
     path('invoice/<int:invoice_id>/', views.invoice_detail, name='invoice_detail'),
     path('invoice/<int:invoice_id>/download/', views.download_invoice, name='download_invoice'),
@@ -1,9 +1,13 @@
 from django.shortcuts import render, get_object_or_404
 from django.contrib.auth.decorators import login_required
-from django.http import HttpResponse
+from urllib.parse import quote
+from django.conf import settings
+from django.http import HttpResponse, FileResponse
+from django.utils.cache import patch_cache_control
 from django.db import models
 from django.db.models import Sum
 from .models import BillingCycle, Invoice
+from grandvps.pagination import keyset_page, streaming_export
 from .services import HourlyBillingService, NotificationService, AutoRenewalService
 
 @login_required
@@ -44,12 +48,38 @@ def download_invoice(request, invoice_id):
     invoice = get_object_or_404(Invoice, id=invoice_id, user=request.user)
 
     if not invoice.pdf_file:
+        # Rendering happens on the PDF workers; never build the PDF inside the request
         from .services import InvoiceService
-        pdf_buffer = InvoiceService.generate_invoice_pdf(invoice)
-        invoice.pdf_file.save(f'invoice_{invoice.invoice_number}.pdf', pdf_buffer, save=True)
-
-    response = HttpResponse(invoice.pdf_file.read(), content_type='application/pdf')
-    response['Content-Disposition'] = f'attachment; filename="invoice_{invoice.invoice_number}.pdf"'
+        InvoiceService.schedule_pdf_rendering([invoice.id])
+        invoice.refresh_from_db(fields=['pdf_file'])
+        if not invoice.pdf_file:
+            response = HttpResponse(
+                'Your invoice is being prepared. Please try again in a few seconds.',
+                status=202,
+                content_type='text/plain'
+            )
+            response['Retry-After'] = '5'
+            return response
+
+    return protected_media_response(invoice.pdf_file, f'invoice_{invoice.invoice_number}.pdf', 'application/pdf')
+
+
+def protected_media_response(field_file, filename, content_type):
+    """Send a stored file after the view has authorized the request.
+
+    With MEDIA_X_ACCEL_REDIRECT_PREFIX set, nginx serves the bytes from its
+    internal location; otherwise the file is streamed with FileResponse.
+    Either way the response must not be cached; nginx keeps this
+    Cache-Control when it follows the redirect.
+    """
+    prefix = getattr(settings, 'MEDIA_X_ACCEL_REDIRECT_PREFIX', None)
+    if prefix:
+        response = HttpResponse(content_type=content_type)
+        response['X-Accel-Redirect'] = f"{prefix.rstrip('/')}/{quote(field_file.name)}"
+        response['Content-Disposition'] = f'attachment; filename="{filename}"'
+    else:
+        response = FileResponse(field_file.open('rb'), as_attachment=True, filename=filename, content_type=content_type)
+    patch_cache_control(response, private=True, no_store=True)
     return response
 
 @login_required
@@ -85,8 +115,11 @@ def billing_history(request):
         total_yearly = yearly_invoices.aggregate(total=models.Sum('amount'))['total'] or 0
         average_monthly = total_yearly / 12
 
+    page = keyset_page(invoices, request.GET.get('cursor'), 'issued_date')
+
     context = {
-        'invoices': invoices,
+        'invoices': page,
+        'page': page,
         'total_invoices': total_invoices,
         'paid_invoices': paid_invoices,
         'pending_invoices': pending_invoices,
@@ -97,6 +130,25 @@ def billing_history(request):
 
     return render(request, 'billing/history.html', context)
 
+INVOICE_EXPORT_COLUMNS = [
+    ('invoice_number', lambda i: i.invoice_number),
+    ('issued_date', lambda i: i.issued_date.isoformat()),
+    ('due_date', lambda i: i.due_date.isoformat()),
+    ('amount', lambda i: str(i.amount)),
+    ('status', lambda i: i.status),
+]
+
+@login_required
+def export_invoices(request):
+    """Stream the full invoice history as CSV or JSON"""
+    return streaming_export(
+        Invoice.objects.filter(user=request.user),
+        'issued_date',
+        INVOICE_EXPORT_COLUMNS,
+        'invoices',
+        request.GET.get('format', 'csv')
+    )
+
 @login_required
 def billing_analytics(request):
     """Display billing analytics and statistics"""
@@ -1,3 +1,160 @@
+from datetime import timedelta
+from decimal import Decimal
 from django.db import models
+from django.db.models import Count, Sum, Min, Q, OuterRef, Subquery
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import receiver
+from django.utils import timezone
+from django.contrib.auth.models import User
+from wallet.models import Wallet
+from wallet.signals import balances_changed
+from vps.models import VPSInstance
+from billing.models import Invoice
 
 # Create your models here.
+
+BILLABLE_VPS_STATUSES = ['active', 'pending']
+PENDING_INVOICE_STATUS = 'unpaid'
+
+
+class DashboardSummary(models.Model):
+    """Per-user landing page numbers, maintained by signals on their source rows.
+
+    Each write to a wallet, VPS instance or invoice recomputes only the slice
+    of the summary it affects, so dashboards read one row instead of running
+    a count or sum per widget.
+    """
+
+    user = models.OneToOneField(User, on_delete=models.CASCADE, primary_key=True, related_name='dashboard_summary')
+    wallet_balance = models.DecimalField(max_digits=10, decimal_places=2, default=Decimal('0.00'))
+    total_vps_count = models.PositiveIntegerField(default=0)
+    active_vps_count = models.PositiveIntegerField(default=0)
+    monthly_cost = models.DecimalField(max_digits=10, decimal_places=2, default=Decimal('0.00'))
+    pending_invoices_count = models.PositiveIntegerField(default=0)
+    next_expiry = models.DateTimeField(blank=True, null=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f"{self.user.username}'s dashboard summary"
+
+    @staticmethod
+    def wallet_fields(user_id):
+        balance = Wallet.objects.filter(user_id=user_id).values_list('balance', flat=True).first()
+        return {'wallet_balance': balance if balance is not None else Decimal('0.00')}
+
+    VPS_AGGREGATES = {
+        'total': Count('id'),
+        'active': Count('id', filter=Q(status='active')),
+        'monthly_cost': Sum(VPSInstance.monthly_price_expression(), filter=Q(status__in=BILLABLE_VPS_STATUSES)),
+        'next_expiry': Min('expires_at', filter=Q(status='active')),
+    }
+
+    @staticmethod
+    def _vps_fields_from(totals):
+        return {
+            'total_vps_count': totals['total'],
+            'active_vps_count': totals['active'],
+            'monthly_cost': totals['monthly_cost'] or Decimal('0.00'),
+            'next_expiry': totals['next_expiry'],
+        }
+
+    @classmethod
+    def vps_fields(cls, user_id):
+        return cls._vps_fields_from(VPSInstance.objects.filter(user_id=user_id).aggregate(**cls.VPS_AGGREGATES))
+
+    @staticmethod
+    def invoice_fields(user_id):
+        return {
+            'pending_invoices_count': Invoice.objects.filter(
+                user_id=user_id, status=PENDING_INVOICE_STATUS
+            ).count()
+        }
+
+    @classmethod
+    def rebuild(cls, user_id):
+        """Recompute every field of a user's summary from the source tables"""
+        fields = {
+            **cls.wallet_fields(user_id),
+            **cls.vps_fields(user_id),
+            **cls.invoice_fields(user_id),
+        }
+        summary, _ = cls.objects.update_or_create(user_id=user_id, defaults=fields)
+        return summary
+
+    @classmethod
+    def for_user(cls, user):
+        """Return the user's summary, building it on first access"""
+        summary = cls.objects.filter(user_id=user.pk).first()
+        return summary if summary is not None else cls.rebuild(user.pk)
+
+    def upcoming_expirations(self, days=7):
+        """Active VPS instances expiring within the next `days` days.
+
+        next_expiry answers the common case, nothing expiring soon, without a query.
+        """
+        now = timezone.now()
+        horizon = now + timedelta(days=days)
+        if self.next_expiry is None or self.next_expiry > horizon:
+            return 0
+        return VPSInstance.objects.filter(
+            user_id=self.user_id,
+            expires_at__lte=horizon,
+            expires_at__gte=now,
+            status='active'
+        ).count()
+
+    @classmethod
+    def refresh(cls, user_id, fields):
+        """Overwrite one slice of a summary; users without a summary yet are skipped"""
+        cls.objects.filter(user_id=user_id).update(**fields)
+
+    @classmethod
+    def refresh_vps(cls, user_ids):
+        """Recompute the VPS slice after writes that bypass signals, such as bulk_update.
+
+        The VPS totals of all users come from one grouped query; only users
+        that already have a summary are written.
+        """
+        user_ids = list(cls.objects.filter(user_id__in=set(user_ids)).values_list('user_id', flat=True))
+        if not user_ids:
+            return
+        totals = {
+            row['user_id']: row
+            for row in VPSInstance.objects.filter(user_id__in=user_ids).values('user_id').annotate(
+                **cls.VPS_AGGREGATES
+            ).order_by()
+        }
+        for user_id in user_ids:
+            row = totals.get(user_id, {'total': 0, 'active': 0, 'monthly_cost': None, 'next_expiry': None})
+            cls.refresh(user_id, cls._vps_fields_from(row))
+
+
+@receiver(post_save, sender=Wallet)
+def update_summary_wallet(sender, instance, **kwargs):
+    DashboardSummary.refresh(instance.user_id, {'wallet_balance': instance.balance})
+
+
+@receiver(post_delete, sender=Wallet)
+def clear_summary_wallet(sender, instance, **kwargs):
+    DashboardSummary.refresh(instance.user_id, {'wallet_balance': Decimal('0.00')})
+
+
+@receiver(balances_changed)
+def update_summary_balances(sender, wallet_ids, **kwargs):
+    if not wallet_ids:
+        return
+    DashboardSummary.objects.filter(user__wallet__id__in=wallet_ids).update(
+        wallet_balance=Subquery(Wallet.objects.filter(user_id=OuterRef('user_id')).values('balance')[:1])
+    )
+
+
+@receiver(post_save, sender=VPSInstance)
+@receiver(post_delete, sender=VPSInstance)
+def update_summary_vps(sender, instance, **kwargs):
+    DashboardSummary.refresh(instance.user_id, DashboardSummary.vps_fields(instance.user_id))
+
+
+@receiver(post_save, sender=Invoice)
+@receiver(post_delete, sender=Invoice)
+def update_summary_invoices(sender, instance, **kwargs):
+    DashboardSummary.refresh(instance.user_id, DashboardSummary.invoice_fields(instance.user_id))
@@ -9,6 +9,7 @@ from accounts.models import UserProfile
 from wallet.models import Wallet, Transaction
 from vps.models import VPSInstance, VPSPlan
 from billing.models import BillingCycle, Invoice
+from .models import DashboardSummary
 
 
 class DashboardViewsTestCase(TestCase):
@@ -375,3 +376,81 @@ class DashboardViewsTestCase(TestCase):
 
         self.assertEqual(response.context['monthly_cost'], 0)
         self.assertIsNone(response.context['current_billing_cycle'])
+
+
+class DashboardSummaryTestCase(TestCase):
+    def setUp(self):
+        self.user = get_user_model().objects.create_user(username='summaryuser', password='testpass123')
+        self.wallet = Wallet.objects.create(user=self.user, balance=Decimal('100.00'))
+        self.plan = VPSPlan.objects.create(
+            name='Test Plan',
+            cpu_cores=2,
+            ram_gb=4,
+            disk_gb=50,
+            bandwidth_gb=1000,
+            price_per_month=Decimal('20.00')
+        )
+        self.summary = DashboardSummary.for_user(self.user)
+
+    def _create_vps(self, instance_id, status='active', days=30):
+        return VPSInstance.objects.create(
+            user=self.user,
+            plan=self.plan,
+            instance_id=instance_id,
+            status=status,
+            expires_at=timezone.now() + timedelta(days=days)
+        )
+
+    def test_summary_tracks_vps_writes(self):
+        """Test VPS creation, status changes and deletion update the summary"""
+        vps = self._create_vps('summary-1', days=3)
+        self._create_vps('summary-2', status='pending')
+
+        summary = DashboardSummary.objects.get(user=self.user)
+        self.assertEqual(summary.total_vps_count, 2)
+        self.assertEqual(summary.active_vps_count, 1)
+        self.assertEqual(summary.monthly_cost, Decimal('40.00'))
+        self.assertEqual(summary.upcoming_expirations(), 1)
+
+        vps.status = 'stopped'
+        vps.save()
+        vps.delete()
+        summary.refresh_from_db()
+        self.assertEqual(summary.total_vps_count, 1)
+        self.assertEqual(summary.active_vps_count, 0)
+        self.assertEqual(summary.monthly_cost, Decimal('20.00'))
+        self.assertIsNone(summary.next_expiry)
+
+    def test_summary_tracks_atomic_wallet_updates(self):
+        """Test debits and credits made through queryset updates reach the summary"""
+        Wallet.debit(self.wallet.pk, Decimal('30.00'))
+        self.summary.refresh_from_db()
+        self.assertEqual(self.summary.wallet_balance, Decimal('70.00'))
+
+        self.wallet.refresh_from_db()
+        self.wallet.deposit(Decimal('5.00'))
+        self.summary.refresh_from_db()
+        self.assertEqual(self.summary.wallet_balance, Decimal('75.00'))
+
+    def test_summary_tracks_invoices(self):
+        """Test pending invoice count follows invoice status changes"""
+        invoice = Invoice.objects.create(
+            user=self.user,
+            invoice_number='INV-SUMMARY-0001',
+            amount=Decimal('20.00'),
+            status='unpaid',
+            due_date=timezone.now().date()
+        )
+        self.summary.refresh_from_db()
+        self.assertEqual(self.summary.pending_invoices_count, 1)
+
+        invoice.status = 'paid'
+        invoice.save()
+        self.summary.refresh_from_db()
+        self.assertEqual(self.summary.pending_invoices_count, 0)
+
+    def test_summary_read_is_single_query(self):
+        """Test an existing summary is served from one lookup"""
+        with self.assertNumQueries(1):
+            summary = DashboardSummary.for_user(self.user)
+            self.assertEqual(summary.upcoming_expirations(), 0)
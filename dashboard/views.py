@@ -2,40 +2,30 @@ from django.shortcuts import render, redirect
 from django.contrib.auth.decorators import login_required
 from django.contrib import messages
 from django.db.models import Q, Sum, Count
-from django.utils import timezone
-from datetime import timedelta
 import json
 
 from accounts.models import User
-from wallet.models import Wallet, Transaction
+from wallet.models import Transaction
 from vps.models import VPSInstance
 from billing.models import BillingCycle, Invoice
+from .models import DashboardSummary
 
 
 @login_required
 def dashboard(request):
     """Main dashboard view combining all user data"""
     user = request.user
-
-    # Get wallet information
-    try:
-        wallet = Wallet.objects.get(user=user)
-        wallet_balance = wallet.balance
-    except Wallet.DoesNotExist:
-        wallet_balance = 0
+    summary = DashboardSummary.for_user(user)
+    wallet_balance = summary.wallet_balance
+    monthly_cost = summary.monthly_cost
 
     # Get recent transactions (last 5)
     recent_transactions = Transaction.objects.filter(
         wallet__user=user
     ).order_by('-timestamp')[:5]
 
-    # Get VPS instances
-    vps_instances = VPSInstance.objects.filter(user=user)
-    active_vps_count = vps_instances.filter(status='active').count()
-    total_vps_count = vps_instances.count()
-
     # Get recent VPS instances (last 3)
-    recent_vps = vps_instances.order_by('-created_at')[:3]
+    recent_vps = VPSInstance.objects.filter(user=user).select_related('plan').order_by('-created_at')[:3]
 
     # Get billing information
     current_billing_cycle = BillingCycle.objects.filter(
@@ -43,28 +33,13 @@ def dashboard(request):
         status='active'
     ).first()
 
-    # Calculate total monthly cost
-    monthly_cost = 0
-    if current_billing_cycle:
-        monthly_cost = current_billing_cycle.total_amount
-
     # Get recent invoices (last 3)
     recent_invoices = Invoice.objects.filter(
         user=user
     ).order_by('-issued_date')[:3]
 
-    # Get pending invoices count
-    pending_invoices_count = Invoice.objects.filter(
-        user=user,
-        status='unpaid'
-    ).count()
-
-    # Get upcoming expirations (next 7 days)
-    upcoming_expirations = vps_instances.filter(
-        expires_at__lte=timezone.now() + timedelta(days=7),
-        expires_at__gte=timezone.now(),
-        status='active'
-    ).count()
+    # Get upcoming expirations (next 7 days); only counted when the earliest one is that close
+    upcoming_expirations = summary.upcoming_expirations()
 
     # Get low balance warning
     low_balance_warning = wallet_balance < monthly_cost and monthly_cost > 0
@@ -72,12 +47,12 @@ def dashboard(request):
     context = {
         'wallet_balance': wallet_balance,
         'recent_transactions': recent_transactions,
-        'active_vps_count': active_vps_count,
-        'total_vps_count': total_vps_count,
+        'active_vps_count': summary.active_vps_count,
+        'total_vps_count': summary.total_vps_count,
         'recent_vps': recent_vps,
         'monthly_cost': monthly_cost,
         'recent_invoices': recent_invoices,
-        'pending_invoices_count': pending_invoices_count,
+        'pending_invoices_count': summary.pending_invoices_count,
         'upcoming_expirations': upcoming_expirations,
         'low_balance_warning': low_balance_warning,
         'current_billing_cycle': current_billing_cycle,
@@ -1,4 +1,5 @@
 import os
+import random
 from celery import Celery
 
 # Set the default Django settings module
@@ -16,4 +17,17 @@ app.autodiscover_tasks()
 
 @app.task(bind=True)
 def debug_task(self):
-    print(f'Request: {self.request!r}')
\ No newline at end of file
+    print(f'Request: {self.request!r}')
+
+@app.task
+def dispatch_with_jitter(task_name, kwargs=None, jitter=0, expires=None):
+    """Queue a periodic task after a random delay of up to `jitter` seconds.
+
+    Beat fires every entry exactly on its tick; routing entries through this
+    task spreads them out so workers and the Doprax API do not see bursts.
+    `expires` is counted from the moment the delayed task becomes due.
+    """
+    countdown = random.uniform(0, jitter) if jitter else 0
+    # A run still queued when the next one is due is dropped instead of piling up
+    expires = countdown + expires if expires else None
+    app.send_task(task_name, kwargs=kwargs or {}, countdown=countdown, expires=expires)
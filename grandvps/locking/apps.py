@@ -0,0 +1,8 @@
+from django.apps import AppConfig
+
+
+class LockingConfig(AppConfig):
+    default_auto_field = 'django.db.models.BigAutoField'
+    name = 'grandvps.locking'
+    label = 'locking'
+    verbose_name = 'Job locks'
@@ -0,0 +1,16 @@
+from django.db import models
+
+
+class JobFence(models.Model):
+    """Highest lock token that has written on behalf of a scheduled job.
+
+    Writers check it inside the transaction that holds their writes (see
+    grandvps.locks.DistributedLock.fence), so a holder whose lease was
+    taken over cannot commit after its successor.
+    """
+
+    name = models.CharField(max_length=100, primary_key=True)
+    token = models.BigIntegerField(default=0)
+
+    def __str__(self):
+        return f"{self.name} - {self.token}"
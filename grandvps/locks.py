@@ -0,0 +1,358 @@
+"""
+Distributed single-flight locks for scheduled jobs.
+
+A run takes a lock before doing any work and skips itself when another run
+still holds it, so a slow billing or sync run is never overlapped by the next
+beat tick, a cron invocation or a second worker after a deploy.
+
+Locks live in Redis when the default cache is the Redis backend, and fall
+back to the Django cache otherwise (tests, local development):
+
+* The lock is a lease: it expires after `ttl` seconds unless the holder
+  renews it, which a background thread does every ttl / 3 seconds. A crashed
+  worker therefore blocks later runs for at most one lease.
+* Every acquisition gets a fencing token from a per-lock counter that only
+  grows. `check()` is a cheap lease test between units of work, but a
+  holder can still pause right after it. The real guard is `fence()`,
+  called inside the transaction that writes the protected rows, against
+  the job's stored token (locking.JobFence): a newer token raises
+  LockLost, an older one is raised to ours. Once the stored token is
+  ours the row is only share-locked, so transactions of the same
+  acquisition (parallel shards) do not wait on each other, while a
+  successor's raise waits until they commit.
+* A task can hand its lock to sub-tasks (`hand_off()` / `adopt()`); the
+  hand-off claims the fence, the sub-tasks extend the lease as they work
+  and the last step releases it.
+* Acquisitions, skipped runs and lost leases are counted per lock and
+  reported by `lock_stats()`, which the health check exposes.
+"""
+
+import logging
+import threading
+from functools import wraps
+from django.core.cache import cache
+from django.db import connection, transaction
+from .redis_client import get_redis_client
+
+logger = logging.getLogger(__name__)
+
+LOCK_KEY = 'grandvps:lock:{}'
+FENCE_KEY = 'grandvps:lock:{}:fence'
+STATS_KEY = 'grandvps:lock:{}:stats'
+NAMES_KEY = 'grandvps:lock:names'
+STAT_FIELDS = ('acquired', 'contended', 'lost')
+
+# Delete or extend the key only while it still holds the caller's token
+RELEASE_SCRIPT = """
+if redis.call('get', KEYS[1]) == ARGV[1] then
+    return redis.call('del', KEYS[1])
+end
+return 0
+"""
+EXTEND_SCRIPT = """
+if redis.call('get', KEYS[1]) == ARGV[1] then
+    return redis.call('pexpire', KEYS[1], ARGV[2])
+end
+return 0
+"""
+# Raise the token counter to at least ARGV[1], e.g. after Redis lost it
+ADVANCE_SCRIPT = """
+if tonumber(redis.call('get', KEYS[1]) or '0') < tonumber(ARGV[1]) then
+    redis.call('set', KEYS[1], ARGV[1])
+end
+return 1
+"""
+
+
+class LockNotAcquired(Exception):
+    """Raised when entering a lock that another run holds"""
+    pass
+
+
+class LockLost(Exception):
+    """Raised when a holder's lease expired and the lock may have been taken over"""
+    pass
+
+
+class RedisLockBackend:
+    """Lock primitives as single atomic Redis commands or Lua scripts"""
+
+    def __init__(self, client):
+        self.client = client
+        self.release_script = client.register_script(RELEASE_SCRIPT)
+        self.extend_script = client.register_script(EXTEND_SCRIPT)
+        self.advance_script = client.register_script(ADVANCE_SCRIPT)
+
+    def next_token(self, name):
+        return self.client.incr(FENCE_KEY.format(name))
+
+    def advance_token(self, name, minimum):
+        self.advance_script(keys=[FENCE_KEY.format(name)], args=[minimum])
+
+    def acquire(self, name, token, ttl):
+        return bool(self.client.set(LOCK_KEY.format(name), token, nx=True, px=int(ttl * 1000)))
+
+    def release(self, name, token):
+        return bool(self.release_script(keys=[LOCK_KEY.format(name)], args=[token]))
+
+    def extend(self, name, token, ttl):
+        return bool(self.extend_script(keys=[LOCK_KEY.format(name)], args=[token, int(ttl * 1000)]))
+
+    def holds(self, name, token):
+        value = self.client.get(LOCK_KEY.format(name))
+        return value is not None and int(value) == token
+
+    def record(self, name, field):
+        pipe = self.client.pipeline()
+        pipe.sadd(NAMES_KEY, name)
+        pipe.hincrby(STATS_KEY.format(name), field, 1)
+        pipe.execute()
+
+    def stats(self):
+        names = sorted(name.decode() if isinstance(name, bytes) else name for name in self.client.smembers(NAMES_KEY))
+        stats = {}
+        for name in names:
+            counters = self.client.hgetall(STATS_KEY.format(name))
+            counters = {(k.decode() if isinstance(k, bytes) else k): int(v) for k, v in counters.items()}
+            stats[name] = {field: counters.get(field, 0) for field in STAT_FIELDS}
+        return stats
+
+
+class CacheLockBackend:
+    """Best-effort lock primitives on the Django cache, for non-Redis deployments and tests"""
+
+    def __init__(self, backend):
+        self.cache = backend
+
+    def _incr(self, key):
+        self.cache.add(key, 0, None)
+        return self.cache.incr(key)
+
+    def next_token(self, name):
+        return self._incr(FENCE_KEY.format(name))
+
+    def advance_token(self, name, minimum):
+        key = FENCE_KEY.format(name)
+        if (self.cache.get(key) or 0) < minimum:
+            self.cache.set(key, minimum, None)
+
+    def acquire(self, name, token, ttl):
+        return self.cache.add(LOCK_KEY.format(name), token, ttl)
+
+    def release(self, name, token):
+        if self.holds(name, token):
+            self.cache.delete(LOCK_KEY.format(name))
+            return True
+        return False
+
+    def extend(self, name, token, ttl):
+        return self.holds(name, token) and self.cache.touch(LOCK_KEY.format(name), ttl)
+
+    def holds(self, name, token):
+        return self.cache.get(LOCK_KEY.format(name)) == token
+
+    def record(self, name, field):
+        names = self.cache.get(NAMES_KEY) or []
+        if name not in names:
+            self.cache.set(NAMES_KEY, names + [name], None)
+        self._incr(f'{STATS_KEY.format(name)}:{field}')
+
+    def stats(self):
+        return {
+            name: {field: self.cache.get(f'{STATS_KEY.format(name)}:{field}', 0) for field in STAT_FIELDS}
+            for name in sorted(self.cache.get(NAMES_KEY) or [])
+        }
+
+
+def get_backend():
+    """Use raw Redis when the default cache is Django's Redis backend"""
+    client = get_redis_client()
+    if client is not None:
+        return RedisLockBackend(client)
+    return CacheLockBackend(cache)
+
+
+class DistributedLock:
+    """Lease-based lock with fencing tokens, usable as a context manager.
+
+    `token` is the fencing token of the current acquisition. Long runs call
+    `check()` between units of work and `fence()` inside every transaction
+    that writes on the lock's behalf.
+    """
+
+    def __init__(self, name, ttl=5 * 60, backend=None):
+        self.name = name
+        self.ttl = ttl
+        self.backend = backend or get_backend()
+        self.token = None
+        self._stop = threading.Event()
+        self._renewer = None
+        self.lost = False
+        # Adopted locks were acquired by another process and renew on check()
+        self.adopted = False
+
+    @classmethod
+    def adopt(cls, name, token, ttl=5 * 60, backend=None):
+        """Act for an acquisition handed off by another task (see hand_off)"""
+        lock = cls(name, ttl, backend)
+        lock.token = token
+        lock.adopted = True
+        return lock
+
+    def acquire(self):
+        """Try once to take the lock; returns False when another run holds it"""
+        token = self.backend.next_token(self.name)
+        if not self.backend.acquire(self.name, token, self.ttl):
+            self.backend.record(self.name, 'contended')
+            logger.warning(f'Lock {self.name} is held by another run, skipping')
+            return False
+
+        self.token = token
+        self.lost = False
+        self.backend.record(self.name, 'acquired')
+        self._stop.clear()
+        self._renewer = threading.Thread(target=self._renew_loop, name=f'lock-renewer-{self.name}', daemon=True)
+        self._renewer.start()
+        return True
+
+    def _renew_loop(self):
+        while not self._stop.wait(self.ttl / 3):
+            try:
+                renewed = self.backend.extend(self.name, self.token, self.ttl)
+            except Exception as e:
+                logger.warning(f'Could not renew lock {self.name}: {str(e)}')
+                continue
+            if not renewed:
+                self._mark_lost()
+                return
+
+    def _mark_lost(self):
+        if not self.lost:
+            self.lost = True
+            self.backend.record(self.name, 'lost')
+            logger.error(f'Lock {self.name} (token {self.token}) expired while held')
+
+    def check(self):
+        """Raise LockLost unless this acquisition still owns the lock.
+
+        An adopted lock has no renewal thread, so checking also extends its
+        lease.
+        """
+        if self.token is None or self.lost:
+            owned = False
+        elif self.adopted:
+            owned = self.backend.extend(self.name, self.token, self.ttl)
+        else:
+            owned = self.backend.holds(self.name, self.token)
+        if not owned:
+            self._mark_lost()
+            raise LockLost(f'Lock {self.name} (token {self.token}) is no longer held')
+
+    def fence(self):
+        """Claim the job's writes for this token; call inside the writing transaction.
+
+        Raises LockLost (rolling the transaction back) if a holder with a
+        newer token has already written.
+        """
+        from .locking.models import JobFence
+
+        stored = JobFence.objects.filter(name=self.name).values_list('token', flat=True).first()
+        if stored == self.token:
+            stored = self._shared_fence_token(JobFence)
+        elif stored is None or stored < self.token:
+            if stored is None:
+                JobFence.objects.bulk_create([JobFence(name=self.name)], ignore_conflicts=True)
+            JobFence.objects.filter(name=self.name, token__lte=self.token).update(token=self.token)
+            stored = JobFence.objects.filter(name=self.name).values_list('token', flat=True).get()
+        if stored == self.token:
+            return
+        # Either a newer holder wrote, or the token counter was lost and
+        # restarted below the stored token; in both cases this run stops,
+        # and the counter is moved past the fence for the next acquisition
+        self.backend.advance_token(self.name, stored)
+        self._mark_lost()
+        raise LockLost(f'Lock {self.name} (token {self.token}) was fenced off by token {stored}')
+
+    def _shared_fence_token(self, JobFence):
+        """Re-read the stored token under a shared row lock (FOR SHARE where supported)"""
+        if not connection.features.has_select_for_update:
+            return JobFence.objects.filter(name=self.name).values_list('token', flat=True).get()
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f'SELECT token FROM {connection.ops.quote_name(JobFence._meta.db_table)} WHERE name = %s FOR SHARE',
+                [self.name]
+            )
+            return cursor.fetchone()[0]
+
+    def hand_off(self):
+        """Pass the acquisition on to sub-tasks and return its token.
+
+        Claims the fence for this token, so the sub-tasks only ever share it,
+        then stops the renewal thread and refreshes the lease once; this
+        holder no longer releases the lock. Whoever adopts the token must
+        check() often enough to keep the lease alive and release it at the
+        end.
+        """
+        with transaction.atomic():
+            self.fence()
+        self._stop.set()
+        if self._renewer is not None:
+            self._renewer.join()
+            self._renewer = None
+        token = self.token
+        if not self.backend.extend(self.name, token, self.ttl):
+            self._mark_lost()
+            raise LockLost(f'Lock {self.name} (token {token}) is no longer held')
+        self.token = None
+        return token
+
+    def release(self):
+        self._stop.set()
+        if self._renewer is not None:
+            self._renewer.join()
+            self._renewer = None
+        if self.token is not None:
+            try:
+                self.backend.release(self.name, self.token)
+            except Exception as e:
+                # The lease runs out on its own
+                logger.warning(f'Could not release lock {self.name}: {str(e)}')
+            self.token = None
+
+    def __enter__(self):
+        if not self.acquire():
+            raise LockNotAcquired(f'Lock {self.name} is held by another run')
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.release()
+        return False
+
+
+def single_flight(name, ttl=5 * 60, pass_lock=False):
+    """Run the decorated function only if no other run holds the `name` lock.
+
+    Skipped calls return None. With `pass_lock=True` the held DistributedLock
+    is passed as the `lock` keyword argument so the function can `check()` and `fence()` it.
+    """
+    def decorator(func):
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            try:
+                with DistributedLock(name, ttl) as lock:
+                    if pass_lock:
+                        kwargs['lock'] = lock
+                    return func(*args, **kwargs)
+            except LockNotAcquired:
+                return None
+        return wrapper
+    return decorator
+
+
+def lock_stats():
+    """Acquired, contended and lost counts for every lock used so far"""
+    try:
+        return get_backend().stats()
+    except Exception as e:
+        logger.warning(f'Could not read lock stats: {str(e)}')
+        return {}
@@ -76,6 +76,10 @@ class HealthCheckMiddleware:
                 }
             }
 
+            # Lock contention of scheduled jobs; informational, does not affect status
+            from .locks import lock_stats
+            health_data['scheduled_job_locks'] = lock_stats()
+
             # Determine overall status
             if any(not check.get('status', True) for check in health_data['checks'].values()):
                 health_data['status'] = 'unhealthy'
@@ -0,0 +1,185 @@
+"""
+Sliding-window rate limits for views.
+
+Each hit is checked and counted in a single atomic step, so concurrent
+requests cannot slip past the limit between a read and a write, and the
+window slides with every request instead of resetting on fixed boundaries
+(which let a client fire twice the limit around a reset).
+
+Limits live in Redis when the default cache is the Redis backend: a Lua
+script keeps the timestamps of recent hits in a sorted set per key and
+admits a hit only while fewer than `limit` fall inside the window. Other
+caches (tests, local development) get the sliding-window counter
+approximation built on the cache's atomic `incr`.
+
+Keys are per user or per client IP; stack two `rate_limit` decorators to
+limit both.
+"""
+
+import math
+import time
+import uuid
+import logging
+from collections import namedtuple
+from functools import wraps
+from django.conf import settings
+from django.core.cache import cache
+from django.http import HttpResponse, JsonResponse
+from .redis_client import get_redis_client
+
+logger = logging.getLogger(__name__)
+
+RATE_LIMIT_KEY = 'grandvps:ratelimit:{}:{}'
+
+# Drop hits older than the window, then record this one if there is room.
+# Returns {allowed, hits in window, milliseconds until the oldest hit expires}
+SLIDING_WINDOW_SCRIPT = """
+local now = tonumber(ARGV[1])
+local window = tonumber(ARGV[2])
+redis.call('zremrangebyscore', KEYS[1], '-inf', now - window)
+local count = redis.call('zcard', KEYS[1])
+if count < tonumber(ARGV[3]) then
+    redis.call('zadd', KEYS[1], now, ARGV[4])
+    redis.call('pexpire', KEYS[1], window)
+    return {1, count + 1, 0}
+end
+local oldest = redis.call('zrange', KEYS[1], 0, 0, 'WITHSCORES')
+return {0, count, tonumber(oldest[2]) + window - now}
+"""
+
+RateLimitResult = namedtuple('RateLimitResult', ['allowed', 'remaining', 'retry_after'])
+
+
+class RedisRateLimitBackend:
+    """Exact sliding-window log, one Lua script call per hit"""
+
+    def __init__(self, client):
+        self.client = client
+        self.script = client.register_script(SLIDING_WINDOW_SCRIPT)
+
+    def hit(self, key, limit, window, now):
+        allowed, count, retry_ms = self.script(
+            keys=[key],
+            args=[int(now * 1000), int(window * 1000), limit, uuid.uuid4().hex]
+        )
+        return RateLimitResult(bool(allowed), max(limit - int(count), 0), math.ceil(int(retry_ms) / 1000))
+
+
+class CacheRateLimitBackend:
+    """Sliding-window counter on the Django cache, for non-Redis deployments and tests.
+
+    The previous fixed window's count is weighted by how much of it still
+    overlaps the sliding window. Counting uses the cache's atomic `incr`;
+    rejected hits are taken back out so they do not extend the block.
+    """
+
+    def __init__(self, backend):
+        self.cache = backend
+
+    def hit(self, key, limit, window, now):
+        current = int(now // window)
+        overlap = 1 - (now % window) / window
+        current_key = f'{key}:{current}'
+
+        self.cache.add(current_key, 0, window * 2)
+        count = self.cache.incr(current_key)
+        previous = self.cache.get(f'{key}:{current - 1}', 0)
+        weighted = previous * overlap + count
+
+        if weighted > limit:
+            self.cache.decr(current_key)
+            return RateLimitResult(False, 0, math.ceil(window * overlap) or 1)
+        return RateLimitResult(True, int(limit - weighted), 0)
+
+
+def get_backend():
+    """Use raw Redis when the default cache is Django's Redis backend"""
+    client = get_redis_client()
+    if client is not None:
+        return RedisRateLimitBackend(client)
+    return CacheRateLimitBackend(cache)
+
+
+class RateLimiter:
+    """At most `limit` hits per `window` seconds for each identity"""
+
+    def __init__(self, name, limit, window, backend=None):
+        self.name = name
+        self.limit = limit
+        self.window = window
+        self.backend = backend
+
+    def hit(self, identity, now=None):
+        """Count a hit for `identity` and report whether it is allowed.
+
+        If the backend is unreachable the hit is allowed: a cache outage
+        should not take the endpoints it protects down with it.
+        """
+        key = RATE_LIMIT_KEY.format(self.name, identity)
+        try:
+            backend = self.backend or get_backend()
+            return backend.hit(key, self.limit, self.window, now or time.time())
+        except Exception as e:
+            logger.warning(f'Rate limiter {self.name} unavailable: {str(e)}')
+            return RateLimitResult(True, self.limit, 0)
+
+
+def client_ip(request):
+    """The client address, taken from X-Forwarded-For behind RATE_LIMIT_PROXY_COUNT proxies.
+
+    Each trusted proxy appends the address it received the request from, so
+    the client is the entry that many places from the end; anything before
+    it was supplied by the client and cannot be trusted.
+    """
+    proxies = getattr(settings, 'RATE_LIMIT_PROXY_COUNT', 0)
+    forwarded = request.META.get('HTTP_X_FORWARDED_FOR')
+    if proxies and forwarded:
+        addresses = [address.strip() for address in forwarded.split(',')]
+        if len(addresses) >= proxies:
+            return addresses[-proxies]
+    return request.META.get('REMOTE_ADDR', '')
+
+
+def rate_limit_identity(request, key):
+    if key == 'ip':
+        return f'ip:{client_ip(request)}'
+    if request.user.is_authenticated:
+        return f'user:{request.user.pk}'
+    return f'ip:{client_ip(request)}'
+
+
+def rate_limited_response(request, retry_after):
+    message = 'Rate limit exceeded. Please try again later.'
+    if request.headers.get('x-requested-with') == 'XMLHttpRequest' or 'application/json' in request.headers.get('accept', ''):
+        response = JsonResponse({'success': False, 'message': message}, status=429)
+    else:
+        response = HttpResponse(message, status=429)
+    response['Retry-After'] = str(retry_after)
+    return response
+
+
+def rate_limit(name, limit, window, key='user', methods=None):
+    """Allow the decorated view `limit` times per `window` seconds.
+
+    `key='user'` limits each signed-in user (anonymous requests by IP),
+    `key='ip'` limits each client IP. With `methods`, only requests using
+    those HTTP methods are counted. Views decorated with the same name and
+    key share one limit. Requests over the limit get a 429 with
+    Retry-After; AJAX and JSON clients get the JSON error shape the views
+    use.
+    """
+    def decorator(view_func):
+        limiter = RateLimiter(f'{name}:{key}', limit, window)
+
+        @wraps(view_func)
+        def wrapper(request, *args, **kwargs):
+            if methods and request.method not in methods:
+                return view_func(request, *args, **kwargs)
+            identity = rate_limit_identity(request, key)
+            result = limiter.hit(identity)
+            if not result.allowed:
+                logger.warning(f'Rate limit {name} exceeded by {identity}')
+                return rate_limited_response(request, result.retry_after)
+            return view_func(request, *args, **kwargs)
+        return wrapper
+    return decorator
@@ -0,0 +1,17 @@
+"""
+Access to the raw Redis connection behind the default cache.
+
+Features that need atomic Redis commands (locks, timers, rate limits) use
+this client directly and fall back to plain cache operations when the cache
+is not Redis, as in tests and local development.
+"""
+
+from django.core.cache import cache
+
+
+def get_redis_client():
+    """Return a redis-py client when the default cache is Django's Redis backend, else None"""
+    client = getattr(cache, '_cache', None)
+    if hasattr(client, 'get_client'):
+        return client.get_client(write=True)
+    return None
@@ -12,6 +12,7 @@ https://docs.djangoproject.com/en/5.2/ref/settings/
 
 from pathlib import Path
 import os
+from celery.schedules import crontab
 from dotenv import load_dotenv
 import logging
 
@@ -75,6 +76,22 @@ SECRET_KEY = os.environ.get('SECRET_KEY', 'django-insecure-f$w9mt^htb0@bhm%b5*p&
 
 # Doprax API Configuration
 DOPRAX_API_KEY = os.environ.get('DOPRAX_API_KEY', 'd13aea94.Vmzuzv7EiXSI16fzm5HSISOdhiM8hb9DYyO-sYPkjnE')
+DOPRAX_STATUS_POLL_CONCURRENCY = int(os.environ.get('DOPRAX_STATUS_POLL_CONCURRENCY', 8))
+DOPRAX_RATE_LIMIT_PER_SECOND = float(os.environ.get('DOPRAX_RATE_LIMIT_PER_SECOND', 10))
+DOPRAX_CONNECT_TIMEOUT = float(os.environ.get('DOPRAX_CONNECT_TIMEOUT', 5))
+DOPRAX_READ_TIMEOUT = float(os.environ.get('DOPRAX_READ_TIMEOUT', 30))
+DOPRAX_MAX_RETRIES = int(os.environ.get('DOPRAX_MAX_RETRIES', 3))
+DOPRAX_POOL_MAXSIZE = max(DOPRAX_STATUS_POLL_CONCURRENCY, 20)
+DOPRAX_CATALOG_TTL = int(os.environ.get('DOPRAX_CATALOG_TTL', 15 * 60))
+DOPRAX_CATALOG_STALE_TTL = int(os.environ.get('DOPRAX_CATALOG_STALE_TTL', 24 * 60 * 60))
+
+# VPS provisioning: seconds between boot checks and how many checks before refunding
+VPS_PROVISIONING_POLL_INTERVAL = int(os.environ.get('VPS_PROVISIONING_POLL_INTERVAL', 15))
+VPS_PROVISIONING_MAX_POLLS = int(os.environ.get('VPS_PROVISIONING_MAX_POLLS', 40))
+# Seconds after which a purchase still queued, creating or booting is reaped
+VPS_PROVISIONING_STALE_AFTER = int(os.environ.get('VPS_PROVISIONING_STALE_AFTER', 30 * 60))
+# Days before expiry at which a reminder is sent, comma-separated
+VPS_EXPIRY_WARNING_DAYS = [int(days) for days in os.environ.get('VPS_EXPIRY_WARNING_DAYS', '7,1').split(',') if days]
 
 # SECURITY WARNING: don't run with debug turned on in production!
 DEBUG = True
@@ -92,6 +109,8 @@ INSTALLED_APPS = [
     'django.contrib.messages',
     'django.contrib.staticfiles',
     'django.contrib.humanize',
+    # Fencing table behind grandvps.locks
+    'grandvps.locking',
     # Custom apps
     'accounts',
     'wallet',
@@ -211,10 +230,31 @@ STATICFILES_DIRS = [BASE_DIR / 'static']
 
 MEDIA_URL = '/media/'
 MEDIA_ROOT = BASE_DIR / 'media'
+# Internal nginx location that serves MEDIA_ROOT for authorized downloads; None streams from Django
+MEDIA_X_ACCEL_REDIRECT_PREFIX = os.environ.get('MEDIA_X_ACCEL_REDIRECT_PREFIX') or None
 
 # Email backend
 EMAIL_BACKEND = 'django.core.mail.backends.console.EmailBackend'
 
+# Notification outbox delivery
+NOTIFICATION_OUTBOX_BATCH_SIZE = 100
+NOTIFICATION_OUTBOX_MAX_PER_SECOND = 10
+NOTIFICATION_OUTBOX_MAX_ATTEMPTS = 5
+NOTIFICATION_OUTBOX_RETRY_DELAY = 60  # seconds, doubled on every failed attempt
+
+# History pages: rows per keyset page and rows fetched per chunk when streaming exports
+HISTORY_PAGE_SIZE = int(os.environ.get('HISTORY_PAGE_SIZE', 50))
+EXPORT_CHUNK_SIZE = int(os.environ.get('EXPORT_CHUNK_SIZE', 2000))
+
+# Invoices per render_invoice_pdfs task
+INVOICE_PDF_RENDER_BATCH_SIZE = int(os.environ.get('INVOICE_PDF_RENDER_BATCH_SIZE', 50))
+
+# Coalesce billing notifications into one digest per user: 'daily', 'weekly' or None to email immediately
+NOTIFICATION_DIGEST_WINDOW = os.environ.get('NOTIFICATION_DIGEST_WINDOW', 'daily') or None
+
+# Reverse proxies in front of Django that append to X-Forwarded-For; 0 uses REMOTE_ADDR for per-IP rate limits
+RATE_LIMIT_PROXY_COUNT = int(os.environ.get('RATE_LIMIT_PROXY_COUNT', 0))
+
 # Caching
 CACHES = {
     'default': {
@@ -232,6 +272,7 @@ if 'test' in sys.argv:
     CACHES['default'] = {
         'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
     }
+    CELERY_TASK_ALWAYS_EAGER = True
 
 # Celery Configuration
 CELERY_BROKER_URL = os.environ.get('REDIS_URL', 'redis://127.0.0.1:6379/0')
@@ -240,6 +281,42 @@ CELERY_ACCEPT_CONTENT = ['json']
 CELERY_TASK_SERIALIZER = 'json'
 CELERY_RESULT_SERIALIZER = 'json'
 CELERY_TIMEZONE = TIME_ZONE
+# ReportLab rendering is CPU-bound: keep it on its own prefork worker pool
+CELERY_TASK_ROUTES = {
+    'billing.tasks.render_invoice_pdfs': {'queue': 'invoice_pdfs'},
+}
+
+# Periodic jobs. Every entry goes through dispatch_with_jitter, which queues the
+# real task after a random delay of up to `jitter` seconds; `expires` drops a run
+# that is still queued when the next one is due. Overlap is prevented by the
+# single_flight lock on each task.
+BILLING_SHARDS = int(os.environ.get('BILLING_SHARDS', 1))
+# How far back the scheduled billing run catches up hours missed during an outage
+BILLING_CATCHUP_MAX_HOURS = int(os.environ.get('BILLING_CATCHUP_MAX_HOURS', 24))
+
+
+def _periodic(task, schedule, jitter, expires, **kwargs):
+    return {
+        'task': 'grandvps.celery.dispatch_with_jitter',
+        'schedule': schedule,
+        'kwargs': {'task_name': task, 'kwargs': kwargs, 'jitter': jitter, 'expires': expires},
+        'options': {'expires': expires},
+    }
+
+
+CELERY_BEAT_SCHEDULE = {
+    'hourly-billing': _periodic('billing.tasks.process_hourly_billing', crontab(minute=5), jitter=120, expires=50 * 60),
+    'expiry-timers': _periodic('vps.tasks.process_expiry_timers', crontab(), jitter=0, expires=60),
+    # Backstops for timers lost from Redis: a full renewal sweep and a timer re-seed
+    'auto-renewal': _periodic('billing.tasks.process_auto_renewals', crontab(hour=2, minute=20), jitter=300, expires=6 * 60 * 60),
+    'expiry-timers-rebuild': _periodic('vps.tasks.rebuild_expiry_timers', crontab(hour=4, minute=0), jitter=600, expires=6 * 60 * 60),
+    'vps-status-sync': _periodic('vps.tasks.update_vps_statuses', crontab(minute='*/5'), jitter=60, expires=4 * 60),
+    'vps-provisioning-reaper': _periodic('vps.tasks.reap_stale_provisioning', crontab(minute='*/5'), jitter=60, expires=4 * 60),
+    'plan-sync': _periodic('vps.tasks.sync_plans', crontab(hour=3, minute=30), jitter=15 * 60, expires=6 * 60 * 60),
+    'catalog-refresh': _periodic('vps.tasks.refresh_doprax_catalog', crontab(minute='*/10'), jitter=60, expires=9 * 60),
+    'notification-outbox-drain': _periodic('billing.tasks.drain_notification_outbox', crontab(), jitter=10, expires=60),
+    'notification-digests': _periodic('billing.tasks.flush_notification_digests', crontab(minute=45), jitter=300, expires=50 * 60),
+}
 
 # Default primary key field type
 # https://docs.djangoproject.com/en/5.2/ref/settings/#default-auto-field
@@ -61,6 +61,11 @@ STATIC_URL = '/static/'
 STATIC_ROOT = BASE_DIR / 'staticfiles'
 MEDIA_URL = '/media/'
 MEDIA_ROOT = BASE_DIR / 'media'
+# Invoice downloads are authorized by Django and served by nginx (see nginx/sites-enabled/grandvps)
+MEDIA_X_ACCEL_REDIRECT_PREFIX = '/protected-media/'
+
+# nginx appends the client address to X-Forwarded-For
+RATE_LIMIT_PROXY_COUNT = int(os.environ.get('RATE_LIMIT_PROXY_COUNT', 1))
 
 # Security settings
 SECURE_SSL_REDIRECT = True
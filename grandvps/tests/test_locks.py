@@ -0,0 +1,218 @@
+import threading
+import time
+from unittest import skipUnless
+from django.core.cache import cache
+from django.db import OperationalError, connection, connections, transaction
+from django.test import SimpleTestCase, TestCase, TransactionTestCase
+from django.test.utils import CaptureQueriesContext
+from unittest.mock import patch
+
+from grandvps.locks import (
+    DistributedLock, LockNotAcquired, LockLost, single_flight, lock_stats, LOCK_KEY
+)
+from grandvps.locking.models import JobFence
+
+
+class DistributedLockTests(SimpleTestCase):
+    """Tests for the single-flight lock on the cache backend"""
+
+    def setUp(self):
+        cache.clear()
+        self.addCleanup(cache.clear)
+
+    def test_second_acquire_is_contended(self):
+        first = DistributedLock('job', ttl=60)
+        second = DistributedLock('job', ttl=60)
+
+        self.assertTrue(first.acquire())
+        self.assertFalse(second.acquire())
+        first.release()
+        self.assertTrue(second.acquire())
+        second.release()
+
+    def test_fencing_tokens_increase(self):
+        first = DistributedLock('job', ttl=60)
+        first.acquire()
+        first_token = first.token
+        first.release()
+
+        second = DistributedLock('job', ttl=60)
+        second.acquire()
+        self.assertGreater(second.token, first_token)
+        second.release()
+
+    def test_stale_holder_cannot_release_or_pass_check(self):
+        stale = DistributedLock('job', ttl=60)
+        stale.acquire()
+        # The lease runs out and another run takes over
+        cache.delete(LOCK_KEY.format('job'))
+        current = DistributedLock('job', ttl=60)
+        self.assertTrue(current.acquire())
+
+        with self.assertRaises(LockLost):
+            stale.check()
+        stale.release()
+        current.check()
+        self.assertEqual(cache.get(LOCK_KEY.format('job')), current.token)
+        current.release()
+
+    def test_context_manager_raises_when_held(self):
+        with DistributedLock('job', ttl=60):
+            with self.assertRaises(LockNotAcquired):
+                with DistributedLock('job', ttl=60):
+                    pass
+        self.assertIsNone(cache.get(LOCK_KEY.format('job')))
+
+    def test_lease_is_renewed_while_held(self):
+        with DistributedLock('job', ttl=0.3) as lock:
+            time.sleep(0.6)
+            lock.check()
+
+    def test_single_flight_skips_and_passes_lock(self):
+        calls = []
+
+        @single_flight('job', ttl=60, pass_lock=True)
+        def job(lock=None):
+            calls.append(lock.token)
+            return job()
+
+        self.assertIsNone(job())
+        self.assertEqual(len(calls), 1)
+
+    def test_lock_stats_count_contention(self):
+        with DistributedLock('job', ttl=60):
+            DistributedLock('job', ttl=60).acquire()
+
+        self.assertEqual(lock_stats()['job'], {'acquired': 1, 'contended': 1, 'lost': 0})
+
+    @patch('grandvps.locks.CacheLockBackend.extend', return_value=False)
+    def test_failed_renewal_marks_lock_lost(self, mock_extend):
+        lock = DistributedLock('job', ttl=0.15)
+        lock.acquire()
+        time.sleep(0.3)
+
+        with self.assertRaises(LockLost):
+            lock.check()
+        lock.release()
+        self.assertEqual(lock_stats()['job']['lost'], 1)
+
+
+class DistributedLockFenceTests(TestCase):
+    """Tests for fencing writes and handing a lock off to sub-tasks"""
+
+    def setUp(self):
+        cache.clear()
+        self.addCleanup(cache.clear)
+
+    def test_fence_rejects_older_token(self):
+        stale = DistributedLock('job', ttl=60)
+        stale.acquire()
+        cache.delete(LOCK_KEY.format('job'))
+        newer = DistributedLock('job', ttl=60)
+        newer.acquire()
+        newer.fence()
+
+        with self.assertRaises(LockLost):
+            stale.fence()
+        self.assertTrue(stale.lost)
+        newer.fence()
+        self.assertEqual(JobFence.objects.get(name='job').token, newer.token)
+        newer.release()
+
+    def test_fence_moves_reset_token_counter_past_stored_token(self):
+        JobFence.objects.create(name='job', token=50)
+        lock = DistributedLock('job', ttl=60)
+        lock.acquire()
+
+        with self.assertRaises(LockLost):
+            lock.fence()
+        lock.release()
+        lock.acquire()
+        self.assertGreater(lock.token, 50)
+        lock.fence()
+        lock.release()
+
+    def test_hand_off_keeps_lock_until_adopter_releases(self):
+        with DistributedLock('job', ttl=60) as lock:
+            token = lock.hand_off()
+        self.assertFalse(DistributedLock('job', ttl=60).acquire())
+
+        adopted = DistributedLock.adopt('job', token, ttl=60)
+        adopted.check()
+        adopted.fence()
+        adopted.release()
+        self.assertTrue(DistributedLock('job', ttl=60).acquire())
+
+    def test_hand_off_claims_fence_so_adopters_only_read_it(self):
+        with DistributedLock('job', ttl=60) as lock:
+            token = lock.hand_off()
+        self.assertEqual(JobFence.objects.get(name='job').token, token)
+
+        with CaptureQueriesContext(connection) as queries:
+            DistributedLock.adopt('job', token, ttl=60).fence()
+        self.assertFalse([q['sql'] for q in queries.captured_queries if not q['sql'].startswith('SELECT')])
+
+    def test_adopted_lock_check_fails_after_takeover(self):
+        with DistributedLock('job', ttl=60) as lock:
+            token = lock.hand_off()
+        cache.delete(LOCK_KEY.format('job'))
+        DistributedLock('job', ttl=60).acquire()
+
+        with self.assertRaises(LockLost):
+            DistributedLock.adopt('job', token, ttl=60).check()
+
+
+@skipUnless(connection.vendor == 'postgresql', 'Row lock behaviour is only checked on PostgreSQL')
+class DistributedLockFenceConcurrencyTests(TransactionTestCase):
+    """Tests that fencing serializes successors without serializing shards of one acquisition"""
+
+    def setUp(self):
+        cache.clear()
+        self.addCleanup(cache.clear)
+
+    def _fence_in_thread(self, token, release):
+        """Fence `token` in another connection and keep its transaction open until `release` is set"""
+        fenced = threading.Event()
+
+        def run():
+            try:
+                with transaction.atomic():
+                    DistributedLock.adopt('job', token).fence()
+                    fenced.set()
+                    release.wait(10)
+            finally:
+                connections.close_all()
+
+        thread = threading.Thread(target=run)
+        thread.start()
+        self.assertTrue(fenced.wait(10))
+        return thread
+
+    def _fence_with_timeout(self, token):
+        with transaction.atomic():
+            with connection.cursor() as cursor:
+                cursor.execute("SET LOCAL lock_timeout = '500ms'")
+            DistributedLock.adopt('job', token).fence()
+
+    def test_same_token_transactions_do_not_wait_on_each_other(self):
+        JobFence.objects.create(name='job', token=5)
+        release = threading.Event()
+        thread = self._fence_in_thread(5, release)
+        try:
+            self._fence_with_timeout(5)
+        finally:
+            release.set()
+            thread.join()
+
+    def test_newer_token_waits_for_open_transactions_of_older_one(self):
+        JobFence.objects.create(name='job', token=5)
+        release = threading.Event()
+        thread = self._fence_in_thread(5, release)
+        try:
+            with self.assertRaises(OperationalError):
+                self._fence_with_timeout(6)
+        finally:
+            release.set()
+            thread.join()
+        self._fence_with_timeout(6)
+        self.assertEqual(JobFence.objects.get(name='job').token, 6)
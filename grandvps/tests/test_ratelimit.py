@@ -0,0 +1,79 @@
+from django.core.cache import cache
+from django.contrib.auth.models import AnonymousUser
+from django.http import HttpResponse
+from django.test import SimpleTestCase, RequestFactory, override_settings
+from unittest.mock import patch
+
+from grandvps.ratelimit import RateLimiter, rate_limit, client_ip
+
+
+class RateLimiterTests(SimpleTestCase):
+    """Tests for the sliding-window limiter on the cache backend"""
+
+    def setUp(self):
+        cache.clear()
+        self.addCleanup(cache.clear)
+        self.factory = RequestFactory()
+
+    def test_limit_within_window(self):
+        limiter = RateLimiter('test', limit=3, window=60)
+
+        results = [limiter.hit('user:1', now=1000.0) for _ in range(4)]
+
+        self.assertEqual([r.allowed for r in results], [True, True, True, False])
+        self.assertEqual(results[2].remaining, 0)
+        self.assertGreater(results[3].retry_after, 0)
+        # Other identities have their own budget
+        self.assertTrue(limiter.hit('user:2', now=1000.0).allowed)
+
+    def test_window_boundary_does_not_double_the_limit(self):
+        limiter = RateLimiter('test', limit=3, window=60)
+        # Three hits at the very end of one fixed window...
+        for _ in range(3):
+            self.assertTrue(limiter.hit('user:1', now=1019.0).allowed)
+        # ...still count right after the boundary
+        self.assertFalse(limiter.hit('user:1', now=1021.0).allowed)
+        # and age out as the window slides past them
+        self.assertTrue(limiter.hit('user:1', now=1079.0).allowed)
+
+    def test_rejected_hits_do_not_extend_the_block(self):
+        limiter = RateLimiter('test', limit=1, window=60)
+        limiter.hit('user:1', now=1000.0)
+        for _ in range(5):
+            self.assertFalse(limiter.hit('user:1', now=1001.0).allowed)
+        self.assertTrue(limiter.hit('user:1', now=1080.0).allowed)
+
+    def test_backend_errors_fail_open(self):
+        limiter = RateLimiter('test', limit=1, window=60)
+        with patch.object(cache, 'incr', side_effect=ConnectionError('down')):
+            self.assertTrue(limiter.hit('user:1').allowed)
+            self.assertTrue(limiter.hit('user:1').allowed)
+
+    def test_client_ip_behind_proxies(self):
+        request = self.factory.get('/', HTTP_X_FORWARDED_FOR='1.1.1.1, 2.2.2.2', REMOTE_ADDR='10.0.0.1')
+        self.assertEqual(client_ip(request), '10.0.0.1')
+        with override_settings(RATE_LIMIT_PROXY_COUNT=1):
+            # The spoofable first entry is ignored
+            self.assertEqual(client_ip(request), '2.2.2.2')
+
+    def test_decorator_returns_429(self):
+        @rate_limit('view', limit=1, window=60, key='ip', methods=['POST'])
+        def view(request):
+            return HttpResponse('ok')
+
+        def post(**headers):
+            request = self.factory.post('/', REMOTE_ADDR='10.0.0.1', **headers)
+            request.user = AnonymousUser()
+            return view(request)
+
+        self.assertEqual(post().status_code, 200)
+        response = post()
+        self.assertEqual(response.status_code, 429)
+        self.assertIn('Retry-After', response)
+        response = post(HTTP_X_REQUESTED_WITH='XMLHttpRequest')
+        self.assertEqual(response['Content-Type'], 'application/json')
+
+        # Methods outside `methods` are not counted
+        request = self.factory.get('/', REMOTE_ADDR='10.0.0.1')
+        request.user = AnonymousUser()
+        self.assertEqual(view(request).status_code, 200)
@@ -4,3 +4,7 @@ from django.apps import AppConfig
 class VpsConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'vps'
+
+    def ready(self):
+        # Connect the expiry timer signal handlers
+        from .services import expiry  # noqa: F401
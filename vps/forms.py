@@ -1,7 +1,9 @@
 from django import forms
 from django.contrib.auth.models import User
 from .models import VPSPlan, VPSInstance
-from .services.doprax_client import DopraxClient, DopraxAPIError
+from .services.doprax_client import DopraxAPIError
+from .services.catalog import DopraxCatalog
+from .services.availability import PlanAvailabilityService
 import logging
 
 logger = logging.getLogger(__name__)
@@ -41,12 +43,10 @@ class VPSCreationForm(forms.Form):
         self._load_dynamic_choices()
 
     def _load_dynamic_choices(self):
-        """Load dynamic choices from Doprax API"""
+        """Load dynamic choices from the cached Doprax catalog"""
         try:
-            client = DopraxClient()
-
             # Load locations
-            data = client.get_locations_and_plans()
+            data = DopraxCatalog.locations_and_plans()
             locations = data.get('locationsList', [])
             location_choices = []
             for loc in locations:
@@ -57,7 +57,7 @@ class VPSCreationForm(forms.Form):
             self.fields['location'].choices = location_choices
 
             # Load operating systems
-            os_data = client.get_operating_systems()
+            os_data = DopraxCatalog.operating_systems()
             os_choices = []
             for provider, os_list in os_data.items():
                 for os_item in os_list:
@@ -89,9 +89,11 @@ class VPSCreationForm(forms.Form):
         location = cleaned_data.get('location')
 
         if plan and location:
-            # Additional validation can be added here
-            # For example, check if the selected plan is available in the selected location
-            pass
+            offer = PlanAvailabilityService.offer(plan, location)
+            if offer is None:
+                raise forms.ValidationError("The selected plan is not available in this location")
+            # Creation needs the offer's machine type code and provider
+            cleaned_data['offer'] = offer
 
         return cleaned_data
 
@@ -1,6 +1,8 @@
 from django.core.management.base import BaseCommand, CommandError
 from vps.models import VPSInstance
 from vps.services.doprax_client import DopraxClient, DopraxAPIError
+from vps.services.status_sync import VPSStatusSyncService
+from grandvps.locks import DistributedLock, LockNotAcquired
 import logging
 
 logger = logging.getLogger(__name__)
@@ -15,6 +17,23 @@ class Command(BaseCommand):
             action='store_true',
             help='Show what would be done without making changes',
         )
+        parser.add_argument(
+            '--reconcile',
+            action='store_true',
+            help='Match instances against the bulk VM listing, polling only instances missing from it',
+        )
+        parser.add_argument(
+            '--concurrency',
+            type=int,
+            default=None,
+            help='Maximum number of concurrent status requests (default: DOPRAX_STATUS_POLL_CONCURRENCY)',
+        )
+        parser.add_argument(
+            '--rate-limit',
+            type=float,
+            default=None,
+            help='Maximum requests per second to the Doprax API (default: DOPRAX_RATE_LIMIT_PER_SECOND)',
+        )
 
     def handle(self, *args, **options):
         dry_run = options['dry_run']
@@ -23,79 +42,43 @@ class Command(BaseCommand):
             self.stdout.write(self.style.WARNING('DRY RUN MODE - No changes will be made'))
 
         try:
-            client = DopraxClient()
-            vps_instances = VPSInstance.objects.all()
-
-            if not vps_instances:
+            if not VPSInstance.objects.exists():
                 self.stdout.write('No VPS instances found in database')
                 return
 
-            updated_count = 0
-            error_count = 0
-
-            for vps in vps_instances:
-                try:
-                    # Get current status from API
-                    status_data = client.get_vps_status(vps.instance_id)
-
-                    new_status = status_data.get('status', '').lower()
-                    new_ip = status_data.get('ipv4')
-
-                    # Map API status to our model status
-                    status_mapping = {
-                        'active': 'active',
-                        'running': 'active',
-                        'stopped': 'stopped',
-                        'pending': 'pending',
-                        'terminated': 'terminated',
-                        'suspended': 'suspended',
-                    }
-
-                    mapped_status = status_mapping.get(new_status, 'pending')
-
-                    # Check if status or IP changed
-                    status_changed = vps.status != mapped_status
-                    ip_changed = (new_ip and vps.ip_address != new_ip)
-
-                    if status_changed or ip_changed:
-                        if not dry_run:
-                            vps.status = mapped_status
-                            if new_ip:
-                                vps.ip_address = new_ip
-                            vps.save()
-                            updated_count += 1
-                            self.stdout.write(
-                                self.style.SUCCESS(
-                                    f'Updated {vps.instance_id}: status={mapped_status}, ip={new_ip or "unchanged"}'
-                                )
-                            )
-                        else:
-                            updated_count += 1
-                            self.stdout.write(
-                                f'Would update {vps.instance_id}: status={mapped_status}, ip={new_ip or "unchanged"}'
-                            )
-                    else:
-                        self.stdout.write(f'No changes needed for {vps.instance_id}')
-
-                except DopraxAPIError as e:
-                    error_count += 1
-                    self.stdout.write(
-                        self.style.ERROR(f'Error updating {vps.instance_id}: {str(e)}')
-                    )
-                except Exception as e:
-                    error_count += 1
-                    logger.error(f'Unexpected error updating VPS {vps.instance_id}: {str(e)}')
-                    self.stdout.write(
-                        self.style.ERROR(f'Unexpected error updating {vps.instance_id}: {str(e)}')
-                    )
+            with DistributedLock(VPSStatusSyncService.LOCK_NAME) as lock:
+                result = VPSStatusSyncService.sync(
+                    DopraxClient(),
+                    reconcile=options['reconcile'],
+                    dry_run=dry_run,
+                    concurrency=options['concurrency'],
+                    rate_limit=options['rate_limit'],
+                    lock=lock
+                )
+
+            for vps, error in result['errors']:
+                prefix = 'Error' if isinstance(error, DopraxAPIError) else 'Unexpected error'
+                self.stdout.write(
+                    self.style.ERROR(f'{prefix} updating {vps.instance_id}: {str(error)}')
+                )
+
+            for vps in result['changed']:
+                prefix = 'Would update' if dry_run else 'Updated'
+                message = f'{prefix} {vps.instance_id}: status={vps.status}, ip={vps.ip_address or "unchanged"}'
+                self.stdout.write(message if dry_run else self.style.SUCCESS(message))
+
+            for vps in result['unchanged']:
+                self.stdout.write(f'No changes needed for {vps.instance_id}')
 
             # Summary
             self.stdout.write(self.style.SUCCESS(
-                f'Status update completed. Updated: {updated_count}, Errors: {error_count}'
+                f"Status update completed. Updated: {len(result['changed'])}, Errors: {len(result['errors'])}"
             ))
 
+        except LockNotAcquired:
+            self.stdout.write(self.style.WARNING('Another status update is in progress, skipping'))
         except DopraxAPIError as e:
             raise CommandError(f'API Error: {str(e)}')
         except Exception as e:
             logger.error(f'Unexpected error during status update: {str(e)}')
-            raise CommandError(f'Unexpected error: {str(e)}')
\ No newline at end of file
+            raise CommandError(f'Unexpected error: {str(e)}')
@@ -0,0 +1,23 @@
+# Generated by Django 5.2.18 on 2026-10-17 12:24
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('vps', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='vpsinstance',
+            name='provisioning_error',
+            field=models.TextField(blank=True),
+        ),
+        migrations.AddField(
+            model_name='vpsinstance',
+            name='provisioning_state',
+            field=models.CharField(choices=[('queued', 'Queued'), ('creating', 'Creating'), ('booting', 'Booting'), ('ready', 'Ready'), ('failed', 'Failed')], default='ready', max_length=20),
+        ),
+    ]
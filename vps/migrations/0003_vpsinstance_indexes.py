@@ -0,0 +1,27 @@
+# Generated by Django 5.2.18 on 2026-10-17 12:35
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('vps', '0002_vpsinstance_provisioning_state'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='vpsinstance',
+            index=models.Index(fields=['status', 'expires_at'], name='vps_status_expires_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='vpsinstance',
+            index=models.Index(fields=['user', 'status'], name='vps_user_status_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='vpsinstance',
+            index=models.Index(condition=models.Q(('status', 'active')), fields=['user', 'expires_at'], name='vps_active_user_expires_idx'),
+        ),
+    ]
@@ -0,0 +1,63 @@
+# Generated by Django 5.2.18 on 2026-10-17 13:10
+
+import logging
+from django.db import migrations
+
+logger = logging.getLogger(__name__)
+
+PLAN_FIELDS = ['cpu_cores', 'ram_gb', 'disk_gb', 'bandwidth_gb', 'price_per_month']
+
+
+def merge_duplicate_plans(apps, schema_editor):
+    """Keep the oldest plan of each name and move instances of its identical duplicates onto it.
+
+    Duplicates that differ in price or specs are not merged: customers on
+    them would silently change plan. The migration aborts listing the plan
+    and instance ids so they can be renamed or reassigned by hand first.
+    Merged duplicates are logged, since the reverse cannot split them again.
+    """
+    VPSPlan = apps.get_model('vps', 'VPSPlan')
+    VPSInstance = apps.get_model('vps', 'VPSInstance')
+
+    groups = {}
+    for plan in VPSPlan.objects.order_by('id').values('id', 'name', *PLAN_FIELDS):
+        groups.setdefault(plan['name'], []).append(plan)
+    duplicates = {name: plans for name, plans in groups.items() if len(plans) > 1}
+
+    conflicts = []
+    for name, plans in duplicates.items():
+        if any(plan[field] != plans[0][field] for plan in plans[1:] for field in PLAN_FIELDS):
+            plan_ids = [plan['id'] for plan in plans]
+            instance_ids = list(VPSInstance.objects.filter(plan_id__in=plan_ids).values_list('id', flat=True))
+            conflicts.append(f'{name!r}: plans {plan_ids}, instances {instance_ids}')
+    if conflicts:
+        raise RuntimeError(
+            'Duplicate VPS plan names with different prices or specs; resolve them before migrating: '
+            + '; '.join(conflicts)
+        )
+
+    for name, plans in duplicates.items():
+        survivor = plans[0]['id']
+        merged = [plan['id'] for plan in plans[1:]]
+        instances = VPSInstance.objects.filter(plan_id__in=merged)
+        instance_ids = list(instances.values_list('id', flat=True))
+        instances.update(plan_id=survivor)
+        VPSPlan.objects.filter(id__in=merged).delete()
+        logger.warning(
+            f'Merged duplicate plans {merged} of {name!r} into plan {survivor}; moved instances {instance_ids}'
+        )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('vps', '0003_vpsinstance_indexes'),
+    ]
+
+    operations = [
+        # Merging identical plans loses nothing the reverse could restore
+        # The unique constraint is added in 0005: on PostgreSQL a table with
+        # pending FK trigger events from this merge cannot be altered in the
+        # same transaction
+        migrations.RunPython(merge_duplicate_plans, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.18 on 2026-10-17 13:10
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('vps', '0004_merge_duplicate_vpsplans'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='vpsplan',
+            name='name',
+            field=models.CharField(max_length=100, unique=True),
+        ),
+    ]
@@ -0,0 +1,29 @@
+# Generated by Django 5.2.18 on 2026-10-17 13:15
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('vps', '0005_vpsplan_unique_name'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PlanAvailability',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('location_code', models.CharField(max_length=100)),
+                ('provider_name', models.CharField(blank=True, max_length=100)),
+                ('machine_type_code', models.CharField(max_length=100)),
+                ('price_per_month', models.DecimalField(decimal_places=2, max_digits=10)),
+                ('is_active', models.BooleanField(default=True)),
+                ('plan', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='availability', to='vps.vpsplan')),
+            ],
+            options={
+                'constraints': [models.UniqueConstraint(fields=('plan', 'location_code'), name='vps_plan_location_unique')],
+            },
+        ),
+    ]
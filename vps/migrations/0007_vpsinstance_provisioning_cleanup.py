@@ -0,0 +1,18 @@
+# Generated by Django 5.2.18 on 2026-10-17 13:39
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('vps', '0006_planavailability'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='vpsinstance',
+            name='provisioning_state',
+            field=models.CharField(choices=[('queued', 'Queued'), ('creating', 'Creating'), ('booting', 'Booting'), ('ready', 'Ready'), ('cleanup', 'Cleanup'), ('failed', 'Failed')], default='ready', max_length=20),
+        ),
+    ]
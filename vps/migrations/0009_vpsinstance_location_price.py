@@ -0,0 +1,23 @@
+# Generated by Django 5.2.18 on 2026-10-17 14:30
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('vps', '0008_vpsinstance_user_no_fk_index'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='vpsinstance',
+            name='location_code',
+            field=models.CharField(blank=True, max_length=100),
+        ),
+        migrations.AddField(
+            model_name='vpsinstance',
+            name='price_per_month',
+            field=models.DecimalField(blank=True, decimal_places=2, max_digits=10, null=True),
+        ),
+    ]
@@ -1,10 +1,11 @@
 from django.db import models
+from django.db.models.functions import Coalesce
 from django.contrib.auth.models import User
 
 # Create your models here.
 
 class VPSPlan(models.Model):
-    name = models.CharField(max_length=100)
+    name = models.CharField(max_length=100, unique=True)
     cpu_cores = models.IntegerField()
     ram_gb = models.IntegerField()
     disk_gb = models.IntegerField()
@@ -15,6 +16,24 @@ class VPSPlan(models.Model):
     def __str__(self):
         return self.name
 
+class PlanAvailability(models.Model):
+    """A plan as offered in one Doprax location, kept current by the plan sync"""
+    plan = models.ForeignKey(VPSPlan, on_delete=models.CASCADE, related_name='availability')
+    location_code = models.CharField(max_length=100)
+    provider_name = models.CharField(max_length=100, blank=True)
+    machine_type_code = models.CharField(max_length=100)
+    price_per_month = models.DecimalField(max_digits=10, decimal_places=2)
+    is_active = models.BooleanField(default=True)
+
+    class Meta:
+        constraints = [
+            # One offer per plan and location; also the index behind availability lookups
+            models.UniqueConstraint(fields=['plan', 'location_code'], name='vps_plan_location_unique'),
+        ]
+
+    def __str__(self):
+        return f"{self.plan.name} @ {self.location_code}"
+
 class VPSInstance(models.Model):
     STATUS_CHOICES = [
         ('pending', 'Pending'),
@@ -24,19 +43,62 @@ class VPSInstance(models.Model):
         ('terminated', 'Terminated'),
     ]
 
-    user = models.ForeignKey(User, on_delete=models.CASCADE)
+    PROVISIONING_CHOICES = [
+        ('queued', 'Queued'),
+        ('creating', 'Creating'),
+        ('booting', 'Booting'),
+        ('ready', 'Ready'),
+        ('cleanup', 'Cleanup'),
+        ('failed', 'Failed'),
+    ]
+
+    # vps_user_status_idx leads with user, so the FK needs no index of its own
+    user = models.ForeignKey(User, on_delete=models.CASCADE, db_index=False)
     plan = models.ForeignKey(VPSPlan, on_delete=models.CASCADE)
     instance_id = models.CharField(max_length=100, unique=True)
     status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='pending')
     created_at = models.DateTimeField(auto_now_add=True)
     expires_at = models.DateTimeField()
     ip_address = models.GenericIPAddressField(blank=True, null=True)
+    provisioning_state = models.CharField(max_length=20, choices=PROVISIONING_CHOICES, default='ready')
+    provisioning_error = models.TextField(blank=True)
+    # The location bought and its monthly price at purchase. Plans are priced
+    # per location, so renewals and billing charge this price; instances
+    # bought before it was stored fall back to the plan's price
+    location_code = models.CharField(max_length=100, blank=True)
+    price_per_month = models.DecimalField(max_digits=10, decimal_places=2, blank=True, null=True)
+
+    class Meta:
+        indexes = [
+            # Renewal and expiry sweeps: status + expires_at range
+            models.Index(fields=['status', 'expires_at'], name='vps_status_expires_idx'),
+            # Per-user counts and listings filtered by status
+            models.Index(fields=['user', 'status'], name='vps_user_status_idx'),
+            # Billing and per-user renewal only ever look at active instances
+            models.Index(
+                fields=['user', 'expires_at'],
+                condition=models.Q(status='active'),
+                name='vps_active_user_expires_idx'
+            ),
+        ]
 
     def __str__(self):
         return f"{self.user.username} - {self.plan.name} - {self.instance_id}"
 
+    @staticmethod
+    def monthly_price_expression():
+        """Query expression for the monthly price an instance is charged"""
+        return Coalesce('price_per_month', 'plan__price_per_month')
+
+    @property
+    def monthly_price(self):
+        return self.price_per_month if self.price_per_month is not None else self.plan.price_per_month
+
     def renew(self, days=30):
-        """Renew the VPS for specified days"""
+        """Renew the VPS for specified days.
+
+        Saving reschedules the instance's expiry and warning timers.
+        """
         from django.utils import timezone
         from datetime import timedelta
 
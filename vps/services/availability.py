@@ -0,0 +1,31 @@
+"""
+Plan availability per location.
+
+Reads the PlanAvailability rows written by the plan sync, so checking
+whether a plan can be bought in a location, finding its Doprax machine type
+code and showing where a plan is offered are indexed local lookups instead
+of round-trips to the Doprax catalog.
+"""
+
+from django.db.models import Count, Min, Q
+from ..models import VPSPlan, PlanAvailability
+
+
+class PlanAvailabilityService:
+    """Local lookups over the synced plan x location offers"""
+
+    @staticmethod
+    def offer(plan, location_code):
+        """The active offer of a plan in a location, or None if it is not sold there"""
+        return PlanAvailability.objects.filter(
+            plan=plan, location_code=location_code, is_active=True
+        ).first()
+
+    @staticmethod
+    def plans():
+        """Active plans annotated with their location count and lowest location price"""
+        active_offers = Q(availability__is_active=True)
+        return VPSPlan.objects.filter(is_active=True).annotate(
+            location_count=Count('availability', filter=active_offers),
+            lowest_location_price=Min('availability__price_per_month', filter=active_offers),
+        )
@@ -0,0 +1,121 @@
+"""
+Cached Doprax catalog (locations with plans, and operating systems).
+
+Each catalog section is kept in the Django cache together with the time it
+was fetched. Readers always get the cached copy immediately; once it is older
+than DOPRAX_CATALOG_TTL a background refresh is queued and the stale copy is
+served until it lands. Refreshes are single-flight: a short-lived lock key
+ensures only one refresh per section is in flight. A cold cache queues a
+refresh and reports the catalog as unavailable instead of calling Doprax
+inline, so page rendering never waits on the API.
+"""
+
+import time
+import logging
+from typing import Any, Dict, List
+from django.conf import settings
+from django.core.cache import cache
+from .doprax_client import DopraxClient, DopraxAPIError
+
+logger = logging.getLogger(__name__)
+
+SECTIONS = {
+    'locations_and_plans': 'get_locations_and_plans',
+    'operating_systems': 'get_operating_systems',
+}
+CACHE_KEY = 'vps:catalog:{}'
+LOCK_KEY = 'vps:catalog:{}:refreshing'
+LOCK_TIMEOUT = 60
+
+
+class CatalogUnavailable(DopraxAPIError):
+    """Raised when a catalog section has not been cached yet"""
+    pass
+
+
+class DopraxCatalog:
+    """Read-through cache over the Doprax catalog endpoints"""
+
+    @staticmethod
+    def ttl():
+        """Seconds after which a cached section is refreshed in the background"""
+        return getattr(settings, 'DOPRAX_CATALOG_TTL', 15 * 60)
+
+    @staticmethod
+    def stale_ttl():
+        """Seconds a cached section may still be served while a refresh is pending"""
+        return getattr(settings, 'DOPRAX_CATALOG_STALE_TTL', 24 * 60 * 60)
+
+    @staticmethod
+    def _read(section):
+        try:
+            return cache.get(CACHE_KEY.format(section))
+        except Exception as e:
+            logger.warning(f'Catalog cache unavailable: {str(e)}')
+            return None
+
+    @staticmethod
+    def get(section: str):
+        """Return a catalog section from the cache, refreshing it in the background when stale"""
+        entry = DopraxCatalog._read(section)
+
+        if entry is None:
+            DopraxCatalog.schedule_refresh(section)
+            # An eager or very quick refresh may already have filled the cache
+            entry = DopraxCatalog._read(section)
+            if entry is None:
+                raise CatalogUnavailable(f'Doprax catalog "{section}" is not loaded yet')
+        elif time.time() - entry['fetched_at'] > DopraxCatalog.ttl():
+            DopraxCatalog.schedule_refresh(section)
+
+        return entry['data']
+
+    @staticmethod
+    def locations_and_plans() -> Dict[str, Any]:
+        return DopraxCatalog.get('locations_and_plans')
+
+    @staticmethod
+    def operating_systems() -> Dict[str, List[Dict]]:
+        return DopraxCatalog.get('operating_systems')
+
+    @staticmethod
+    def schedule_refresh(section: str) -> bool:
+        """Queue a refresh unless one is already in flight; returns True if queued"""
+        from ..tasks import refresh_doprax_catalog
+
+        lock_key = LOCK_KEY.format(section)
+        try:
+            if not cache.add(lock_key, 1, LOCK_TIMEOUT):
+                return False
+        except Exception as e:
+            logger.warning(f'Catalog cache unavailable: {str(e)}')
+            return False
+
+        try:
+            refresh_doprax_catalog.delay(section)
+        except Exception as e:
+            logger.error(f'Failed to queue catalog refresh for {section}: {str(e)}')
+            cache.delete(lock_key)
+            return False
+        return True
+
+    @staticmethod
+    def store(section: str, data):
+        """Cache freshly fetched section data, e.g. from a plan sync that already downloaded it"""
+        cache.set(
+            CACHE_KEY.format(section),
+            {'data': data, 'fetched_at': time.time()},
+            DopraxCatalog.stale_ttl()
+        )
+
+    @staticmethod
+    def refresh(section: str, client=None):
+        """Fetch a section from Doprax and store it; always releases the refresh lock"""
+        try:
+            client = client or DopraxClient()
+            data = getattr(client, SECTIONS[section])()
+            DopraxCatalog.store(section, data)
+            logger.info(f'Refreshed Doprax catalog section {section}')
+            return data
+        finally:
+            cache.delete(LOCK_KEY.format(section))
@@ -1,16 +1,54 @@
 import requests
 import os
 import logging
+import threading
 from typing import Dict, List, Optional, Any
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 from django.conf import settings
 from django.core.exceptions import ImproperlyConfigured
 
 logger = logging.getLogger(__name__)
 
+_session = None
+_session_lock = threading.Lock()
+
+
+def get_session() -> requests.Session:
+    """Return the process-wide pooled session shared by every DopraxClient.
+
+    Connections to doprax.com are kept alive and reused across clients,
+    views and poller threads. Idempotent GETs are retried on connection
+    errors and gateway failures; POSTs are only retried when the connection
+    could not be established.
+    """
+    global _session
+    if _session is None:
+        with _session_lock:
+            if _session is None:
+                retry = Retry(
+                    total=getattr(settings, 'DOPRAX_MAX_RETRIES', 3),
+                    backoff_factor=0.5,
+                    status_forcelist=(502, 503, 504),
+                    allowed_methods=frozenset(['GET']),
+                    raise_on_status=False,
+                )
+                pool_size = getattr(settings, 'DOPRAX_POOL_MAXSIZE', 20)
+                adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size, max_retries=retry)
+                session = requests.Session()
+                session.mount('https://', adapter)
+                session.mount('http://', adapter)
+                _session = session
+    return _session
+
 
 class DopraxAPIError(Exception):
     """Custom exception for Doprax API errors"""
-    pass
+
+    def __init__(self, message='', status_code=None):
+        super().__init__(message)
+        # HTTP status of the failed response, None for connection and parsing errors
+        self.status_code = status_code
 
 
 class DopraxClient:
@@ -26,7 +64,12 @@ class DopraxClient:
             "X-API-Key": self.api_key,
             "Content-Type": "application/json"
         }
-        self.timeout = 30
+        # (connect, read) so an unreachable host fails fast without cutting slow responses short
+        self.timeout = (
+            getattr(settings, 'DOPRAX_CONNECT_TIMEOUT', 5),
+            getattr(settings, 'DOPRAX_READ_TIMEOUT', 30),
+        )
+        self.session = get_session()
 
     def _make_request(self, method: str, endpoint: str, data: Optional[Dict] = None) -> Dict[str, Any]:
         """Make HTTP request to Doprax API with error handling"""
@@ -34,9 +77,11 @@ class DopraxClient:
 
         try:
             if method.upper() == 'GET':
-                response = requests.get(url, headers=self.headers, timeout=self.timeout)
+                response = self.session.get(url, headers=self.headers, timeout=self.timeout)
             elif method.upper() == 'POST':
-                response = requests.post(url, headers=self.headers, json=data, timeout=self.timeout)
+                response = self.session.post(url, headers=self.headers, json=data, timeout=self.timeout)
+            elif method.upper() == 'DELETE':
+                response = self.session.delete(url, headers=self.headers, timeout=self.timeout)
             else:
                 raise ValueError(f"Unsupported HTTP method: {method}")
 
@@ -49,7 +94,8 @@ class DopraxClient:
 
         except requests.exceptions.RequestException as e:
             logger.error(f"Doprax API request failed: {method} {endpoint} - {str(e)}")
-            raise DopraxAPIError(f"API request failed: {str(e)}")
+            status_code = e.response.status_code if e.response is not None else None
+            raise DopraxAPIError(f"API request failed: {str(e)}", status_code=status_code)
         except ValueError as e:
             logger.error(f"Invalid JSON response from Doprax API: {method} {endpoint} - {str(e)}")
             raise DopraxAPIError(f"Invalid API response: {str(e)}")
@@ -109,20 +155,32 @@ class DopraxClient:
             raise
 
     def delete_vps(self, vm_code: str) -> bool:
-        """Delete a VPS instance"""
+        """Delete a VPS instance; a VM that is already gone counts as deleted"""
         try:
-            # Note: This might need to be implemented based on actual API
-            # For now, returning True as placeholder
+            self._make_request('DELETE', f'/api/v1/vms/{vm_code}/')
             return True
-        except DopraxAPIError:
+        except DopraxAPIError as e:
+            if e.status_code == 404:
+                return True
             raise
 
-    def get_vps_list(self) -> List[Dict[str, Any]]:
-        """Get list of all VPS instances"""
+    def get_vps_list(self, max_pages: int = 100) -> List[Dict[str, Any]]:
+        """Get list of all VPS instances, following pagination if the API paginates"""
+        vms = []
+        page = 1
         try:
-            # This endpoint might need to be confirmed with actual API
-            response = self._make_request('GET', '/api/v1/vms/')
-            return response.get('data', [])
+            while page <= max_pages:
+                endpoint = '/api/v1/vms/' if page == 1 else f'/api/v1/vms/?page={page}'
+                response = self._make_request('GET', endpoint)
+                data = response.get('data', [])
+                vms.extend(data)
+
+                pagination = response.get('pagination') or {}
+                has_next = response.get('next') or response.get('hasNext') or pagination.get('next')
+                if not data or not has_next:
+                    break
+                page += 1
+            return vms
         except DopraxAPIError:
             raise
 
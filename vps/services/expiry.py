@@ -0,0 +1,288 @@
+"""
+Timer wheel for VPS expiry and pre-expiry warnings.
+
+Every active instance has a timer for its expires_at and one per warning
+offset in VPS_EXPIRY_WARNING_DAYS, kept in a Redis sorted set scored by the
+Unix time they fire. A once-a-minute task pops the timers that are due and
+renews (or suspends) and warns exactly those instances, so no job has to scan
+VPSInstance for expired rows.
+
+Timers follow the instance: saving it (including `VPSInstance.renew`)
+reschedules them, and suspending, terminating or deleting it drops them.
+Writes that bypass signals (bulk renewal, status sync) reschedule
+explicitly. Re-adding a timer only moves its score, so rescheduling is
+idempotent. Timers whose renewal or warning fails are put back, due at
+once, and retried on the next run. The daily auto-renewal sweep and `rebuild()` cover timers that
+were lost, for example after a Redis flush.
+"""
+
+import logging
+from datetime import timedelta
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import receiver
+from django.utils import timezone
+from grandvps.redis_client import get_redis_client
+from ..models import VPSInstance
+
+logger = logging.getLogger(__name__)
+
+TIMERS_KEY = 'grandvps:vps:expiry_timers'
+EXPIRE = 'expire'
+WARN = 'warn'
+
+# Pop up to ARGV[2] timers scored at or before ARGV[1] in one atomic step
+POP_DUE_SCRIPT = """
+local due = redis.call('zrangebyscore', KEYS[1], '-inf', ARGV[1], 'LIMIT', 0, ARGV[2])
+if #due > 0 then
+    redis.call('zrem', KEYS[1], unpack(due))
+end
+return due
+"""
+
+
+class RedisTimerBackend:
+    """Timers as members of a Redis sorted set"""
+
+    def __init__(self, client):
+        self.client = client
+        self.pop_due_script = client.register_script(POP_DUE_SCRIPT)
+
+    def add(self, timers):
+        if timers:
+            self.client.zadd(TIMERS_KEY, timers)
+
+    def remove(self, members):
+        if members:
+            self.client.zrem(TIMERS_KEY, *members)
+
+    def pop_due(self, now, limit):
+        return [
+            member.decode() if isinstance(member, bytes) else member
+            for member in self.pop_due_script(keys=[TIMERS_KEY], args=[now, limit])
+        ]
+
+    def score(self, member):
+        return self.client.zscore(TIMERS_KEY, member)
+
+
+class CacheTimerBackend:
+    """Timers as one dict in the Django cache, for non-Redis deployments and tests"""
+
+    def _timers(self):
+        return cache.get(TIMERS_KEY) or {}
+
+    def add(self, timers):
+        if timers:
+            cache.set(TIMERS_KEY, {**self._timers(), **timers}, None)
+
+    def remove(self, members):
+        timers = self._timers()
+        for member in members:
+            timers.pop(member, None)
+        cache.set(TIMERS_KEY, timers, None)
+
+    def pop_due(self, now, limit):
+        timers = self._timers()
+        due = sorted((score, member) for member, score in timers.items() if score <= now)[:limit]
+        for _, member in due:
+            del timers[member]
+        cache.set(TIMERS_KEY, timers, None)
+        return [member for _, member in due]
+
+    def score(self, member):
+        return self._timers().get(member)
+
+
+def get_backend():
+    client = get_redis_client()
+    if client is not None:
+        return RedisTimerBackend(client)
+    return CacheTimerBackend()
+
+
+class ExpiryScheduler:
+    """Schedules and fires the expiry and warning timers of VPS instances"""
+
+    BATCH_SIZE = 500
+
+    @staticmethod
+    def warning_days():
+        return getattr(settings, 'VPS_EXPIRY_WARNING_DAYS', [7, 1])
+
+    @staticmethod
+    def members(instance_pk):
+        return [f'{EXPIRE}:{instance_pk}'] + [
+            f'{WARN}:{days}:{instance_pk}' for days in ExpiryScheduler.warning_days()
+        ]
+
+    @staticmethod
+    def timers_for(instance_pk, expires_at, now=None):
+        """Timers of one instance; warnings whose time has passed are left out"""
+        now = now or timezone.now()
+        timers = {f'{EXPIRE}:{instance_pk}': expires_at.timestamp()}
+        for days in ExpiryScheduler.warning_days():
+            warn_at = expires_at - timedelta(days=days)
+            if warn_at > now:
+                timers[f'{WARN}:{days}:{instance_pk}'] = warn_at.timestamp()
+        return timers
+
+    @staticmethod
+    def schedule(expiries):
+        """(Re)schedule the timers of (instance_pk, expires_at) pairs"""
+        now = timezone.now()
+        timers = {}
+        stale = []
+        for instance_pk, expires_at in expiries:
+            instance_timers = ExpiryScheduler.timers_for(instance_pk, expires_at, now)
+            timers.update(instance_timers)
+            # Drop warnings of a previous expiry that no longer apply
+            stale.extend(m for m in ExpiryScheduler.members(instance_pk) if m not in instance_timers)
+        backend = get_backend()
+        backend.remove(stale)
+        backend.add(timers)
+
+    @staticmethod
+    def cancel(instance_pks):
+        get_backend().remove([member for pk in instance_pks for member in ExpiryScheduler.members(pk)])
+
+    @staticmethod
+    def sync(instances):
+        """Schedule active instances and cancel the timers of the rest"""
+        instances = list(instances)
+        ExpiryScheduler.schedule(
+            (instance.pk, instance.expires_at) for instance in instances if instance.status == 'active'
+        )
+        ExpiryScheduler.cancel(instance.pk for instance in instances if instance.status != 'active')
+
+    @staticmethod
+    def on_commit(func, *args):
+        """Run a timer update after the surrounding transaction commits.
+
+        Timer errors are logged and never fail the write; the daily sweep
+        picks up whatever was missed.
+        """
+        def apply():
+            try:
+                func(*args)
+            except Exception as e:
+                logger.warning(f'Could not update expiry timers: {str(e)}')
+
+        transaction.on_commit(apply)
+
+    @staticmethod
+    def process_due(now=None):
+        """Fire every due timer; returns the number of renewal and warning timers handled.
+
+        Popped timers are re-added if handling them raises, so a failed
+        batch is retried on the next run instead of being lost.
+        """
+        now = now or timezone.now()
+        backend = get_backend()
+        fired = {'renewals': 0, 'warnings': 0}
+
+        while True:
+            members = backend.pop_due(now.timestamp(), ExpiryScheduler.BATCH_SIZE)
+            if not members:
+                break
+
+            expired, warnings = [], {}
+            expire_members, warn_members = [], []
+            for member in members:
+                parts = member.split(':')
+                if parts[0] == EXPIRE:
+                    expired.append(int(parts[1]))
+                    expire_members.append(member)
+                else:
+                    warnings.setdefault(int(parts[2]), []).append(int(parts[1]))
+                    warn_members.append(member)
+
+            pending = expire_members + warn_members
+            try:
+                if expired:
+                    ExpiryScheduler.renew_expired(expired, now)
+                    fired['renewals'] += len(expired)
+                pending = warn_members
+                if warnings:
+                    ExpiryScheduler.send_warnings(warnings, now)
+                    fired['warnings'] += len(warn_members)
+            except Exception:
+                backend.add({member: now.timestamp() for member in pending})
+                raise
+
+            if len(members) < ExpiryScheduler.BATCH_SIZE:
+                break
+
+        return fired
+
+    @staticmethod
+    def renew_expired(instance_pks, now):
+        from billing.services import BulkAutoRenewalService
+        # The engine only touches instances that are still active and expired
+        return BulkAutoRenewalService.process(now=now, instance_ids=instance_pks)
+
+    @staticmethod
+    def send_warnings(warnings, now):
+        """Queue expiry reminders for {instance_pk: [days_before, ...]} that are still accurate.
+
+        An instance whose timers fired together (after downtime, say) gets
+        one reminder; they all announce the same expiry.
+        """
+        from billing.services import NotificationService, NotificationDigestService
+
+        instances = VPSInstance.objects.filter(
+            pk__in=list(warnings), status='active', expires_at__gt=now
+        ).select_related('user', 'plan')
+        # A timer whose instance was renewed since it was set no longer matches
+        instances = [
+            instance for instance in instances
+            if any(instance.expires_at - timedelta(days=days) <= now for days in warnings[instance.pk])
+        ]
+        if not instances:
+            return
+
+        with transaction.atomic():
+            if NotificationDigestService.enabled():
+                NotificationDigestService.record_events([
+                    NotificationService.build_expiry_warning_event(
+                        instance.user, instance.pk, instance.instance_id, instance.expires_at
+                    )
+                    for instance in instances
+                ])
+            else:
+                NotificationService.queue_emails([
+                    NotificationService.build_expiry_warning_email(
+                        instance.user, instance.instance_id, instance.plan.name, instance.expires_at
+                    )
+                    for instance in instances
+                ])
+
+    @staticmethod
+    def rebuild():
+        """Reschedule every active instance from the database; returns the number scheduled"""
+        count = 0
+        batch = []
+        rows = VPSInstance.objects.filter(status='active').values_list('pk', 'expires_at')
+        for row in rows.iterator(chunk_size=ExpiryScheduler.BATCH_SIZE):
+            batch.append(row)
+            if len(batch) >= ExpiryScheduler.BATCH_SIZE:
+                ExpiryScheduler.schedule(batch)
+                count += len(batch)
+                batch = []
+        ExpiryScheduler.schedule(batch)
+        return count + len(batch)
+
+
+@receiver(post_save, sender=VPSInstance)
+def reschedule_expiry_timers(sender, instance, **kwargs):
+    update_fields = kwargs.get('update_fields')
+    if update_fields is not None and not {'status', 'expires_at'} & set(update_fields):
+        return
+    ExpiryScheduler.on_commit(ExpiryScheduler.sync, [instance])
+
+
+@receiver(post_delete, sender=VPSInstance)
+def cancel_expiry_timers(sender, instance, **kwargs):
+    ExpiryScheduler.on_commit(ExpiryScheduler.cancel, [instance.pk])
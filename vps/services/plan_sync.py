@@ -0,0 +1,219 @@
+"""
+Synchronisation of VPSPlan rows with the Doprax machine type catalog.
+
+Shared by the `sync_plans` management command and the scheduled
+`vps.tasks.sync_plans` task. The desired plan set is built in memory from
+the catalog, diffed against the current rows in one query and written with a
+single upsert plus a single UPDATE deactivating plans that left the catalog.
+
+The same listing is stored per location in PlanAvailability (machine type
+code, provider and price of every plan in every location), which form
+validation and provisioning read instead of calling Doprax. Offers are
+synced the same way: one upsert, one UPDATE withdrawing the rest.
+"""
+
+import logging
+from decimal import Decimal
+from django.db import transaction
+from ..models import VPSPlan, VPSInstance, PlanAvailability
+from .doprax_client import DopraxClient
+from .catalog import DopraxCatalog
+
+logger = logging.getLogger(__name__)
+
+PLAN_FIELDS = ['cpu_cores', 'ram_gb', 'disk_gb', 'bandwidth_gb', 'price_per_month', 'is_active']
+OFFER_FIELDS = ['provider_name', 'machine_type_code', 'price_per_month', 'is_active']
+
+
+class PlanSyncService:
+    """Creates, updates and deactivates VPS plans from the Doprax locations-and-plans listing"""
+
+    LOCK_NAME = 'vps:sync_plans'
+
+    @staticmethod
+    def plan_name(machine):
+        return machine.get('name', f"{machine.get('cpu', 0)}CPU-{machine.get('ramGb', 0)}GB-{machine.get('ssdGb', 0)}GB")
+
+    @staticmethod
+    def monthly_price(machine):
+        return Decimal(str(machine.get('monthlyPriceUsd', 0))).quantize(Decimal('0.01'))
+
+    @staticmethod
+    def machines(data):
+        """Yield (location_code, machine) for every machine type in the listing"""
+        for location_code, machines in data.get('locationMachineTypeMapping', {}).items():
+            # Some locations group their machine types by category
+            if isinstance(machines, dict):
+                machines = [machine for group in machines.values() for machine in group or []]
+            for machine in machines or []:
+                yield location_code, machine
+
+    @staticmethod
+    def desired_plans(data):
+        """Map plan name to field values for every machine type in the catalog.
+
+        A machine type offered in several locations appears once; as before,
+        the last location listed sets its price.
+        """
+        plans = {}
+        processed = 0
+        for location_code, machine in PlanSyncService.machines(data):
+            processed += 1
+            plans[PlanSyncService.plan_name(machine)] = {
+                'cpu_cores': machine.get('cpu', 0),
+                'ram_gb': machine.get('ramGb', 0),
+                'disk_gb': machine.get('ssdGb', 0),
+                'bandwidth_gb': machine.get('monthlyTrafficGb', 0),
+                'price_per_month': PlanSyncService.monthly_price(machine),
+                'is_active': True,
+            }
+        return plans, processed
+
+    @staticmethod
+    def desired_offers(data):
+        """Map (plan name, location code) to the offer's field values"""
+        providers = {
+            location.get('locationCode'): location.get('provider') or ''
+            for location in data.get('locationsList', [])
+        }
+        return {
+            (PlanSyncService.plan_name(machine), location_code): {
+                'provider_name': providers.get(location_code, ''),
+                'machine_type_code': machine.get('machineCode', ''),
+                'price_per_month': PlanSyncService.monthly_price(machine),
+                'is_active': True,
+            }
+            for location_code, machine in PlanSyncService.machines(data)
+        }
+
+    @staticmethod
+    def diff(desired):
+        """Split the desired plans into created and updated names, and find plans to deactivate"""
+        current = {
+            row['name']: row
+            for row in VPSPlan.objects.values('name', *PLAN_FIELDS)
+        }
+        created = [name for name in desired if name not in current]
+        updated = [
+            name for name, fields in desired.items()
+            if name in current and any(current[name][field] != value for field, value in fields.items())
+        ]
+        deactivated = sorted(
+            name for name, row in current.items() if row['is_active'] and name not in desired
+        )
+        return created, updated, deactivated
+
+    @staticmethod
+    def diff_offers(desired):
+        """Return the offers to upsert and the ids of active offers no longer listed"""
+        current = {
+            (row['plan__name'], row['location_code']): row
+            for row in PlanAvailability.objects.values('id', 'plan__name', 'location_code', *OFFER_FIELDS)
+        }
+        changed = [
+            key for key, fields in desired.items()
+            if key not in current or any(current[key][field] != value for field, value in fields.items())
+        ]
+        withdrawn = sorted(
+            row['id'] for key, row in current.items() if row['is_active'] and key not in desired
+        )
+        return changed, withdrawn
+
+    @staticmethod
+    def write_offers(offers, changed, withdrawn):
+        """Upsert changed offers and withdraw the rest; plans must already exist"""
+        if changed:
+            plan_ids = dict(
+                VPSPlan.objects.filter(name__in={name for name, _ in changed}).values_list('name', 'id')
+            )
+            PlanAvailability.objects.bulk_create(
+                [
+                    PlanAvailability(plan_id=plan_ids[name], location_code=location_code, **offers[(name, location_code)])
+                    for name, location_code in changed
+                ],
+                update_conflicts=True,
+                unique_fields=['plan', 'location_code'],
+                update_fields=OFFER_FIELDS
+            )
+        if withdrawn:
+            PlanAvailability.objects.filter(pk__in=withdrawn).update(is_active=False)
+
+    @staticmethod
+    def sync(client=None, dry_run=False, lock=None):
+        """Sync plans and their offers.
+
+        A given DistributedLock is fenced in the writing transaction, so a
+        run that lost its lock during the API call writes nothing.
+
+        Returns the processed count, the created/updated/deactivated plan
+        names and the number of offers changed and withdrawn.
+        """
+        from billing import pricing
+        from dashboard.models import DashboardSummary
+
+        client = client or DopraxClient()
+        logger.info('Starting VPS plans sync from Doprax API')
+
+        # Get locations and plans data
+        data = client.get_locations_and_plans()
+        logger.info(f'Retrieved data for {len(data.get("locationsList", []))} locations')
+
+        desired, processed = PlanSyncService.desired_plans(data)
+        created, updated, deactivated = PlanSyncService.diff(desired)
+        offers = PlanSyncService.desired_offers(data)
+        changed_offers, withdrawn = PlanSyncService.diff_offers(offers)
+        if not desired:
+            # An empty listing is far more likely an API hiccup than a catalog with no plans
+            logger.warning('Doprax returned no machine types, leaving existing plans active')
+            deactivated = []
+            withdrawn = []
+
+        result = {
+            'processed': processed,
+            'created': created,
+            'updated': updated,
+            'deactivated': deactivated,
+            'offers_changed': len(changed_offers),
+            'offers_withdrawn': len(withdrawn),
+        }
+        if dry_run:
+            return result
+
+        changed = created + updated
+        repriced = [
+            name for name, price in VPSPlan.objects.filter(name__in=updated).values_list('name', 'price_per_month')
+            if price != desired[name]['price_per_month']
+        ] if updated else []
+        with transaction.atomic():
+            if lock is not None:
+                lock.fence()
+            if changed:
+                VPSPlan.objects.bulk_create(
+                    [VPSPlan(name=name, **desired[name]) for name in changed],
+                    update_conflicts=True,
+                    unique_fields=['name'],
+                    update_fields=PLAN_FIELDS
+                )
+            if deactivated:
+                VPSPlan.objects.filter(name__in=deactivated, is_active=True).update(is_active=False)
+            PlanSyncService.write_offers(offers, changed_offers, withdrawn)
+            # The upsert skips post_save, so refresh the monthly cost of users
+            # on repriced plans; instances with an agreed price are unaffected
+            if repriced:
+                DashboardSummary.refresh_vps(
+                    VPSInstance.objects.filter(plan__name__in=repriced, price_per_month__isnull=True)
+                    .values_list('user_id', flat=True).distinct()
+                )
+
+        # Neither statement sends post_save, so drop the cached pricing table here
+        if changed or deactivated:
+            pricing.invalidate()
+        if desired:
+            DopraxCatalog.store('locations_and_plans', data)
+
+        logger.info(
+            f"Sync completed. Processed: {processed}, Created: {len(created)}, "
+            f"Updated: {len(updated)}, Deactivated: {len(deactivated)}, "
+            f"Offers changed: {len(changed_offers)}, Offers withdrawn: {len(withdrawn)}"
+        )
+        return result
@@ -0,0 +1,282 @@
+"""
+Asynchronous VPS provisioning.
+
+A purchase moves through queued -> creating -> booting -> ready, or ends in
+failed with the reserved funds refunded. The web request only reserves funds
+and creates the pending VPSInstance; Celery tasks talk to Doprax, poll the VM
+until it is running and then finalize or refund.
+
+A failed VM is deleted at Doprax before the refund is credited. When the
+delete does not go through, the instance waits in cleanup and keeps its
+payment pending until the reaper manages to delete it. The reaper also
+finishes purchases whose task was lost (broker down, worker killed).
+"""
+
+import uuid
+import logging
+from datetime import timedelta
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Q
+from django.utils import timezone
+from wallet.models import Wallet, Transaction, InsufficientBalance
+from ..models import VPSInstance
+from .doprax_client import DopraxClient, DopraxAPIError
+from .status_poller import map_status
+
+logger = logging.getLogger(__name__)
+
+RUNNING_STATES = {'active', 'running'}
+FAILED_STATES = {'error', 'failed', 'terminated'}
+# Instance id prefix used until Doprax assigns the vmCode
+PENDING_PREFIX = 'pending-'
+
+
+class InsufficientBalanceError(Exception):
+    """Raised when the wallet cannot cover the first month of a plan"""
+    pass
+
+
+class VPSProvisioningService:
+    """State machine driving a VPS purchase from reservation to a running VM"""
+
+    @staticmethod
+    def poll_interval():
+        return getattr(settings, 'VPS_PROVISIONING_POLL_INTERVAL', 15)
+
+    @staticmethod
+    def max_polls():
+        return getattr(settings, 'VPS_PROVISIONING_MAX_POLLS', 40)
+
+    @staticmethod
+    def stale_after():
+        """Seconds after which an unfinished purchase is assumed to have lost its task"""
+        return getattr(settings, 'VPS_PROVISIONING_STALE_AFTER', 30 * 60)
+
+    @staticmethod
+    def reserve(user, offer, os_slug, vm_name):
+        """Debit the first month of a plan offer and create a queued instance.
+
+        `offer` is the PlanAvailability of the plan in the chosen location;
+        its price is charged and kept on the instance for renewals and
+        billing, and its machine type is provisioned. The provisioning task
+        starts after commit.
+        """
+        from ..tasks import provision_vps
+
+        plan = offer.plan
+        amount = offer.price_per_month
+        location_code = offer.location_code
+        machine_type_code = offer.machine_type_code
+        provider_name = offer.provider_name or 'Unknown'
+        # Placeholder until Doprax assigns the vmCode
+        instance_id = f'{PENDING_PREFIX}{uuid.uuid4().hex[:12]}'
+        with transaction.atomic():
+            wallet_id = Wallet.objects.filter(user=user).values_list('id', flat=True).get()
+            try:
+                Wallet.debit(
+                    wallet_id,
+                    amount,
+                    transaction_type='payment',
+                    description=f'VPS Creation: {plan.name}',
+                    status='pending',
+                    reference_id=instance_id
+                )
+            except InsufficientBalance:
+                available = Wallet.objects.filter(pk=wallet_id).values_list('balance', flat=True).get()
+                raise InsufficientBalanceError(
+                    f'Insufficient balance. Required: ${amount}, Available: ${available}'
+                )
+
+            instance = VPSInstance.objects.create(
+                user=user,
+                plan=plan,
+                instance_id=instance_id,
+                status='pending',
+                provisioning_state='queued',
+                location_code=location_code,
+                price_per_month=amount,
+                expires_at=timezone.now() + timedelta(days=30)
+            )
+
+            # A broker outage must not fail the request after the debit committed;
+            # the reaper refunds purchases whose task never ran
+            transaction.on_commit(lambda: provision_vps.delay(
+                instance.pk, location_code, machine_type_code, os_slug, provider_name, vm_name
+            ), robust=True)
+
+        logger.info(f'Reserved ${amount} for VPS {instance.instance_id} of user {user.username}')
+        return instance
+
+    @staticmethod
+    def create(instance_pk, location_code, machine_type_code, os_slug, provider_name, vm_name, client=None):
+        """Ask Doprax to create the VM; returns the instance, now booting.
+
+        Only a queued instance is submitted, so a redelivered task never
+        creates a second VM.
+        """
+        claimed = VPSInstance.objects.filter(pk=instance_pk, provisioning_state='queued').update(
+            provisioning_state='creating'
+        )
+        instance = VPSInstance.objects.get(pk=instance_pk)
+        if not claimed:
+            return instance
+
+        client = client or DopraxClient()
+        try:
+            vps_data = client.create_vps(
+                location_code=location_code,
+                machine_type_code=machine_type_code,
+                os_slug=os_slug,
+                provider_name=provider_name,
+                vm_name=vm_name
+            )
+        except Exception as e:
+            if not isinstance(e, DopraxAPIError):
+                logger.exception(f'Unexpected error creating VPS {instance.instance_id}')
+            VPSProvisioningService.fail(instance, f'Failed to create VPS: {str(e)}', client=client)
+            return instance
+
+        old_reference = instance.instance_id
+        instance.instance_id = vps_data.get('vmCode', old_reference)
+        instance.ip_address = vps_data.get('ipv4') or instance.ip_address
+        instance.provisioning_state = 'booting'
+        with transaction.atomic():
+            instance.save(update_fields=['instance_id', 'ip_address', 'provisioning_state'])
+            Transaction.objects.filter(reference_id=old_reference).update(reference_id=instance.instance_id)
+
+        logger.info(f'Doprax accepted VPS {instance.instance_id}, waiting for it to boot')
+        return instance
+
+    @staticmethod
+    def check(instance_pk, attempt, client=None):
+        """Poll a booting VM once.
+
+        Returns True when provisioning reached a final state and False when
+        the VM is still booting and should be polled again.
+        """
+        instance = VPSInstance.objects.get(pk=instance_pk)
+        if instance.provisioning_state != 'booting':
+            return True
+
+        client = client or DopraxClient()
+        try:
+            status_data = client.get_vps_status(instance.instance_id)
+        except DopraxAPIError as e:
+            logger.warning(f'Status check failed for VPS {instance.instance_id}: {str(e)}')
+            status_data = {}
+
+        api_status = (status_data.get('status') or '').lower()
+        if api_status in RUNNING_STATES:
+            VPSProvisioningService.finalize(instance, status_data)
+            return True
+        if api_status in FAILED_STATES:
+            VPSProvisioningService.fail(instance, f'VPS entered state "{api_status}" while booting', client=client)
+            return True
+        if attempt + 1 >= VPSProvisioningService.max_polls():
+            VPSProvisioningService.fail(instance, 'VPS did not start in time', client=client)
+            return True
+        return False
+
+    @staticmethod
+    def finalize(instance, status_data):
+        """Mark the VM active and settle the reserved payment"""
+        with transaction.atomic():
+            instance.status = map_status(status_data.get('status'))
+            instance.ip_address = status_data.get('ipv4') or instance.ip_address
+            instance.provisioning_state = 'ready'
+            instance.save(update_fields=['status', 'ip_address', 'provisioning_state'])
+            Transaction.objects.filter(
+                reference_id=instance.instance_id, transaction_type='payment', status='pending'
+            ).update(status='completed')
+
+        logger.info(f'VPS {instance.instance_id} provisioned for user {instance.user_id}')
+
+    @staticmethod
+    def delete_vm(instance, client=None):
+        """Delete the instance's VM at Doprax; returns False if it may still exist"""
+        if instance.instance_id.startswith(PENDING_PREFIX):
+            # Doprax never accepted the VM
+            return True
+        try:
+            (client or DopraxClient()).delete_vps(instance.instance_id)
+            return True
+        except Exception as e:
+            logger.warning(f'Could not delete VPS {instance.instance_id}: {str(e)}')
+            return False
+
+    @staticmethod
+    def fail(instance, reason, client=None):
+        """Delete the VM, terminate the instance record and refund the reserved payment.
+
+        If the VM cannot be deleted the instance is left in cleanup with its
+        payment still pending, and the reaper retries. Returns True once the
+        instance is terminated.
+        """
+        if not VPSProvisioningService.delete_vm(instance, client):
+            instance.provisioning_state = 'cleanup'
+            instance.provisioning_error = reason
+            instance.save(update_fields=['provisioning_state', 'provisioning_error'])
+            logger.error(f'Provisioning failed for VPS {instance.instance_id}: {reason}; VM left for cleanup')
+            return False
+
+        with transaction.atomic():
+            instance.status = 'terminated'
+            instance.provisioning_state = 'failed'
+            instance.provisioning_error = reason
+            instance.save(update_fields=['status', 'provisioning_state', 'provisioning_error'])
+
+            payment = Transaction.objects.filter(
+                reference_id=instance.instance_id, transaction_type='payment', status='pending'
+            ).first()
+            # Cancelling is a conditional update, so a payment is refunded at most once
+            if payment is not None and Transaction.objects.filter(pk=payment.pk, status='pending').update(status='cancelled'):
+                Wallet.credit(
+                    payment.wallet_id,
+                    payment.amount,
+                    transaction_type='refund',
+                    description=f'Refund for failed VPS creation: {instance.plan.name}',
+                    reference_id=instance.instance_id
+                )
+
+        logger.error(f'Provisioning failed for VPS {instance.instance_id}: {reason}')
+        return True
+
+    @staticmethod
+    def reap(now=None, client=None):
+        """Finish purchases that lost their task and retry pending cleanups.
+
+        Returns the number of instances handled per provisioning state.
+        """
+        now = now or timezone.now()
+        cutoff = now - timedelta(seconds=VPSProvisioningService.stale_after())
+        stale = VPSInstance.objects.filter(
+            Q(provisioning_state__in=['queued', 'creating', 'booting'], created_at__lt=cutoff)
+            | Q(provisioning_state='cleanup')
+        ).select_related('plan')
+
+        reaped = {}
+        for instance in stale:
+            state = instance.provisioning_state
+            if state == 'queued':
+                # Claim it the same way create() does, so a late task cannot submit it
+                if not VPSInstance.objects.filter(pk=instance.pk, provisioning_state='queued').update(
+                    provisioning_state='creating'
+                ):
+                    continue
+                VPSProvisioningService.fail(instance, 'Provisioning task was never run', client=client)
+            elif state == 'creating':
+                # The worker died during create; any VM it made has no vmCode to delete
+                VPSProvisioningService.fail(
+                    instance, 'Provisioning task was interrupted while creating the VM', client=client
+                )
+            elif state == 'booting':
+                # The polling chain was lost: one final check finalizes or fails it
+                VPSProvisioningService.check(instance.pk, VPSProvisioningService.max_polls(), client=client)
+            else:
+                VPSProvisioningService.fail(instance, instance.provisioning_error, client=client)
+            reaped[state] = reaped.get(state, 0) + 1
+
+        if reaped:
+            logger.warning(f'Reaped stale VPS provisioning: {reaped}')
+        return reaped
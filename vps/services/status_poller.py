@@ -0,0 +1,117 @@
+import threading
+import time
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Iterable, List, Optional, Tuple
+from urllib.parse import urlparse
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+# Map Doprax VM states to VPSInstance.status
+STATUS_MAPPING = {
+    'active': 'active',
+    'running': 'active',
+    'stopped': 'stopped',
+    'pending': 'pending',
+    'terminated': 'terminated',
+    'suspended': 'suspended',
+}
+
+
+def map_status(api_status: Optional[str]) -> str:
+    """Translate a Doprax VM status into a VPSInstance status"""
+    return STATUS_MAPPING.get((api_status or '').lower(), 'pending')
+
+
+class HostRateLimiter:
+    """Thread-safe limiter that spaces requests to one host evenly.
+
+    Every caller reserves the next free slot under a lock and sleeps outside
+    it, so the host never sees more than `rate` requests per second no
+    matter how many threads share the limiter.
+    """
+
+    _limiters: Dict[Tuple[str, float], 'HostRateLimiter'] = {}
+    _registry_lock = threading.Lock()
+
+    def __init__(self, rate: float):
+        self.interval = 1.0 / rate if rate and rate > 0 else 0
+        self._next_slot = 0.0
+        self._lock = threading.Lock()
+
+    @classmethod
+    def for_host(cls, host: str, rate: float) -> 'HostRateLimiter':
+        """Return the process-wide limiter for a host"""
+        with cls._registry_lock:
+            key = (host, rate)
+            if key not in cls._limiters:
+                cls._limiters[key] = cls(rate)
+            return cls._limiters[key]
+
+    def acquire(self):
+        if not self.interval:
+            return
+        with self._lock:
+            now = time.monotonic()
+            slot = max(now, self._next_slot)
+            self._next_slot = slot + self.interval
+        wait = slot - now
+        if wait > 0:
+            time.sleep(wait)
+
+
+class VPSStatusPoller:
+    """Fetches VPS statuses from Doprax concurrently with bounded parallelism"""
+
+    def __init__(self, client, concurrency: Optional[int] = None, rate_limit: Optional[float] = None):
+        self.client = client
+        self.concurrency = max(1, concurrency or getattr(settings, 'DOPRAX_STATUS_POLL_CONCURRENCY', 8))
+        rate_limit = rate_limit if rate_limit is not None else getattr(settings, 'DOPRAX_RATE_LIMIT_PER_SECOND', 10)
+        base_url = getattr(client, 'base_url', None)
+        host = urlparse(base_url).netloc if isinstance(base_url, str) else 'doprax'
+        self.limiter = HostRateLimiter.for_host(host, rate_limit)
+
+    def _fetch(self, vm_code: str):
+        self.limiter.acquire()
+        try:
+            return self.client.get_vps_status(vm_code), None
+        except Exception as e:
+            return None, e
+
+    def poll(self, instances: Iterable) -> List[Tuple[object, Optional[Dict], Optional[Exception]]]:
+        """Fetch the status of every instance.
+
+        Returns (instance, status_data, error) tuples in input order; exactly
+        one of status_data and error is set.
+        """
+        instances = list(instances)
+        if not instances:
+            return []
+
+        with ThreadPoolExecutor(max_workers=min(self.concurrency, len(instances))) as executor:
+            outcomes = executor.map(self._fetch, [vps.instance_id for vps in instances])
+            return [(vps, data, error) for vps, (data, error) in zip(instances, outcomes)]
+
+    def reconcile(self, instances: Iterable) -> List[Tuple[object, Optional[Dict], Optional[Exception]]]:
+        """Resolve statuses from the bulk VM listing.
+
+        The full VM list is fetched once and matched to instances by
+        instance_id in memory; only instances missing from the listing are
+        polled individually. Returns the same tuples as poll().
+        """
+        instances = list(instances)
+        listing = {vm.get('vmCode'): vm for vm in self.client.get_vps_list() if vm.get('vmCode')}
+
+        listed = {vps.instance_id: listing[vps.instance_id] for vps in instances if vps.instance_id in listing}
+        missing = [vps for vps in instances if vps.instance_id not in listed]
+        polled = {vps.instance_id: (data, error) for vps, data, error in self.poll(missing)}
+
+        results = []
+        for vps in instances:
+            if vps.instance_id in listed:
+                results.append((vps, listed[vps.instance_id], None))
+            else:
+                data, error = polled[vps.instance_id]
+                results.append((vps, data, error))
+        return results
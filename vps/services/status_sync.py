@@ -0,0 +1,84 @@
+"""
+Refresh of VPSInstance status and IP address from Doprax.
+
+Shared by the `update_vps_statuses` management command and the scheduled
+`vps.tasks.update_vps_statuses` task.
+"""
+
+import logging
+from django.db import transaction
+from ..models import VPSInstance
+from .doprax_client import DopraxClient, DopraxAPIError
+from .status_poller import VPSStatusPoller, map_status
+
+logger = logging.getLogger(__name__)
+
+
+class VPSStatusSyncService:
+    """Polls provisioned VPS instances and writes back the ones whose state changed"""
+
+    LOCK_NAME = 'vps:update_statuses'
+
+    @staticmethod
+    def sync(client=None, reconcile=False, dry_run=False, concurrency=None, rate_limit=None, lock=None):
+        """Poll provisioned instances and apply changes with one bulk_update.
+
+        Instances still being provisioned (including placeholder `pending-`
+        ids Doprax does not know), failed ones and terminated ones are
+        owned by the provisioning service and left alone. A given
+        DistributedLock is checked after polling and fenced in the writing
+        transaction, so a run that outlived its lease writes nothing.
+
+        Returns a dict with the `changed` instances, the `unchanged` ones and
+        `errors` as (instance, exception) pairs.
+        """
+        from dashboard.models import DashboardSummary
+        from .expiry import ExpiryScheduler
+
+        result = {'changed': [], 'unchanged': [], 'errors': []}
+        vps_instances = list(
+            VPSInstance.objects.filter(provisioning_state='ready').exclude(status='terminated')
+            .only('id', 'user_id', 'instance_id', 'status', 'ip_address', 'expires_at')
+        )
+        if not vps_instances:
+            return result
+
+        poller = VPSStatusPoller(
+            client or DopraxClient(),
+            concurrency=concurrency,
+            rate_limit=rate_limit
+        )
+        results = poller.reconcile(vps_instances) if reconcile else poller.poll(vps_instances)
+
+        for vps, status_data, error in results:
+            if error is not None:
+                if not isinstance(error, DopraxAPIError):
+                    logger.error(f'Unexpected error updating VPS {vps.instance_id}: {str(error)}')
+                result['errors'].append((vps, error))
+                continue
+
+            mapped_status = map_status(status_data.get('status'))
+            new_ip = status_data.get('ipv4')
+
+            # Check if status or IP changed
+            if vps.status != mapped_status or (new_ip and vps.ip_address != new_ip):
+                vps.status = mapped_status
+                if new_ip:
+                    vps.ip_address = new_ip
+                result['changed'].append(vps)
+            else:
+                result['unchanged'].append(vps)
+
+        if result['changed'] and not dry_run:
+            if lock is not None:
+                lock.check()
+            with transaction.atomic():
+                if lock is not None:
+                    lock.fence()
+                VPSInstance.objects.bulk_update(result['changed'], ['status', 'ip_address'], batch_size=500)
+                # bulk_update skips post_save, so refresh the affected dashboard summaries
+                # and expiry timers here
+                DashboardSummary.refresh_vps(vps.user_id for vps in result['changed'])
+                ExpiryScheduler.on_commit(ExpiryScheduler.sync, result['changed'])
+
+        return result
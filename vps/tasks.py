@@ -0,0 +1,92 @@
+import logging
+from celery import shared_task
+from grandvps.locks import single_flight
+from .services.catalog import DopraxCatalog, SECTIONS
+from .services.plan_sync import PlanSyncService
+from .services.status_sync import VPSStatusSyncService
+from .services.expiry import ExpiryScheduler
+from .services.provisioning import VPSProvisioningService
+from .services.doprax_client import DopraxAPIError
+
+logger = logging.getLogger(__name__)
+
+
+@shared_task
+def refresh_doprax_catalog(section=None):
+    """Refresh one cached catalog section, or all of them; stale copies are kept on failure"""
+    refreshed = []
+    for name in ([section] if section else SECTIONS):
+        try:
+            DopraxCatalog.refresh(name)
+            refreshed.append(name)
+        except DopraxAPIError as e:
+            logger.error(f'Catalog refresh failed for {name}: {str(e)}')
+    return refreshed
+
+
+@shared_task
+@single_flight(VPSStatusSyncService.LOCK_NAME, pass_lock=True)
+def update_vps_statuses(reconcile=True, lock=None):
+    """Scheduled status sync; reconcile mode lists VMs in bulk and polls only the rest"""
+    result = VPSStatusSyncService.sync(reconcile=reconcile, lock=lock)
+    for vps, error in result['errors']:
+        logger.warning(f'Status sync failed for VPS {vps.instance_id}: {str(error)}')
+    return {'updated': len(result['changed']), 'errors': len(result['errors'])}
+
+
+@shared_task
+@single_flight(PlanSyncService.LOCK_NAME, pass_lock=True)
+def sync_plans(lock=None):
+    """Scheduled plan sync with the Doprax catalog"""
+    result = PlanSyncService.sync(lock=lock)
+    return {
+        'processed': result['processed'],
+        'created': len(result['created']),
+        'updated': len(result['updated']),
+        'deactivated': len(result['deactivated']),
+        'offers_changed': result['offers_changed'],
+        'offers_withdrawn': result['offers_withdrawn'],
+    }
+
+
+@shared_task
+@single_flight('vps:expiry_timers')
+def process_expiry_timers():
+    """Renew, suspend and warn the instances whose expiry timers are due"""
+    return ExpiryScheduler.process_due()
+
+
+@shared_task
+@single_flight('vps:expiry_timers_rebuild', ttl=30 * 60)
+def rebuild_expiry_timers():
+    """Re-seed every active instance's timers from the database"""
+    return ExpiryScheduler.rebuild()
+
+
+@shared_task
+def provision_vps(instance_pk, location_code, machine_type_code, os_slug, provider_name, vm_name):
+    """Submit a reserved VPS to Doprax and start polling it until it boots"""
+    instance = VPSProvisioningService.create(
+        instance_pk, location_code, machine_type_code, os_slug, provider_name, vm_name
+    )
+    if instance.provisioning_state == 'booting':
+        poll_vps_provisioning.apply_async(
+            (instance_pk, 0), countdown=VPSProvisioningService.poll_interval()
+        )
+    return instance.provisioning_state
+
+
+@shared_task
+@single_flight('vps:reap_provisioning')
+def reap_stale_provisioning():
+    """Refund or finish purchases whose provisioning task was lost, and retry VM cleanups"""
+    return VPSProvisioningService.reap()
+
+
+@shared_task
+def poll_vps_provisioning(instance_pk, attempt=0):
+    """Check a booting VPS, re-scheduling itself until it is running or gives up"""
+    if not VPSProvisioningService.check(instance_pk, attempt):
+        poll_vps_provisioning.apply_async(
+            (instance_pk, attempt + 1), countdown=VPSProvisioningService.poll_interval()
+        )
@@ -1,18 +1,27 @@
-from django.test import TestCase, Client
+from django.test import TestCase, Client, override_settings
 from django.contrib.auth.models import User
 from django.utils import timezone
 from django.urls import reverse
 from django.core.management import call_command
-from django.core.exceptions import ImproperlyConfigured
+from django.core.exceptions import ImproperlyConfigured, ValidationError
+from django.core.cache import cache
 from datetime import timedelta
 from decimal import Decimal
 from unittest.mock import patch, MagicMock
 import json
 
-from .models import VPSPlan, VPSInstance
+from .models import VPSPlan, VPSInstance, PlanAvailability
 from .forms import VPSCreationForm, VPSActionForm
 from .services.doprax_client import DopraxClient, DopraxAPIError
+from .services.catalog import DopraxCatalog, CatalogUnavailable, CACHE_KEY, LOCK_KEY
+from .services.provisioning import VPSProvisioningService, InsufficientBalanceError
+from .services.plan_sync import PlanSyncService
+from .services.availability import PlanAvailabilityService
+from .services import expiry
+from .services.expiry import ExpiryScheduler
 from wallet.models import Wallet, Transaction
+from billing.models import NotificationOutbox
+from grandvps.locks import DistributedLock
 
 
 class VPSPlanModelTest(TestCase):
@@ -167,6 +176,7 @@ class VPSCreationFormTest(TestCase):
     """Test cases for VPSCreationForm"""
 
     def setUp(self):
+        cache.clear()
         self.plan = VPSPlan.objects.create(
             name='Test Plan',
             cpu_cores=2,
@@ -175,8 +185,12 @@ class VPSCreationFormTest(TestCase):
             bandwidth_gb=1000,
             price_per_month=Decimal('10.00')
         )
+        PlanAvailability.objects.create(
+            plan=self.plan, location_code='us-east', provider_name='DigitalOcean',
+            machine_type_code='mt-2cpu-4gb', price_per_month=Decimal('10.00')
+        )
 
-    @patch('vps.forms.DopraxClient')
+    @patch('vps.services.catalog.DopraxClient')
     def test_form_initialization_success(self, mock_client):
         """Test form initialization with successful API calls"""
         mock_client_instance = MagicMock()
@@ -198,7 +212,12 @@ class VPSCreationFormTest(TestCase):
         self.assertEqual(len(form.fields['location'].choices), 1)
         self.assertEqual(len(form.fields['operating_system'].choices), 1)
 
-    @patch('vps.forms.DopraxClient')
+        # A second form is served from the catalog cache
+        VPSCreationForm()
+        self.assertEqual(mock_client_instance.get_locations_and_plans.call_count, 1)
+        self.assertEqual(mock_client_instance.get_operating_systems.call_count, 1)
+
+    @patch('vps.services.catalog.DopraxClient')
     def test_form_initialization_api_error(self, mock_client):
         """Test form initialization with API errors"""
         mock_client.side_effect = DopraxAPIError("API Error")
@@ -243,6 +262,22 @@ class VPSCreationFormTest(TestCase):
         self.assertFalse(form.is_valid())
         self.assertIn('plan', form.errors)
 
+    def test_form_plan_unavailable_in_location(self):
+        """Test a plan not offered in the chosen location is rejected"""
+        form = VPSCreationForm()
+        form.cleaned_data = {'plan': self.plan, 'location': 'eu-west'}
+        with self.assertRaises(ValidationError):
+            form.clean()
+
+        form.cleaned_data = {'plan': self.plan, 'location': 'us-east'}
+        self.assertEqual(form.clean()['offer'].machine_type_code, 'mt-2cpu-4gb')
+
+        # A withdrawn offer no longer counts
+        PlanAvailability.objects.update(is_active=False)
+        form.cleaned_data = {'plan': self.plan, 'location': 'us-east'}
+        with self.assertRaises(ValidationError):
+            form.clean()
+
 
 class VPSActionFormTest(TestCase):
     """Test cases for VPSActionForm"""
@@ -320,7 +355,17 @@ class DopraxClientTest(TestCase):
         with self.assertRaises(ImproperlyConfigured):
             DopraxClient()
 
-    @patch('vps.services.doprax_client.requests.get')
+    def test_clients_share_pooled_session(self):
+        """Test every client reuses one keep-alive session with retries on GET only"""
+        other = DopraxClient()
+        self.assertIs(self.client.session, other.session)
+
+        adapter = self.client.session.get_adapter('https://www.doprax.com/api/v1/vms/')
+        self.assertEqual(adapter.max_retries.allowed_methods, frozenset(['GET']))
+        self.assertIn(503, adapter.max_retries.status_forcelist)
+        self.assertEqual(self.client.timeout, (5, 30))
+
+    @patch('vps.services.doprax_client.requests.Session.get')
     def test_make_request_get_success(self, mock_get):
         """Test successful GET request"""
         mock_response = MagicMock()
@@ -331,7 +376,7 @@ class DopraxClientTest(TestCase):
         result = self.client._make_request('GET', '/test/')
         self.assertEqual(result, {'data': 'test'})
 
-    @patch('vps.services.doprax_client.requests.get')
+    @patch('vps.services.doprax_client.requests.Session.get')
     def test_make_request_get_error(self, mock_get):
         """Test GET request with API error"""
         mock_response = MagicMock()
@@ -341,7 +386,7 @@ class DopraxClientTest(TestCase):
         with self.assertRaises(DopraxAPIError):
             self.client._make_request('GET', '/test/')
 
-    @patch('vps.services.doprax_client.requests.post')
+    @patch('vps.services.doprax_client.requests.Session.post')
     def test_make_request_post_success(self, mock_post):
         """Test successful POST request"""
         mock_response = MagicMock()
@@ -352,7 +397,7 @@ class DopraxClientTest(TestCase):
         result = self.client._make_request('POST', '/test/', {'key': 'value'})
         self.assertEqual(result, {'data': 'created'})
 
-    @patch('vps.services.doprax_client.requests.get')
+    @patch('vps.services.doprax_client.requests.Session.get')
     def test_get_locations_and_plans(self, mock_get):
         """Test getting locations and plans"""
         mock_response = MagicMock()
@@ -363,7 +408,21 @@ class DopraxClientTest(TestCase):
         result = self.client.get_locations_and_plans()
         self.assertEqual(result, {'locationsList': []})
 
-    @patch('vps.services.doprax_client.requests.get')
+    @patch('vps.services.doprax_client.requests.Session.get')
+    def test_get_vps_list_follows_pagination(self, mock_get):
+        """Test the VM listing walks every page"""
+        first_page = MagicMock()
+        first_page.json.return_value = {'data': [{'vmCode': 'vm-1'}], 'hasNext': True}
+        last_page = MagicMock()
+        last_page.json.return_value = {'data': [{'vmCode': 'vm-2'}]}
+        mock_get.side_effect = [first_page, last_page]
+
+        result = self.client.get_vps_list()
+
+        self.assertEqual([vm['vmCode'] for vm in result], ['vm-1', 'vm-2'])
+        self.assertTrue(mock_get.call_args_list[1][0][0].endswith('/api/v1/vms/?page=2'))
+
+    @patch('vps.services.doprax_client.requests.Session.get')
     def test_get_operating_systems(self, mock_get):
         """Test getting operating systems"""
         mock_response = MagicMock()
@@ -374,7 +433,7 @@ class DopraxClientTest(TestCase):
         result = self.client.get_operating_systems()
         self.assertEqual(result, {'ubuntu': []})
 
-    @patch('vps.services.doprax_client.requests.post')
+    @patch('vps.services.doprax_client.requests.Session.post')
     def test_create_vps(self, mock_post):
         """Test VPS creation"""
         mock_response = MagicMock()
@@ -385,7 +444,7 @@ class DopraxClientTest(TestCase):
         result = self.client.create_vps('us-east', '2cpu-4gb', 'ubuntu', 'DO', 'test-vm')
         self.assertEqual(result, {'vmCode': 'vm-123'})
 
-    @patch('vps.services.doprax_client.requests.get')
+    @patch('vps.services.doprax_client.requests.Session.get')
     def test_get_vps_status(self, mock_get):
         """Test getting VPS status"""
         mock_response = MagicMock()
@@ -396,7 +455,7 @@ class DopraxClientTest(TestCase):
         result = self.client.get_vps_status('vm-123')
         self.assertEqual(result, {'status': 'active'})
 
-    @patch('vps.services.doprax_client.requests.post')
+    @patch('vps.services.doprax_client.requests.Session.post')
     def test_execute_vps_command_valid(self, mock_post):
         """Test executing valid VPS command"""
         mock_response = MagicMock()
@@ -412,7 +471,28 @@ class DopraxClientTest(TestCase):
         with self.assertRaises(ValueError):
             self.client.execute_vps_command('vm-123', 'invalid')
 
-    @patch('vps.services.doprax_client.requests.get')
+    @patch('vps.services.doprax_client.requests.Session.delete')
+    def test_delete_vps(self, mock_delete):
+        """Test deleting a VM, treating one that is already gone as deleted"""
+        import requests
+
+        mock_response = MagicMock()
+        mock_response.status_code = 200
+        mock_response.raise_for_status.return_value = None
+        mock_response.json.return_value = {}
+        mock_delete.return_value = mock_response
+        self.assertTrue(self.client.delete_vps('vm-123'))
+        self.assertTrue(mock_delete.call_args[0][0].endswith('/api/v1/vms/vm-123/'))
+
+        mock_response.status_code = 404
+        mock_response.raise_for_status.side_effect = requests.exceptions.HTTPError(response=mock_response)
+        self.assertTrue(self.client.delete_vps('vm-123'))
+
+        mock_response.status_code = 500
+        with self.assertRaises(DopraxAPIError):
+            self.client.delete_vps('vm-123')
+
+    @patch('vps.services.doprax_client.requests.Session.get')
     def test_get_vps_network_info(self, mock_get):
         """Test getting VPS network info"""
         mock_response = MagicMock()
@@ -423,7 +503,7 @@ class DopraxClientTest(TestCase):
         result = self.client.get_vps_network_info('vm-123')
         self.assertEqual(result, {'ip': '1.2.3.4'})
 
-    @patch('vps.services.doprax_client.requests.get')
+    @patch('vps.services.doprax_client.requests.Session.get')
     def test_get_vps_traffic(self, mock_get):
         """Test getting VPS traffic data"""
         mock_response = MagicMock()
@@ -434,7 +514,7 @@ class DopraxClientTest(TestCase):
         result = self.client.get_vps_traffic('vm-123')
         self.assertEqual(result, {'traffic': '100GB'})
 
-    @patch('vps.services.doprax_client.requests.post')
+    @patch('vps.services.doprax_client.requests.Session.post')
     def test_create_snapshot(self, mock_post):
         """Test creating VPS snapshot"""
         mock_response = MagicMock()
@@ -445,7 +525,7 @@ class DopraxClientTest(TestCase):
         result = self.client.create_snapshot('vm-123', 'backup')
         self.assertEqual(result, {'snapshot_id': 'snap-123'})
 
-    @patch('vps.services.doprax_client.requests.get')
+    @patch('vps.services.doprax_client.requests.Session.get')
     def test_list_snapshots(self, mock_get):
         """Test listing VPS snapshots"""
         mock_response = MagicMock()
@@ -456,7 +536,7 @@ class DopraxClientTest(TestCase):
         result = self.client.list_snapshots('vm-123')
         self.assertEqual(result, [{'id': 'snap-123'}])
 
-    @patch('vps.services.doprax_client.requests.post')
+    @patch('vps.services.doprax_client.requests.Session.post')
     def test_rebuild_vps(self, mock_post):
         """Test rebuilding VPS"""
         mock_response = MagicMock()
@@ -468,6 +548,47 @@ class DopraxClientTest(TestCase):
         self.assertEqual(result, {'status': 'rebuilding'})
 
 
+class DopraxCatalogTest(TestCase):
+    """Test cases for the cached Doprax catalog"""
+
+    def setUp(self):
+        cache.clear()
+
+    @patch('vps.services.catalog.DopraxClient')
+    def test_stale_entry_served_while_refresh_queued_once(self, mock_client):
+        """Test stale data is returned immediately and only one refresh is queued"""
+        cache.set(CACHE_KEY.format('operating_systems'), {'data': {'old': []}, 'fetched_at': 0}, None)
+
+        with patch('vps.tasks.refresh_doprax_catalog.delay') as mock_delay:
+            self.assertEqual(DopraxCatalog.operating_systems(), {'old': []})
+            self.assertEqual(DopraxCatalog.operating_systems(), {'old': []})
+
+        mock_delay.assert_called_once_with('operating_systems')
+        mock_client.assert_not_called()
+
+    @patch('vps.services.catalog.DopraxClient')
+    def test_cold_cache_does_not_call_api_while_refresh_in_flight(self, mock_client):
+        """Test a cold cache reports unavailable instead of stampeding the API"""
+        cache.add(LOCK_KEY.format('locations_and_plans'), 1, 60)
+
+        with self.assertRaises(CatalogUnavailable):
+            DopraxCatalog.locations_and_plans()
+        mock_client.assert_not_called()
+
+    def test_refresh_releases_lock_on_error(self):
+        """Test a failed refresh keeps the stale copy and frees the lock"""
+        cache.set(CACHE_KEY.format('operating_systems'), {'data': {'old': []}, 'fetched_at': 0}, None)
+        cache.add(LOCK_KEY.format('operating_systems'), 1, 60)
+        client = MagicMock()
+        client.get_operating_systems.side_effect = DopraxAPIError("API Error")
+
+        with self.assertRaises(DopraxAPIError):
+            DopraxCatalog.refresh('operating_systems', client=client)
+
+        self.assertIsNone(cache.get(LOCK_KEY.format('operating_systems')))
+        self.assertEqual(cache.get(CACHE_KEY.format('operating_systems'))['data'], {'old': []})
+
+
 class VPSViewsTest(TestCase):
     """Test cases for VPS views"""
 
@@ -490,6 +611,10 @@ class VPSViewsTest(TestCase):
             expires_at=timezone.now() + timedelta(days=30),
             ip_address='192.168.1.1'
         )
+        PlanAvailability.objects.create(
+            plan=self.plan, location_code='us-east', provider_name='DigitalOcean',
+            machine_type_code='mt-2cpu-4gb', price_per_month=Decimal('10.00')
+        )
         self.wallet = Wallet.objects.create(user=self.user, balance=Decimal('100.00'))
 
     def test_vps_dashboard_unauthenticated(self):
@@ -504,7 +629,7 @@ class VPSViewsTest(TestCase):
         self.assertEqual(response.status_code, 200)
         self.assertContains(response, 'test-instance-123')
 
-    @patch('vps.views.DopraxClient')
+    @patch('vps.services.provisioning.DopraxClient')
     def test_create_vps_success(self, mock_client):
         """Test successful VPS creation"""
         self.client.login(username='testuser', password='testpass')
@@ -514,6 +639,7 @@ class VPSViewsTest(TestCase):
             'locationsList': [{'locationCode': 'us-east', 'provider': 'DigitalOcean'}]
         }
         mock_client_instance.create_vps.return_value = {'vmCode': 'vm-123', 'ipv4': '1.2.3.4'}
+        mock_client_instance.get_vps_status.return_value = {'status': 'running', 'ipv4': '1.2.3.4'}
         mock_client.return_value = mock_client_instance
 
         data = {
@@ -522,12 +648,14 @@ class VPSViewsTest(TestCase):
             'operating_system': 'ubuntu-20-04',
             'vm_name': 'test-vm'
         }
-        response = self.client.post(reverse('vps:create_vps'), data)
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post(reverse('vps:create_vps'), data)
         self.assertEqual(response.status_code, 302)  # Redirect to dashboard
 
-        # Check VPS was created
+        # Check VPS was provisioned in the background
         vps = VPSInstance.objects.get(instance_id='vm-123')
-        self.assertEqual(vps.status, 'pending')
+        self.assertEqual(vps.status, 'active')
+        self.assertEqual(vps.provisioning_state, 'ready')
 
         # Check wallet was debited
         self.wallet.refresh_from_db()
@@ -548,7 +676,7 @@ class VPSViewsTest(TestCase):
         self.assertEqual(response.status_code, 200)  # Stay on form
         self.assertContains(response, 'Insufficient balance')
 
-    @patch('vps.views.DopraxClient')
+    @patch('vps.services.provisioning.DopraxClient')
     def test_create_vps_api_error(self, mock_client):
         """Test VPS creation with API error"""
         self.client.login(username='testuser', password='testpass')
@@ -562,9 +690,15 @@ class VPSViewsTest(TestCase):
             'location': 'us-east',
             'operating_system': 'ubuntu-20-04'
         }
-        response = self.client.post(reverse('vps:create_vps'), data)
-        self.assertEqual(response.status_code, 200)
-        self.assertContains(response, 'Failed to create VPS')
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post(reverse('vps:create_vps'), data)
+        self.assertEqual(response.status_code, 302)
+
+        # Provisioning failed in the background and the reservation was refunded
+        vps = VPSInstance.objects.get(user=self.user, provisioning_state='failed')
+        self.assertIn('Failed to create VPS', vps.provisioning_error)
+        self.wallet.refresh_from_db()
+        self.assertEqual(self.wallet.balance, Decimal('100.00'))
 
     def test_vps_detail_unauthenticated(self):
         """Test VPS detail requires authentication"""
@@ -700,6 +834,320 @@ class VPSViewsTest(TestCase):
         self.assertContains(response, 'test-instance-123')
 
 
+class VPSProvisioningTest(TestCase):
+    """Test cases for the asynchronous provisioning state machine"""
+
+    def setUp(self):
+        self.user = User.objects.create_user(username='provuser', password='testpass')
+        self.plan = VPSPlan.objects.create(
+            name='Test Plan',
+            cpu_cores=2,
+            ram_gb=4,
+            disk_gb=50,
+            bandwidth_gb=1000,
+            price_per_month=Decimal('10.00')
+        )
+        self.wallet = Wallet.objects.create(user=self.user, balance=Decimal('100.00'))
+
+        # The location price differs from the plan's listed price
+        self.offer = PlanAvailability.objects.create(
+            plan=self.plan, location_code='us-east', provider_name='DigitalOcean',
+            machine_type_code='mt-2cpu-4gb', price_per_month=Decimal('12.00')
+        )
+
+    def _reserve(self):
+        return VPSProvisioningService.reserve(self.user, self.offer, 'ubuntu-20-04', 'test-vm')
+
+    @patch('vps.tasks.provision_vps.delay')
+    def test_reserve_debits_and_queues_after_commit(self, mock_delay):
+        """Test reservation returns a queued instance and defers the API call to a task"""
+        with self.captureOnCommitCallbacks(execute=True):
+            instance = self._reserve()
+
+        self.assertEqual(instance.status, 'pending')
+        self.assertEqual(instance.provisioning_state, 'queued')
+        self.wallet.refresh_from_db()
+        self.assertEqual(self.wallet.balance, Decimal('88.00'))
+        mock_delay.assert_called_once_with(instance.pk, 'us-east', 'mt-2cpu-4gb', 'ubuntu-20-04', 'DigitalOcean', 'test-vm')
+
+    @patch('vps.tasks.provision_vps.delay')
+    def test_location_price_is_charged_for_the_life_of_the_instance(self, mock_delay):
+        """Test renewals, hourly billing and the dashboard use the price of the location bought"""
+        from billing.pricing import hourly_rate
+        from billing.services import BulkHourlyBillingService, BulkAutoRenewalService
+        from dashboard.models import DashboardSummary
+
+        eu_offer = PlanAvailability.objects.create(
+            plan=self.plan, location_code='eu-west', provider_name='Hetzner',
+            machine_type_code='mt-eu', price_per_month=Decimal('15.00')
+        )
+        instance = VPSProvisioningService.reserve(self.user, eu_offer, 'ubuntu-20-04', 'eu-vm')
+        self.assertEqual((instance.location_code, instance.price_per_month), ('eu-west', Decimal('15.00')))
+        # A later sync moves the plan's own price; the agreed price stays
+        self.plan.price_per_month = Decimal('12.00')
+        self.plan.save()
+        VPSInstance.objects.filter(pk=instance.pk).update(status='active', provisioning_state='ready')
+
+        self.assertEqual(DashboardSummary.rebuild(self.user.pk).monthly_cost, Decimal('15.00'))
+        charge = BulkHourlyBillingService.collect_charges()[self.user.pk]
+        self.assertEqual(charge['instances'][0]['hourly_cost'], hourly_rate(Decimal('15.00')))
+
+        VPSInstance.objects.filter(pk=instance.pk).update(expires_at=timezone.now() - timedelta(minutes=1))
+        BulkAutoRenewalService.process(instance_ids=[instance.pk])
+        self.wallet.refresh_from_db()
+        self.assertEqual(self.wallet.balance, Decimal('70.00'))
+
+    def test_reserve_insufficient_balance(self):
+        """Test reservation is refused without touching the wallet"""
+        self.wallet.balance = Decimal('5.00')
+        self.wallet.save()
+
+        with self.assertRaises(InsufficientBalanceError):
+            self._reserve()
+        self.assertFalse(VPSInstance.objects.filter(user=self.user).exists())
+
+    @patch('vps.tasks.provision_vps.delay')
+    def test_boot_success_settles_payment(self, mock_delay):
+        """Test a VM that comes up is activated and its payment completed"""
+        instance = self._reserve()
+        client = MagicMock()
+        client.create_vps.return_value = {'vmCode': 'vm-456'}
+        client.get_vps_status.side_effect = [{'status': 'pending'}, {'status': 'running', 'ipv4': '5.6.7.8'}]
+
+        VPSProvisioningService.create(instance.pk, 'us-east', 'mt-2cpu-4gb', 'ubuntu-20-04', 'DigitalOcean', 'test-vm', client=client)
+        self.assertFalse(VPSProvisioningService.check(instance.pk, 0, client=client))
+        self.assertTrue(VPSProvisioningService.check(instance.pk, 1, client=client))
+
+        instance.refresh_from_db()
+        self.assertEqual(instance.instance_id, 'vm-456')
+        self.assertEqual(instance.status, 'active')
+        self.assertEqual(instance.ip_address, '5.6.7.8')
+        payment = Transaction.objects.get(reference_id='vm-456', transaction_type='payment')
+        self.assertEqual(payment.status, 'completed')
+
+        # A redelivered create task does not submit a second VM
+        VPSProvisioningService.create(instance.pk, 'us-east', 'mt-2cpu-4gb', 'ubuntu-20-04', 'DigitalOcean', 'test-vm', client=client)
+        self.assertEqual(client.create_vps.call_count, 1)
+
+    @patch('vps.tasks.provision_vps.delay')
+    def test_boot_timeout_refunds(self, mock_delay):
+        """Test a VM that never boots is failed and refunded"""
+        instance = self._reserve()
+        client = MagicMock()
+        client.create_vps.return_value = {'vmCode': 'vm-789'}
+        client.get_vps_status.return_value = {'status': 'pending'}
+
+        VPSProvisioningService.create(instance.pk, 'us-east', 'mt-2cpu-4gb', 'ubuntu-20-04', 'DigitalOcean', 'test-vm', client=client)
+        with self.settings(VPS_PROVISIONING_MAX_POLLS=2):
+            self.assertTrue(VPSProvisioningService.check(instance.pk, 1, client=client))
+
+        client.delete_vps.assert_called_once_with('vm-789')
+        instance.refresh_from_db()
+        self.assertEqual(instance.provisioning_state, 'failed')
+        self.wallet.refresh_from_db()
+        self.assertEqual(self.wallet.balance, Decimal('100.00'))
+        self.assertTrue(Transaction.objects.filter(reference_id='vm-789', transaction_type='refund').exists())
+
+    @patch('vps.tasks.provision_vps.delay')
+    def test_failed_delete_defers_refund_to_cleanup(self, mock_delay):
+        """Test the refund waits until the failed VM is actually deleted"""
+        instance = self._reserve()
+        client = MagicMock()
+        client.create_vps.return_value = {'vmCode': 'vm-999'}
+        client.get_vps_status.return_value = {'status': 'error'}
+        client.delete_vps.side_effect = DopraxAPIError('API Error')
+
+        VPSProvisioningService.create(instance.pk, 'us-east', 'mt-2cpu-4gb', 'ubuntu-20-04', 'DigitalOcean', 'test-vm', client=client)
+        self.assertTrue(VPSProvisioningService.check(instance.pk, 0, client=client))
+
+        instance.refresh_from_db()
+        self.assertEqual(instance.provisioning_state, 'cleanup')
+        self.wallet.refresh_from_db()
+        self.assertEqual(self.wallet.balance, Decimal('88.00'))
+
+        client.delete_vps.side_effect = None
+        self.assertEqual(VPSProvisioningService.reap(client=client), {'cleanup': 1})
+
+        instance.refresh_from_db()
+        self.assertEqual(instance.provisioning_state, 'failed')
+        self.assertEqual(instance.status, 'terminated')
+        self.wallet.refresh_from_db()
+        self.assertEqual(self.wallet.balance, Decimal('100.00'))
+
+    @patch('vps.tasks.provision_vps.delay')
+    def test_unexpected_create_error_refunds(self, mock_delay):
+        """Test errors other than DopraxAPIError do not leave the purchase stuck"""
+        instance = self._reserve()
+        client = MagicMock()
+        client.create_vps.side_effect = KeyError('vmCode')
+
+        VPSProvisioningService.create(instance.pk, 'us-east', 'mt-2cpu-4gb', 'ubuntu-20-04', 'DigitalOcean', 'test-vm', client=client)
+
+        instance.refresh_from_db()
+        self.assertEqual(instance.provisioning_state, 'failed')
+        client.delete_vps.assert_not_called()
+        self.wallet.refresh_from_db()
+        self.assertEqual(self.wallet.balance, Decimal('100.00'))
+
+    @patch('vps.tasks.provision_vps.delay')
+    def test_reap_stale_queued_purchase(self, mock_delay):
+        """Test a purchase whose task never ran is refunded and cannot be submitted later"""
+        instance = self._reserve()
+        client = MagicMock()
+
+        # Not stale yet
+        self.assertEqual(VPSProvisioningService.reap(client=client), {})
+        later = timezone.now() + timedelta(seconds=VPSProvisioningService.stale_after() + 1)
+        self.assertEqual(VPSProvisioningService.reap(now=later, client=client), {'queued': 1})
+
+        instance.refresh_from_db()
+        self.assertEqual(instance.provisioning_state, 'failed')
+        self.wallet.refresh_from_db()
+        self.assertEqual(self.wallet.balance, Decimal('100.00'))
+
+        VPSProvisioningService.create(instance.pk, 'us-east', 'mt-2cpu-4gb', 'ubuntu-20-04', 'DigitalOcean', 'test-vm', client=client)
+        client.create_vps.assert_not_called()
+
+    @patch('vps.tasks.provision_vps.delay')
+    def test_reap_lost_boot_poll(self, mock_delay):
+        """Test a booting VM whose polling chain was lost gets a final check"""
+        instance = self._reserve()
+        client = MagicMock()
+        client.create_vps.return_value = {'vmCode': 'vm-321'}
+        client.get_vps_status.return_value = {'status': 'running', 'ipv4': '5.6.7.8'}
+        VPSProvisioningService.create(instance.pk, 'us-east', 'mt-2cpu-4gb', 'ubuntu-20-04', 'DigitalOcean', 'test-vm', client=client)
+
+        later = timezone.now() + timedelta(seconds=VPSProvisioningService.stale_after() + 1)
+        self.assertEqual(VPSProvisioningService.reap(now=later, client=client), {'booting': 1})
+        instance.refresh_from_db()
+        self.assertEqual(instance.status, 'active')
+        self.assertEqual(instance.provisioning_state, 'ready')
+
+
+class ExpirySchedulerTest(TestCase):
+    """Test cases for the expiry timer wheel"""
+
+    def setUp(self):
+        cache.clear()
+        self.addCleanup(cache.clear)
+        self.user = User.objects.create_user(username='expiryuser', email='expiry@example.com', password='testpass')
+        self.plan = VPSPlan.objects.create(
+            name='Test Plan',
+            cpu_cores=2,
+            ram_gb=4,
+            disk_gb=50,
+            bandwidth_gb=1000,
+            price_per_month=Decimal('10.00')
+        )
+        self.wallet = Wallet.objects.create(user=self.user, balance=Decimal('100.00'))
+
+    def _create(self, expires_at, status='active'):
+        with self.captureOnCommitCallbacks(execute=True):
+            return VPSInstance.objects.create(
+                user=self.user,
+                plan=self.plan,
+                instance_id=f'vm-{VPSInstance.objects.count()}',
+                status=status,
+                expires_at=expires_at
+            )
+
+    def _score(self, member):
+        return expiry.get_backend().score(member)
+
+    def test_save_schedules_expiry_and_warning_timers(self):
+        expires_at = timezone.now() + timedelta(days=10)
+        instance = self._create(expires_at)
+
+        self.assertEqual(self._score(f'expire:{instance.pk}'), expires_at.timestamp())
+        self.assertEqual(self._score(f'warn:7:{instance.pk}'), (expires_at - timedelta(days=7)).timestamp())
+        self.assertEqual(self._score(f'warn:1:{instance.pk}'), (expires_at - timedelta(days=1)).timestamp())
+
+    def test_renew_reschedules_timers(self):
+        instance = self._create(timezone.now() + timedelta(days=3))
+        self.assertIsNone(self._score(f'warn:7:{instance.pk}'))
+
+        with self.captureOnCommitCallbacks(execute=True):
+            instance.renew(days=30)
+
+        self.assertEqual(self._score(f'expire:{instance.pk}'), instance.expires_at.timestamp())
+        self.assertIsNotNone(self._score(f'warn:7:{instance.pk}'))
+
+    def test_suspending_cancels_timers(self):
+        instance = self._create(timezone.now() + timedelta(days=10))
+
+        with self.captureOnCommitCallbacks(execute=True):
+            instance.status = 'suspended'
+            instance.save(update_fields=['status'])
+
+        self.assertIsNone(self._score(f'expire:{instance.pk}'))
+        self.assertIsNone(self._score(f'warn:1:{instance.pk}'))
+
+    def test_process_due_renews_only_timed_out_instances(self):
+        instance = self._create(timezone.now() - timedelta(minutes=1))
+        untimed = self._create(timezone.now() - timedelta(minutes=1))
+        expiry.get_backend().remove([f'expire:{untimed.pk}'])
+
+        with self.captureOnCommitCallbacks(execute=True):
+            fired = ExpiryScheduler.process_due()
+
+        self.assertEqual(fired['renewals'], 1)
+        instance.refresh_from_db()
+        untimed.refresh_from_db()
+        self.assertGreater(instance.expires_at, timezone.now() + timedelta(days=29))
+        self.assertLess(untimed.expires_at, timezone.now())
+        # The renewed instance is already waiting on its next expiry
+        self.assertEqual(self._score(f'expire:{instance.pk}'), instance.expires_at.timestamp())
+        self.wallet.refresh_from_db()
+        self.assertEqual(self.wallet.balance, Decimal('90.00'))
+
+    @override_settings(NOTIFICATION_DIGEST_WINDOW=None)
+    def test_process_due_sends_warning(self):
+        expires_at = timezone.now() + timedelta(days=10)
+        instance = self._create(expires_at)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            fired = ExpiryScheduler.process_due(now=expires_at - timedelta(days=7) + timedelta(minutes=1))
+
+        self.assertEqual(fired, {'renewals': 0, 'warnings': 1})
+        email = NotificationOutbox.objects.get(user=self.user)
+        self.assertEqual(email.subject, 'GrandVPS - VPS Expiring Soon')
+        self.assertIn(instance.instance_id, email.body)
+        self.assertIsNone(self._score(f'warn:7:{instance.pk}'))
+        self.assertIsNotNone(self._score(f'warn:1:{instance.pk}'))
+
+    @override_settings(NOTIFICATION_DIGEST_WINDOW=None)
+    def test_process_due_handles_every_warning_of_an_instance(self):
+        expires_at = timezone.now() + timedelta(days=10)
+        instance = self._create(expires_at)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            fired = ExpiryScheduler.process_due(now=expires_at - timedelta(hours=12))
+
+        self.assertEqual(fired, {'renewals': 0, 'warnings': 2})
+        self.assertEqual(NotificationOutbox.objects.filter(user=self.user).count(), 1)
+        self.assertIsNone(self._score(f'warn:7:{instance.pk}'))
+        self.assertIsNone(self._score(f'warn:1:{instance.pk}'))
+
+    def test_process_due_restores_timers_when_handling_fails(self):
+        expires_at = timezone.now() + timedelta(days=10)
+        instance = self._create(expires_at)
+        now = expires_at - timedelta(days=7) + timedelta(minutes=1)
+
+        with patch.object(ExpiryScheduler, 'send_warnings', side_effect=RuntimeError('smtp down')):
+            with self.assertRaises(RuntimeError):
+                ExpiryScheduler.process_due(now=now)
+
+        self.assertEqual(self._score(f'warn:7:{instance.pk}'), now.timestamp())
+
+    def test_rebuild_schedules_active_instances(self):
+        instance = self._create(timezone.now() + timedelta(days=10))
+        self._create(timezone.now() + timedelta(days=10), status='stopped')
+        cache.clear()
+
+        self.assertEqual(ExpiryScheduler.rebuild(), 1)
+        self.assertEqual(self._score(f'expire:{instance.pk}'), instance.expires_at.timestamp())
+
+
 class ManagementCommandsTest(TestCase):
     """Test cases for management commands"""
 
@@ -752,6 +1200,129 @@ class ManagementCommandsTest(TestCase):
         # No plans should be created
         self.assertEqual(VPSPlan.objects.count(), 0)
 
+    def _catalog(self, *machines_per_location):
+        return {
+            'locationsList': [
+                {'locationCode': f'loc-{n}', 'provider': f'Provider {n}'} for n in range(len(machines_per_location))
+            ],
+            'locationMachineTypeMapping': {
+                f'loc-{n}': machines for n, machines in enumerate(machines_per_location)
+            }
+        }
+
+    def test_sync_plans_bulk_upsert(self):
+        """Test plans are upserted in bulk, deduplicated by name and vanished ones deactivated"""
+        from django.test.utils import CaptureQueriesContext
+        from django.db import connection
+
+        VPSPlan.objects.create(
+            name='1CPU-1GB', cpu_cores=1, ram_gb=1, disk_gb=25, bandwidth_gb=500, price_per_month=Decimal('5.00')
+        )
+        retired = VPSPlan.objects.create(
+            name='Retired', cpu_cores=1, ram_gb=1, disk_gb=10, bandwidth_gb=100, price_per_month=Decimal('3.00')
+        )
+        PlanAvailability.objects.create(
+            plan=retired, location_code='loc-0', machine_type_code='mt-retired', price_per_month=Decimal('3.00')
+        )
+        small = {
+            'name': '1CPU-1GB', 'machineCode': 'mt-small', 'cpu': 1, 'ramGb': 1, 'ssdGb': 25,
+            'monthlyTrafficGb': 500, 'monthlyPriceUsd': 6.0
+        }
+        large = {
+            'name': '2CPU-4GB', 'machineCode': 'mt-large', 'cpu': 2, 'ramGb': 4, 'ssdGb': 50,
+            'monthlyTrafficGb': 1000, 'monthlyPriceUsd': 10.0
+        }
+        client = MagicMock()
+        client.get_locations_and_plans.return_value = self._catalog([small, large], [{**large, 'monthlyPriceUsd': 12.0}])
+
+        with CaptureQueriesContext(connection) as queries:
+            result = PlanSyncService.sync(client)
+
+        self.assertEqual(result['processed'], 3)
+        self.assertEqual(result['created'], ['2CPU-4GB'])
+        self.assertEqual(result['updated'], ['1CPU-1GB'])
+        self.assertEqual(result['deactivated'], ['Retired'])
+        self.assertEqual(result['offers_changed'], 3)
+        self.assertEqual(result['offers_withdrawn'], 1)
+        # Plan upsert, plan deactivation, offer upsert and offer withdrawal
+        writes = [q['sql'] for q in queries.captured_queries if not q['sql'].startswith(('SELECT', 'SAVEPOINT', 'RELEASE'))]
+        self.assertEqual(len(writes), 4)
+        self.assertEqual(VPSPlan.objects.get(name='1CPU-1GB').price_per_month, Decimal('6.00'))
+        self.assertEqual(VPSPlan.objects.filter(name='2CPU-4GB').count(), 1)
+        self.assertFalse(VPSPlan.objects.get(name='Retired').is_active)
+
+        # Every location keeps its own machine type code and price
+        large_plan = VPSPlan.objects.get(name='2CPU-4GB')
+        offer = PlanAvailabilityService.offer(large_plan, 'loc-1')
+        self.assertEqual(offer.machine_type_code, 'mt-large')
+        self.assertEqual(offer.provider_name, 'Provider 1')
+        self.assertEqual(offer.price_per_month, Decimal('12.00'))
+        self.assertEqual(PlanAvailabilityService.offer(large_plan, 'loc-0').price_per_month, Decimal('10.00'))
+        self.assertIsNone(PlanAvailabilityService.offer(retired, 'loc-0'))
+        annotated = PlanAvailabilityService.plans().get(pk=large_plan.pk)
+        self.assertEqual(annotated.location_count, 2)
+        self.assertEqual(annotated.lowest_location_price, Decimal('10.00'))
+
+        # An unchanged listing writes nothing
+        with CaptureQueriesContext(connection) as queries:
+            result = PlanSyncService.sync(client)
+        self.assertEqual(result['offers_changed'], 0)
+        writes = [q['sql'] for q in queries.captured_queries if not q['sql'].startswith(('SELECT', 'SAVEPOINT', 'RELEASE'))]
+        self.assertEqual(writes, [])
+
+    def test_sync_plans_refreshes_monthly_cost_of_repriced_plans(self):
+        """Test dashboard summaries follow a plan price change written by the sync"""
+        from dashboard.models import DashboardSummary
+
+        user = User.objects.create_user(username='pricedsync', password='testpass')
+        plan = VPSPlan.objects.create(
+            name='1CPU-1GB', cpu_cores=1, ram_gb=1, disk_gb=25, bandwidth_gb=500, price_per_month=Decimal('5.00')
+        )
+        VPSInstance.objects.create(
+            user=user, plan=plan, instance_id='vm-priced', status='active',
+            expires_at=timezone.now() + timedelta(days=30)
+        )
+        self.assertEqual(DashboardSummary.for_user(user).monthly_cost, Decimal('5.00'))
+        client = MagicMock()
+        client.get_locations_and_plans.return_value = self._catalog([{
+            'name': '1CPU-1GB', 'machineCode': 'mt-small', 'cpu': 1, 'ramGb': 1, 'ssdGb': 25,
+            'monthlyTrafficGb': 500, 'monthlyPriceUsd': 6.0
+        }])
+
+        PlanSyncService.sync(client)
+
+        self.assertEqual(DashboardSummary.for_user(user).monthly_cost, Decimal('6.00'))
+
+    def test_sync_plans_dry_run_reports_diff(self):
+        """Test dry run reports what would change without writing"""
+        VPSPlan.objects.create(
+            name='Retired', cpu_cores=1, ram_gb=1, disk_gb=10, bandwidth_gb=100, price_per_month=Decimal('3.00')
+        )
+        client = MagicMock()
+        client.get_locations_and_plans.return_value = self._catalog([
+            {'name': '2CPU-4GB', 'cpu': 2, 'ramGb': 4, 'ssdGb': 50, 'monthlyTrafficGb': 1000, 'monthlyPriceUsd': 10.0}
+        ])
+
+        result = PlanSyncService.sync(client, dry_run=True)
+
+        self.assertEqual(result['created'], ['2CPU-4GB'])
+        self.assertEqual(result['deactivated'], ['Retired'])
+        self.assertFalse(VPSPlan.objects.filter(name='2CPU-4GB').exists())
+        self.assertTrue(VPSPlan.objects.get(name='Retired').is_active)
+
+    def test_sync_plans_keeps_plans_on_empty_catalog(self):
+        """Test an empty listing does not deactivate every plan"""
+        VPSPlan.objects.create(
+            name='Existing', cpu_cores=1, ram_gb=1, disk_gb=10, bandwidth_gb=100, price_per_month=Decimal('3.00')
+        )
+        client = MagicMock()
+        client.get_locations_and_plans.return_value = self._catalog()
+
+        result = PlanSyncService.sync(client)
+
+        self.assertEqual(result['deactivated'], [])
+        self.assertTrue(VPSPlan.objects.get(name='Existing').is_active)
+
     @patch('vps.management.commands.update_vps_statuses.DopraxClient')
     def test_update_vps_statuses_command(self, mock_client):
         """Test update_vps_statuses management command"""
@@ -779,12 +1350,121 @@ class ManagementCommandsTest(TestCase):
         }
         mock_client.return_value = mock_client_instance
 
+        # Rows owned by provisioning, and terminated ones, are not polled
+        VPSInstance.objects.create(
+            user=user, plan=plan, instance_id='pending-abc123', status='pending',
+            provisioning_state='queued', expires_at=timezone.now() + timedelta(days=30)
+        )
+        VPSInstance.objects.create(
+            user=user, plan=plan, instance_id='failed-vm', status='terminated',
+            provisioning_state='failed', expires_at=timezone.now() + timedelta(days=30)
+        )
+        VPSInstance.objects.create(
+            user=user, plan=plan, instance_id='old-vm', status='terminated',
+            expires_at=timezone.now() - timedelta(days=30)
+        )
+
         call_command('update_vps_statuses')
 
         # Check status was updated
         vps.refresh_from_db()
         self.assertEqual(vps.status, 'active')
         self.assertEqual(vps.ip_address, '1.2.3.4')
+        mock_client_instance.get_vps_status.assert_called_once_with('test-vm-123')
+        self.assertEqual(VPSInstance.objects.get(instance_id='failed-vm').status, 'terminated')
+
+    @patch('vps.management.commands.update_vps_statuses.DopraxClient')
+    def test_update_vps_statuses_concurrent_bulk_update(self, mock_client):
+        """Test statuses are polled concurrently and written with one UPDATE"""
+        from django.db import connection
+        from django.test.utils import CaptureQueriesContext
+
+        user = User.objects.create_user(username='testuser', password='testpass')
+        plan = VPSPlan.objects.create(
+            name='Test Plan',
+            cpu_cores=2,
+            ram_gb=4,
+            disk_gb=50,
+            bandwidth_gb=1000,
+            price_per_month=Decimal('10.00')
+        )
+        for i in range(5):
+            VPSInstance.objects.create(
+                user=user,
+                plan=plan,
+                instance_id=f'test-vm-{i}',
+                status='pending',
+                expires_at=timezone.now() + timedelta(days=30)
+            )
+
+        statuses = {
+            'test-vm-0': {'status': 'running', 'ipv4': '10.0.0.1'},
+            'test-vm-1': {'status': 'stopped'},
+            'test-vm-2': {'status': 'pending'},
+            'test-vm-3': {'status': 'running', 'ipv4': '10.0.0.4'},
+        }
+
+        def get_vps_status(vm_code):
+            if vm_code not in statuses:
+                raise DopraxAPIError('Not found')
+            return statuses[vm_code]
+
+        mock_client_instance = MagicMock()
+        mock_client_instance.get_vps_status.side_effect = get_vps_status
+        mock_client.return_value = mock_client_instance
+
+        from io import StringIO
+        out = StringIO()
+        with CaptureQueriesContext(connection) as queries:
+            call_command('update_vps_statuses', '--concurrency', '4', '--rate-limit', '0', stdout=out)
+
+        updates = [query for query in queries if query['sql'].startswith('UPDATE "vps_vpsinstance"')]
+        self.assertEqual(len(updates), 1)
+        self.assertIn('Updated: 3, Errors: 1', out.getvalue())
+        self.assertEqual(mock_client_instance.get_vps_status.call_count, 5)
+
+        self.assertEqual(VPSInstance.objects.get(instance_id='test-vm-0').status, 'active')
+        self.assertEqual(VPSInstance.objects.get(instance_id='test-vm-1').status, 'stopped')
+        self.assertEqual(VPSInstance.objects.get(instance_id='test-vm-3').ip_address, '10.0.0.4')
+        self.assertEqual(VPSInstance.objects.get(instance_id='test-vm-4').status, 'pending')
+
+    @patch('vps.management.commands.update_vps_statuses.DopraxClient')
+    def test_update_vps_statuses_reconcile(self, mock_client):
+        """Test reconcile mode uses the VM listing and only polls missing instances"""
+        user = User.objects.create_user(username='testuser', password='testpass')
+        plan = VPSPlan.objects.create(
+            name='Test Plan',
+            cpu_cores=2,
+            ram_gb=4,
+            disk_gb=50,
+            bandwidth_gb=1000,
+            price_per_month=Decimal('10.00')
+        )
+        for instance_id in ['listed-vm', 'unlisted-vm']:
+            VPSInstance.objects.create(
+                user=user,
+                plan=plan,
+                instance_id=instance_id,
+                status='pending',
+                expires_at=timezone.now() + timedelta(days=30)
+            )
+
+        mock_client_instance = MagicMock()
+        mock_client_instance.get_vps_list.return_value = [
+            {'vmCode': 'listed-vm', 'status': 'running', 'ipv4': '1.2.3.4'},
+            {'vmCode': 'someone-elses-vm', 'status': 'running'},
+        ]
+        mock_client_instance.get_vps_status.return_value = {'status': 'stopped'}
+        mock_client.return_value = mock_client_instance
+
+        call_command('update_vps_statuses', '--reconcile', '--rate-limit', '0')
+
+        mock_client_instance.get_vps_list.assert_called_once()
+        mock_client_instance.get_vps_status.assert_called_once_with('unlisted-vm')
+        listed = VPSInstance.objects.get(instance_id='listed-vm')
+        self.assertEqual(listed.status, 'active')
+        self.assertEqual(listed.ip_address, '1.2.3.4')
+        self.assertEqual(VPSInstance.objects.get(instance_id='unlisted-vm').status, 'stopped')
 
     @patch('vps.management.commands.update_vps_statuses.DopraxClient')
     def test_update_vps_statuses_dry_run(self, mock_client):
@@ -849,3 +1529,47 @@ class ManagementCommandsTest(TestCase):
         # Status should remain unchanged
         vps = VPSInstance.objects.get(instance_id='test-vm-123')
         self.assertEqual(vps.status, 'pending')
+
+    @patch('vps.services.status_sync.DopraxClient')
+    def test_update_vps_statuses_task(self, mock_client):
+        """Test the scheduled status sync task applies changes and reports counts"""
+        from .tasks import update_vps_statuses
+        cache.clear()
+        user = User.objects.create_user(username='testuser', password='testpass')
+        plan = VPSPlan.objects.create(
+            name='Test Plan',
+            cpu_cores=2,
+            ram_gb=4,
+            disk_gb=50,
+            bandwidth_gb=1000,
+            price_per_month=Decimal('10.00')
+        )
+        VPSInstance.objects.create(
+            user=user,
+            plan=plan,
+            instance_id='listed-vm',
+            status='pending',
+            expires_at=timezone.now() + timedelta(days=30)
+        )
+
+        mock_client_instance = MagicMock()
+        mock_client_instance.get_vps_list.return_value = [
+            {'vmCode': 'listed-vm', 'status': 'running', 'ipv4': '1.2.3.4'},
+        ]
+        mock_client.return_value = mock_client_instance
+
+        self.assertEqual(update_vps_statuses(), {'updated': 1, 'errors': 0})
+        self.assertEqual(VPSInstance.objects.get(instance_id='listed-vm').status, 'active')
+
+    @patch('vps.services.plan_sync.DopraxClient')
+    def test_sync_plans_task_skips_overlapping_run(self, mock_client):
+        """Test the scheduled plan sync does nothing while another run holds its lock"""
+        from .tasks import sync_plans
+        cache.clear()
+        self.addCleanup(cache.clear)
+        other_run = DistributedLock(PlanSyncService.LOCK_NAME, ttl=60)
+        self.assertTrue(other_run.acquire())
+        self.addCleanup(other_run.release)
+
+        self.assertIsNone(sync_plans())
+        mock_client.assert_not_called()
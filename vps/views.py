@@ -4,14 +4,15 @@ from django.contrib import messages
 from django.urls import reverse
 from django.http import JsonResponse
 from django.views.decorators.http import require_POST
-from django.utils import timezone
-from datetime import timedelta
 from decimal import Decimal
 
-from .models import VPSPlan, VPSInstance
+from .models import VPSInstance
 from .forms import VPSCreationForm, VPSActionForm
 from .services.doprax_client import DopraxClient, DopraxAPIError
-from wallet.models import Wallet, Transaction
+from .services.availability import PlanAvailabilityService
+from .services.provisioning import VPSProvisioningService, InsufficientBalanceError
+from dashboard.models import DashboardSummary
+from grandvps.ratelimit import rate_limit
 import logging
 
 logger = logging.getLogger(__name__)
@@ -20,31 +21,22 @@ logger = logging.getLogger(__name__)
 @login_required
 def vps_dashboard(request):
     """Main VPS dashboard showing user's VPS instances"""
-    vps_instances = VPSInstance.objects.filter(user=request.user).order_by('-created_at')
-
-    # Calculate monthly cost
-    monthly_cost = 0
-    for vps in vps_instances.filter(status__in=['active', 'pending']):
-        monthly_cost += vps.plan.price_per_month
-
-    # Count expiring soon (next 7 days)
-    expiring_soon_count = vps_instances.filter(
-        expires_at__lte=timezone.now() + timedelta(days=7),
-        expires_at__gte=timezone.now(),
-        status='active'
-    ).count()
+    vps_instances = VPSInstance.objects.filter(user=request.user).select_related('plan').order_by('-created_at')
+    summary = DashboardSummary.for_user(request.user)
 
     context = {
         'vps_instances': vps_instances,
-        'total_vps': vps_instances.count(),
-        'active_vps': vps_instances.filter(status='active').count(),
-        'monthly_cost': monthly_cost,
-        'expiring_soon_count': expiring_soon_count,
+        'total_vps': summary.total_vps_count,
+        'active_vps': summary.active_vps_count,
+        'monthly_cost': summary.monthly_cost,
+        'expiring_soon_count': summary.upcoming_expirations(),
     }
     return render(request, 'vps/dashboard.html', context)
 
 
 @login_required
+@rate_limit('vps_create', limit=5, window=600, methods=['POST'])
+@rate_limit('vps_create', limit=20, window=600, key='ip', methods=['POST'])
 def create_vps(request):
     """VPS creation form and processing"""
     if request.method == 'POST':
@@ -52,67 +44,28 @@ def create_vps(request):
         if form.is_valid():
             try:
                 # Get form data
-                plan = form.cleaned_data['plan']
-                location = form.cleaned_data['location']
+                offer = form.cleaned_data['offer']
                 os_slug = form.cleaned_data['operating_system']
                 vm_name = form.cleaned_data['vm_name']
 
-                # Check wallet balance
-                wallet = Wallet.objects.get(user=request.user)
-                if wallet.balance < plan.price_per_month:
-                    messages.error(request, f'Insufficient balance. Required: ${plan.price_per_month}, Available: ${wallet.balance}')
-                    return redirect('vps:create_vps')
-
-                # Get location details for provider info
-                client = DopraxClient()
-                locations_data = client.get_locations_and_plans()
-                location_info = next(
-                    (loc for loc in locations_data.get('locationsList', []) if loc['locationCode'] == location),
-                    {}
-                )
-                provider_name = location_info.get('provider', 'Unknown')
-
-                # Get machine code from plan (this is a simplification - in real implementation,
-                # you'd need to map plan to machine code properly)
-                machine_code = f"{plan.cpu_cores}cpu-{plan.ram_gb}gb-{plan.disk_gb}gb"
-
-                # Create VPS via API
-                vps_data = client.create_vps(
-                    location_code=location,
-                    machine_type_code=machine_code,
+                # Reserve the location's price and queue provisioning; the VM is created in the background
+                vps_instance = VPSProvisioningService.reserve(
+                    user=request.user,
+                    offer=offer,
                     os_slug=os_slug,
-                    provider_name=provider_name,
                     vm_name=vm_name
                 )
 
-                # Calculate expiration (30 days from now)
-                expires_at = timezone.now() + timedelta(days=30)
-
-                # Create VPS instance in database
-                vps_instance = VPSInstance.objects.create(
-                    user=request.user,
-                    plan=plan,
-                    instance_id=vps_data.get('vmCode', f'vps-{vm_name}'),
-                    status='pending',
-                    expires_at=expires_at,
-                    ip_address=vps_data.get('ipv4')
-                )
-
-                # Deduct from wallet and create transaction
-                wallet.balance -= plan.price_per_month
-                wallet.save()
-
-                Transaction.objects.create(
-                    wallet=wallet,
-                    amount=-plan.price_per_month,
-                    transaction_type='vps_purchase',
-                    description=f'VPS Creation: {plan.name}',
-                    reference_id=vps_instance.instance_id
+                messages.success(
+                    request,
+                    f'VPS "{vm_name}" is being provisioned at ${offer.price_per_month}/month. '
+                    f'Instance ID: {vps_instance.instance_id}'
                 )
-
-                messages.success(request, f'VPS "{vm_name}" created successfully! Instance ID: {vps_instance.instance_id}')
                 return redirect('vps:dashboard')
 
+            except InsufficientBalanceError as e:
+                messages.error(request, str(e))
+                return redirect('vps:create_vps')
             except DopraxAPIError as e:
                 logger.error(f'VPS creation API error: {str(e)}')
                 messages.error(request, f'Failed to create VPS: {str(e)}')
@@ -124,7 +77,7 @@ def create_vps(request):
 
     context = {
         'form': form,
-        'plans': VPSPlan.objects.filter(is_active=True),
+        'plans': PlanAvailabilityService.plans(),
     }
     return render(request, 'vps/create.html', context)
 
@@ -143,6 +96,7 @@ def vps_detail(request, instance_id):
 
 @login_required
 @require_POST
+@rate_limit('vps_action', limit=20, window=60)
 def vps_action(request, instance_id):
     """Handle VPS actions (start, stop, restart)"""
     vps = get_object_or_404(VPSInstance, instance_id=instance_id, user=request.user)
@@ -189,7 +143,7 @@ def vps_action(request, instance_id):
 @login_required
 def vps_plans(request):
     """Display available VPS plans"""
-    plans = VPSPlan.objects.filter(is_active=True).order_by('price_per_month')
+    plans = PlanAvailabilityService.plans().order_by('lowest_location_price')
     context = {
         'plans': plans,
     }
@@ -198,6 +152,7 @@ def vps_plans(request):
 
 @login_required
 @require_POST
+@rate_limit('vps_action', limit=20, window=60)
 def start_vps(request, instance_id):
     """Start a VPS instance via AJAX"""
     vps = get_object_or_404(VPSInstance, instance_id=instance_id, user=request.user)
@@ -226,6 +181,7 @@ def start_vps(request, instance_id):
 
 @login_required
 @require_POST
+@rate_limit('vps_action', limit=20, window=60)
 def stop_vps(request, instance_id):
     """Stop a VPS instance via AJAX"""
     vps = get_object_or_404(VPSInstance, instance_id=instance_id, user=request.user)
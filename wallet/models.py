@@ -1,9 +1,18 @@
-from django.db import models
+from decimal import Decimal
+from django.db import models, transaction as db_transaction
+from django.db.models import F
 from django.contrib.auth.models import User
 from django.core.exceptions import ValidationError
+from .signals import balances_changed
 
 # Create your models here.
 
+
+class InsufficientBalance(ValidationError):
+    """Raised when a debit would take a wallet below zero"""
+    pass
+
+
 class Wallet(models.Model):
     user = models.OneToOneField(User, on_delete=models.CASCADE)
     balance = models.DecimalField(max_digits=10, decimal_places=2, default=0.00)
@@ -12,35 +21,62 @@ class Wallet(models.Model):
     def __str__(self):
         return f"{self.user.username}'s Wallet"
 
-    def deposit(self, amount, description=''):
-        """Deposit amount to wallet balance"""
+    @staticmethod
+    def _validated_amount(amount, message):
+        amount = Decimal(str(amount))
         if amount <= 0:
-            raise ValidationError("Deposit amount must be positive")
-        self.balance += amount
-        self.save()
-        Transaction.objects.create(
-            wallet=self,
+            raise ValidationError(message)
+        return amount
+
+    @classmethod
+    def credit(cls, wallet_id, amount, transaction_type='deposit', description='', status='completed', reference_id=None):
+        """Atomically add to a wallet and record the ledger row.
+
+        Runs a single UPDATE balance = balance + amount, so concurrent
+        credits never lose updates and no row lock is held beyond the
+        statement. Returns (new_balance, transaction).
+        """
+        amount = cls._validated_amount(amount, "Deposit amount must be positive")
+        with db_transaction.atomic():
+            cls.objects.filter(pk=wallet_id).update(balance=F('balance') + amount)
+            return cls._record(wallet_id, amount, transaction_type, description, status, reference_id)
+
+    @classmethod
+    def debit(cls, wallet_id, amount, transaction_type='withdraw', description='', status='completed', reference_id=None):
+        """Atomically take from a wallet if it can cover the amount.
+
+        Runs UPDATE balance = balance - amount WHERE balance >= amount and
+        raises InsufficientBalance when no row matched, so the balance can
+        never go negative. Returns (new_balance, transaction).
+        """
+        amount = cls._validated_amount(amount, "Withdrawal amount must be positive")
+        with db_transaction.atomic():
+            updated = cls.objects.filter(pk=wallet_id, balance__gte=amount).update(balance=F('balance') - amount)
+            if not updated:
+                raise InsufficientBalance("Insufficient balance")
+            return cls._record(wallet_id, amount, transaction_type, description, status, reference_id)
+
+    @classmethod
+    def _record(cls, wallet_id, amount, transaction_type, description, status, reference_id):
+        balance = cls.objects.filter(pk=wallet_id).values_list('balance', flat=True).get()
+        ledger = Transaction.objects.create(
+            wallet_id=wallet_id,
             amount=amount,
-            transaction_type='deposit',
+            transaction_type=transaction_type,
             description=description,
-            status='completed'
+            status=status,
+            reference_id=reference_id
         )
+        balances_changed.send(sender=cls, wallet_ids=[wallet_id])
+        return balance, ledger
+
+    def deposit(self, amount, description=''):
+        """Deposit amount to wallet balance"""
+        self.balance, _ = Wallet.credit(self.pk, amount, description=description)
 
     def withdraw(self, amount, description=''):
         """Withdraw amount from wallet balance"""
-        if amount <= 0:
-            raise ValidationError("Withdrawal amount must be positive")
-        if self.balance < amount:
-            raise ValidationError("Insufficient balance")
-        self.balance -= amount
-        self.save()
-        Transaction.objects.create(
-            wallet=self,
-            amount=amount,
-            transaction_type='withdraw',
-            description=description,
-            status='completed'
-        )
+        self.balance, _ = Wallet.debit(self.pk, amount, description=description)
 
     def get_transaction_history(self):
         """Get all transactions for this wallet"""
@@ -69,6 +105,14 @@ class Transaction(models.Model):
     status = models.CharField(max_length=10, choices=STATUS_CHOICES, default='pending')
     reference_id = models.CharField(max_length=100, blank=True, null=True)  # For payment gateway reference
 
+    class Meta:
+        indexes = [
+            # Transaction history per wallet; -id matches the keyset pagination tie-breaker
+            models.Index(fields=['wallet', '-timestamp', '-id'], name='wallet_txn_recent_idx'),
+            # Payment callbacks and provisioning look ledger rows up by reference
+            models.Index(fields=['reference_id'], name='wallet_txn_reference_idx'),
+        ]
+
     def __str__(self):
         return f"{self.transaction_type} - {self.amount} ({self.status})"
 
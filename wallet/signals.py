@@ -0,0 +1,5 @@
+from django.dispatch import Signal
+
+# Sent with wallet_ids=[...] after balances change through queryset updates,
+# which bypass post_save
+balances_changed = Signal()
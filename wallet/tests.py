@@ -1,12 +1,14 @@
-from django.test import TestCase, Client
+from django.test import TestCase, Client, override_settings
+from django.core.cache import cache
 from django.contrib.auth.models import User
 from django.core.exceptions import ValidationError
 from django.urls import reverse
+from django.utils import timezone
 from django.http import JsonResponse
 from decimal import Decimal
 from unittest.mock import patch, MagicMock
 import json
-from .models import Wallet, Transaction
+from .models import Wallet, Transaction, InsufficientBalance
 from .forms import DepositForm, WithdrawalForm
 from .payment_gateway import ZarinpalPaymentGateway
 
@@ -61,6 +63,28 @@ class WalletModelTest(TestCase):
         with self.assertRaises(ValidationError):
             self.wallet.withdraw(200.00)
 
+    def test_debit_returns_new_balance_and_ledger_row(self):
+        balance, ledger = Wallet.debit(self.wallet.pk, Decimal('30.00'), transaction_type='payment', reference_id='vm-1')
+        self.assertEqual(balance, Decimal('70.00'))
+        self.assertEqual(ledger.transaction_type, 'payment')
+        self.assertEqual(ledger.reference_id, 'vm-1')
+
+    def test_debit_ignores_stale_in_memory_balance(self):
+        stale = Wallet.objects.get(pk=self.wallet.pk)
+        self.wallet.withdraw(Decimal('80.00'))
+        # The stale copy still believes 100.00 is available, the database does not
+        with self.assertRaises(InsufficientBalance):
+            stale.withdraw(Decimal('80.00'))
+        stale.refresh_from_db()
+        self.assertEqual(stale.balance, Decimal('20.00'))
+        self.assertEqual(Transaction.objects.filter(wallet=self.wallet).count(), 1)
+
+    def test_credit_is_relative_to_stored_balance(self):
+        stale = Wallet.objects.get(pk=self.wallet.pk)
+        self.wallet.deposit(Decimal('10.00'))
+        balance, _ = Wallet.credit(stale.pk, Decimal('5.00'))
+        self.assertEqual(balance, Decimal('115.00'))
+
     def test_get_transaction_history(self):
         self.wallet.deposit(20.00)
         self.wallet.withdraw(10.00)
@@ -218,6 +242,8 @@ class PaymentGatewayTest(TestCase):
 
 class WalletViewTest(TestCase):
     def setUp(self):
+        cache.clear()
+        self.addCleanup(cache.clear)
         self.client = Client()
         self.user = User.objects.create_user(username='testuser', password='testpass')
         self.wallet = Wallet.objects.create(user=self.user, balance=100.00)
@@ -240,6 +266,54 @@ class WalletViewTest(TestCase):
         self.assertEqual(response.status_code, 200)
         self.assertTemplateUsed(response, 'wallet/history.html')
 
+    @override_settings(HISTORY_PAGE_SIZE=2)
+    def test_transaction_history_keyset_pages(self):
+        # Three rows share a timestamp so the cursor has to break ties on id
+        same_time = timezone.now()
+        created = [
+            Transaction.objects.create(wallet=self.wallet, amount=Decimal(n), transaction_type='deposit')
+            for n in range(1, 6)
+        ]
+        Transaction.objects.filter(pk__in=[t.pk for t in created[:3]]).update(timestamp=same_time)
+
+        seen = []
+        response = self.client.get(reverse('wallet:transaction_history'))
+        while True:
+            page = response.context['page']
+            seen.extend(t.pk for t in page)
+            if not page.has_next:
+                break
+            response = self.client.get(reverse('wallet:transaction_history'), {'cursor': page.next_cursor})
+
+        self.assertEqual(len(seen), 5)
+        self.assertEqual(set(seen), {t.pk for t in created})
+
+    def test_transaction_history_ignores_bad_cursor(self):
+        Transaction.objects.create(wallet=self.wallet, amount=Decimal('5.00'), transaction_type='deposit')
+        response = self.client.get(reverse('wallet:transaction_history'), {'cursor': 'not-a-cursor'})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.context['page']), 1)
+
+    @override_settings(EXPORT_CHUNK_SIZE=1)
+    def test_export_transactions_csv(self):
+        Transaction.objects.create(wallet=self.wallet, amount=Decimal('5.00'), transaction_type='deposit')
+        Transaction.objects.create(wallet=self.wallet, amount=Decimal('2.00'), transaction_type='payment')
+        response = self.client.get(reverse('wallet:export_transactions'), {'format': 'csv'})
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.streaming)
+        self.assertEqual(response['Content-Type'], 'text/csv')
+        lines = b''.join(response.streaming_content).decode().splitlines()
+        self.assertTrue(lines[0].startswith('id,timestamp,type,amount'))
+        self.assertEqual(len(lines), 3)
+
+    def test_export_transactions_json(self):
+        Transaction.objects.create(wallet=self.wallet, amount=Decimal('5.00'), transaction_type='deposit')
+        response = self.client.get(reverse('wallet:export_transactions'), {'format': 'json'})
+        self.assertEqual(response['Content-Type'], 'application/json')
+        rows = json.loads(b''.join(response.streaming_content))
+        self.assertEqual(len(rows), 1)
+        self.assertEqual(rows[0]['amount'], '5.00')
+
     @patch('wallet.views.zarinpal_gateway')
     def test_initiate_deposit_success(self, mock_gateway):
         mock_gateway.initiate_payment.return_value = {
@@ -277,6 +351,26 @@ class WalletViewTest(TestCase):
         self.assertEqual(response.status_code, 302)
         # No transaction created
 
+    def test_request_withdrawal_rate_limited(self):
+        for _ in range(2):
+            response = self.client.post(reverse('wallet:request_withdrawal'), {'amount': '10.00'})
+            self.assertEqual(response.status_code, 302)
+
+        response = self.client.post(reverse('wallet:request_withdrawal'), {'amount': '10.00'})
+        self.assertEqual(response.status_code, 429)
+        self.assertIn('Retry-After', response)
+        self.assertEqual(Transaction.objects.filter(wallet=self.wallet).count(), 2)
+
+    def test_request_withdrawal_rate_limited_per_ip(self):
+        """Test one address cannot spread withdrawals over many accounts"""
+        for n in range(6):
+            user = User.objects.create_user(username=f'ipuser{n}', password='testpass')
+            Wallet.objects.create(user=user, balance=100.00)
+            self.client.login(username=f'ipuser{n}', password='testpass')
+            response = self.client.post(reverse('wallet:request_withdrawal'), {'amount': '10.00'})
+        # 5 per address per 10 minutes
+        self.assertEqual(response.status_code, 429)
+
     @patch('wallet.views.zarinpal_gateway')
     def test_verify_payment_success(self, mock_gateway):
         transaction = Transaction.objects.create(
@@ -6,6 +6,7 @@ app_name = 'wallet'
 urlpatterns = [
     path('dashboard/', views.wallet_dashboard, name='wallet_dashboard'),
     path('history/', views.transaction_history, name='transaction_history'),
+    path('history/export/', views.export_transactions, name='export_transactions'),
     path('deposit/', views.initiate_deposit, name='initiate_deposit'),
     path('withdraw/', views.request_withdrawal, name='request_withdrawal'),
     path('verify/', views.verify_payment, name='verify_payment'),
@@ -4,27 +4,12 @@ from django.contrib import messages
 from django.http import JsonResponse
 from django.views.decorators.csrf import csrf_exempt
 from django.views.decorators.http import require_POST
-from django.core.cache import cache
-from django.http import HttpResponseForbidden
 from .models import Wallet, Transaction
 from .forms import DepositForm, WithdrawalForm
 from .payment_gateway import zarinpal_gateway
+from grandvps.pagination import keyset_page, streaming_export
+from grandvps.ratelimit import rate_limit
 import json
-import time
-
-def rate_limit(key_prefix, max_requests=5, window=60):
-    """Simple rate limiting decorator"""
-    def decorator(view_func):
-        def wrapper(request, *args, **kwargs):
-            if request.user.is_authenticated:
-                cache_key = f"{key_prefix}:{request.user.id}:{int(time.time() / window)}"
-                requests = cache.get(cache_key, 0)
-                if requests >= max_requests:
-                    return HttpResponseForbidden("Rate limit exceeded. Please try again later.")
-                cache.set(cache_key, requests + 1, window)
-            return view_func(request, *args, **kwargs)
-        return wrapper
-    return decorator
 
 @login_required
 def wallet_dashboard(request):
@@ -43,16 +28,40 @@ def wallet_dashboard(request):
 def transaction_history(request):
     """View full transaction history"""
     wallet = get_object_or_404(Wallet, user=request.user)
-    transactions = wallet.get_transaction_history()
+    page = keyset_page(wallet.transaction_set.all(), request.GET.get('cursor'), 'timestamp')
     context = {
         'wallet': wallet,
-        'transactions': transactions,
+        'transactions': page,
+        'page': page,
     }
     return render(request, 'wallet/history.html', context)
 
+TRANSACTION_EXPORT_COLUMNS = [
+    ('id', lambda t: t.id),
+    ('timestamp', lambda t: t.timestamp.isoformat()),
+    ('type', lambda t: t.transaction_type),
+    ('amount', lambda t: str(t.amount)),
+    ('status', lambda t: t.status),
+    ('description', lambda t: t.description),
+    ('reference_id', lambda t: t.reference_id or ''),
+]
+
+@login_required
+def export_transactions(request):
+    """Stream the full transaction history as CSV or JSON"""
+    wallet = get_object_or_404(Wallet, user=request.user)
+    return streaming_export(
+        wallet.transaction_set.all(),
+        'timestamp',
+        TRANSACTION_EXPORT_COLUMNS,
+        'transactions',
+        request.GET.get('format', 'csv')
+    )
+
 @login_required
 @require_POST
-@rate_limit('deposit', max_requests=3, window=300)  # 3 deposits per 5 minutes
+@rate_limit('deposit', limit=3, window=300)  # 3 deposits per 5 minutes
+@rate_limit('deposit', limit=10, window=300, key='ip')
 def initiate_deposit(request):
     """Initiate a deposit via Zarinpal payment gateway"""
     form = DepositForm(request.POST)
@@ -97,7 +106,8 @@ def initiate_deposit(request):
 
 @login_required
 @require_POST
-@rate_limit('withdrawal', max_requests=2, window=600)  # 2 withdrawals per 10 minutes
+@rate_limit('withdrawal', limit=2, window=600)  # 2 withdrawals per 10 minutes
+@rate_limit('withdrawal', limit=5, window=600, key='ip')
 def request_withdrawal(request):
     """Request a withdrawal"""
     form = WithdrawalForm(request.POST)